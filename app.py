@@ -1,6 +1,6 @@
 import streamlit as st
 from dotenv import load_dotenv
-from utils.chat import get_response
+from utils.chat import stream_response, ConversationWindow
 from utils.db_manager import save_message_to_db, initialize_database
 from constants import *
 import uuid
@@ -79,6 +79,10 @@ if "api_messages" not in st.session_state:
 if "ui_messages" not in st.session_state:
     st.session_state.ui_messages = []
 
+# context_window: keeps api_messages sent to Claude within a token budget
+if "context_window" not in st.session_state:
+    st.session_state.context_window = ConversationWindow()
+
 # Generate unique chat session ID
 if "chat_session_id" not in st.session_state:
     st.session_state.chat_session_id = str(uuid.uuid4())
@@ -108,21 +112,33 @@ if prompt := st.chat_input("Message Claude..."):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # Get response from Claude
+    # Stream response from Claude
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            response = get_response(st.session_state.api_messages, session_id=st.session_state.chat_session_id)
-            assistant_message = response["text"]
-            show_calendly = response["show_calendly"]
-
-            st.markdown(assistant_message)
-
-            # Show booking link if Claude triggered it
-            if show_calendly:
-                st.markdown(
-                    f"[📅 Book an Appointment]({CALENDLY_URL})",
-                    unsafe_allow_html=False,
-                )
+        response = {}
+
+        def stream_text():
+            for event in stream_response(
+                st.session_state.api_messages,
+                session_id=st.session_state.chat_session_id,
+                window=st.session_state.context_window,
+            ):
+                if event["type"] == "text":
+                    yield event["text"]
+                elif event["type"] == "done":
+                    response.update(event)
+
+        st.write_stream(stream_text())
+        assistant_message = response["text"]
+        # Text written before a tool call was shown too; keep the transcript as displayed
+        displayed_message = response["displayed_text"]
+        show_calendly = response["show_calendly"]
+
+        # Show booking link if Claude triggered it
+        if show_calendly:
+            st.markdown(
+                f"[📅 Book an Appointment]({CALENDLY_URL})",
+                unsafe_allow_html=False,
+            )
 
     # Add assistant response to both lists
     st.session_state.api_messages.append(
@@ -131,7 +147,7 @@ if prompt := st.chat_input("Message Claude..."):
     st.session_state.ui_messages.append(
         {
             "role": "assistant",
-            "content": assistant_message,
+            "content": displayed_message,
             "show_calendly": show_calendly,
         }
     )
@@ -139,7 +155,7 @@ if prompt := st.chat_input("Message Claude..."):
     # Save assistant message to PostgreSQL database
     save_message_to_db(
         "assistant",
-        assistant_message,
+        displayed_message,
         show_calendly,
         session_id=st.session_state.chat_session_id,
     )
@@ -1,3 +1,10 @@
 CALENDLY_API_TOKEN = "your_personal_access_token_here"
 CALENDLY_EVENT_TYPE = "https://api.calendly.com/event_types/PT_UUID"
 CALENDLY_URL = "https://book.carepatron.com/Bridgeport-Physical-Wellness/Akshaya?p=YJNjKayLRD2F4RgZGIiSxA&s=cX.x7Mcb"
+
+# Claude pricing in USD per million tokens, used for cost estimates
+MODEL_PRICING = {
+    "claude-sonnet-4-20250514": {"input": 3.00, "output": 15.00, "cache_write": 3.75, "cache_read": 0.30},
+    "claude-3-5-haiku-20241022": {"input": 0.80, "output": 4.00, "cache_write": 1.00, "cache_read": 0.08},
+}
+DEFAULT_PRICING_MODEL = "claude-sonnet-4-20250514"
@@ -1,13 +1,18 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from utils.db_manager import (
-    get_all_sessions,
-    get_all_api_calls,
+    get_session_count,
+    get_sessions_page,
+    get_daily_api_usage,
+    get_top_sessions_by_tokens,
+    get_api_calls_in_range,
     get_messages_by_session,
-    get_api_calls_by_session,
+    get_token_totals_by_sessions,
+    search_sessions,
 )
-from utils.chroma_db import ChromaDB
+from utils.chroma_db import get_chroma_db
+from constants import MODEL_PRICING, DEFAULT_PRICING_MODEL
 
 st.set_page_config(
     page_title="Management Dashboard",
@@ -17,6 +22,64 @@ st.set_page_config(
 
 st.title("📊 Management Dashboard")
 
+CONVERSATIONS_PAGE_SIZE = 25
+
+METRICS_TIME_RANGES = {
+    "Last 7 days": 7,
+    "Last 30 days": 30,
+    "Last 90 days": 90,
+    "All time": None,
+}
+
+RAW_API_CALLS_LIMIT = 500
+
+SESSION_SORT_ORDERS = {
+    "Most Recent": "recent",
+    "Oldest First": "oldest",
+    "Most Messages": "most_messages",
+}
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_session_count():
+    return get_session_count()
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_sessions_page(order, after, page_size):
+    return get_sessions_page(order, after, page_size)
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_search_results(query, page, page_size):
+    return search_sessions(query, page, page_size)
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_token_totals(session_ids):
+    return get_token_totals_by_sessions(list(session_ids))
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_daily_api_usage(start_date, end_date):
+    return get_daily_api_usage(start_date, end_date)
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_top_sessions(start_date, end_date):
+    return get_top_sessions_by_tokens(start_date, end_date)
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_api_calls(start_date, end_date, limit):
+    return get_api_calls_in_range(start_date, end_date, limit)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_transcript(session_id):
+    return get_messages_by_session(session_id)
+
+
 # Sidebar navigation
 page = st.sidebar.radio(
     "Navigation",
@@ -30,12 +93,12 @@ page = st.sidebar.radio(
 if page == "Conversations":
     st.header("💬 Conversation History")
 
-    sessions = get_all_sessions()
+    session_count = load_session_count()
 
-    if not sessions:
+    if not session_count:
         st.info("No conversations found.")
     else:
-        st.write(f"**Total Sessions:** {len(sessions)}")
+        st.write(f"**Total Sessions:** {session_count}")
 
         # Filter options
         col1, col2 = st.columns([2, 1])
@@ -47,26 +110,33 @@ if page == "Conversations":
         with col2:
             sort_order = st.selectbox(
                 "Sort by",
-                ["Most Recent", "Oldest First", "Most Messages"],
+                list(SESSION_SORT_ORDERS),
             )
 
-        # Apply sorting
-        if sort_order == "Most Recent":
-            sessions = sorted(sessions, key=lambda x: x["last_message_time"], reverse=True)
-        elif sort_order == "Oldest First":
-            sessions = sorted(sessions, key=lambda x: x["first_message_time"])
-        elif sort_order == "Most Messages":
-            sessions = sorted(sessions, key=lambda x: x["message_count"], reverse=True)
+        # Keep the cursor of every page visited so far, starting over when
+        # the sort order or search changes. Browsing uses keyset cursors;
+        # search results are ranked, so their cursor is the page number.
+        order = SESSION_SORT_ORDERS[sort_order]
+        listing = (order, search_term)
+        if st.session_state.get("conversation_listing") != listing:
+            st.session_state.conversation_listing = listing
+            st.session_state.conversation_cursors = [0 if search_term else None]
+        cursors = st.session_state.conversation_cursors
 
-        # Filter by search term
         if search_term:
-            filtered_sessions = []
-            for session in sessions:
-                for msg in session["messages"]:
-                    if search_term.lower() in msg["content"].lower():
-                        filtered_sessions.append(session)
-                        break
-            sessions = filtered_sessions
+            sessions, has_more = load_search_results(search_term, cursors[-1], CONVERSATIONS_PAGE_SIZE)
+            next_cursor = cursors[-1] + 1 if has_more else None
+            if not sessions:
+                st.info("No conversations match your search.")
+            else:
+                st.caption(
+                    "*Ranked by relevance. Use \"quotes\" for phrases and a trailing * for prefixes.*"
+                )
+        else:
+            sessions, next_cursor = load_sessions_page(order, cursors[-1], CONVERSATIONS_PAGE_SIZE)
+
+        # Token totals for every session shown, in one query
+        token_totals = load_token_totals(tuple(session["session_id"] for session in sessions))
 
         st.divider()
 
@@ -75,7 +145,6 @@ if page == "Conversations":
             session_id = session["session_id"]
             message_count = session["message_count"]
             first_time = session["first_message_time"]
-            messages = session["messages"]
 
             # Parse timestamp for display
             try:
@@ -84,38 +153,12 @@ if page == "Conversations":
             except:
                 formatted_time = first_time[:19]
 
-            # Get first user message as preview
-            first_user_msg = next(
-                (m["content"] for m in messages if m["role"] == "user"),
-                "No user message",
-            )
+            # First user message as preview
+            first_user_msg = session["preview"] or "No user message"
             preview = first_user_msg[:100] + "..." if len(first_user_msg) > 100 else first_user_msg
 
-            # Generate summary from conversation
-            def generate_summary(msgs):
-                """Generate a brief summary of the conversation."""
-                user_messages = [m["content"] for m in msgs if m["role"] == "user"]
-                assistant_messages = [m["content"] for m in msgs if m["role"] == "assistant"]
-
-                topics = []
-                # Check for common topics
-                all_content = " ".join(user_messages).lower()
-                if any(word in all_content for word in ["appointment", "book", "schedule", "calendly"]):
-                    topics.append("Appointment booking")
-                if any(word in all_content for word in ["insurance", "coverage", "plan"]):
-                    topics.append("Insurance inquiry")
-                if any(word in all_content for word in ["price", "cost", "fee", "payment"]):
-                    topics.append("Pricing questions")
-                if any(word in all_content for word in ["service", "treatment", "therapy"]):
-                    topics.append("Service information")
-                if any(word in all_content for word in ["location", "address", "hour", "open"]):
-                    topics.append("Location/Hours")
-
-                if topics:
-                    return ", ".join(topics)
-                return "General inquiry"
-
-            summary = generate_summary(messages)
+            # Topics detected in the user's messages
+            summary = ", ".join(session["topics"]) or "General inquiry"
 
             # Expandable card for each session
             with st.expander(
@@ -124,33 +167,56 @@ if page == "Conversations":
             ):
                 st.caption(f"Session ID: `{session_id}`")
 
-                # Get token usage for this session
-                api_calls = get_api_calls_by_session(session_id)
-                if api_calls:
-                    total_input = sum(c.get("input_tokens", 0) or 0 for c in api_calls)
-                    total_output = sum(c.get("output_tokens", 0) or 0 for c in api_calls)
+                # Token usage for this session
+                totals = token_totals[session_id]
+                if totals["api_call_count"]:
+                    total_input = totals["input_tokens"]
+                    total_output = totals["output_tokens"]
                     st.caption(
                         f"Token usage: {total_input:,} input / {total_output:,} output"
                     )
 
-                st.divider()
-
-                # Display messages
-                for msg in messages:
-                    role = msg["role"]
-                    content = msg["content"]
-                    show_calendly = msg.get("show_calendly", False)
-
-                    if role == "user":
-                        st.markdown(f"**🧑 User:**")
-                        st.markdown(f"> {content}")
-                    else:
-                        st.markdown(f"**🤖 Assistant:**")
-                        st.markdown(f"> {content}")
-                        if show_calendly:
-                            st.caption("📅 Calendly link was shown")
-
-                    st.write("")
+                if "snippet" in session:
+                    matches = session["match_count"]
+                    st.caption(f"{matches} matching message{'' if matches == 1 else 's'}")
+                    st.markdown(f"> {session['snippet']}")
+                else:
+                    st.caption(f"> {preview}")
+
+                # The transcript is only fetched once it is asked for
+                if st.toggle("Show transcript", key=f"transcript_{session_id}"):
+                    st.divider()
+
+                    # Display messages
+                    for msg in load_transcript(session_id):
+                        role = msg["role"]
+                        content = msg["content"]
+                        show_calendly = msg.get("show_calendly", False)
+
+                        if role == "user":
+                            st.markdown(f"**🧑 User:**")
+                            st.markdown(f"> {content}")
+                        else:
+                            st.markdown(f"**🤖 Assistant:**")
+                            st.markdown(f"> {content}")
+                            if show_calendly:
+                                st.caption("📅 Calendly link was shown")
+
+                        st.write("")
+
+        # Page navigation
+        if sessions:
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col1:
+                if st.button("← Previous", disabled=len(cursors) == 1):
+                    cursors.pop()
+                    st.rerun()
+            with col2:
+                st.caption(f"Page {len(cursors)}")
+            with col3:
+                if st.button("Next →", disabled=next_cursor is None):
+                    cursors.append(next_cursor)
+                    st.rerun()
 
 # -----------------------------------------------------------------------------
 # Token Usage Metrics Page
@@ -158,27 +224,20 @@ if page == "Conversations":
 elif page == "Token Usage Metrics":
     st.header("📈 Token Usage Metrics")
 
-    api_calls = get_all_api_calls()
+    time_range = st.selectbox("Time range", list(METRICS_TIME_RANGES), index=1)
+    days = METRICS_TIME_RANGES[time_range]
+    end_date = date.today()
+    start_date = end_date - timedelta(days=days - 1) if days else None
+
+    usage = load_daily_api_usage(start_date, end_date)
 
-    if not api_calls:
+    if not usage:
         st.info("No API call data found.")
     else:
-        # Convert to DataFrame for analysis
-        df = pd.DataFrame(api_calls)
-
-        # Handle missing columns
-        if "input_tokens" not in df.columns:
-            df["input_tokens"] = 0
-        if "output_tokens" not in df.columns:
-            df["output_tokens"] = 0
-        if "tool_used" not in df.columns:
-            df["tool_used"] = None
-        if "timestamp" not in df.columns:
-            df["timestamp"] = None
-
-        # Fill NaN values
-        df["input_tokens"] = df["input_tokens"].fillna(0).astype(int)
-        df["output_tokens"] = df["output_tokens"].fillna(0).astype(int)
+        # Daily rollup rows: one per day, tool and model
+        df = pd.DataFrame(usage)
+        df["tool_used"] = df["tool_used"].replace({"": None})
+        df["model"] = df["model"].replace({"": None})
         df["total_tokens"] = df["input_tokens"] + df["output_tokens"]
 
         # Overall metrics
@@ -188,51 +247,133 @@ elif page == "Token Usage Metrics":
         total_input = df["input_tokens"].sum()
         total_output = df["output_tokens"].sum()
         total_tokens = total_input + total_output
-        total_calls = len(df)
+        # Turns answered by the intent router or the answer cache are
+        # logged with no tokens
+        routed_turns = df.loc[df["tool_used"].isin(["router", "cache"]), "call_count"].sum()
+        total_calls = df["call_count"].sum() - routed_turns
 
         col1.metric("Total API Calls", f"{total_calls:,}")
         col2.metric("Total Input Tokens", f"{total_input:,}")
         col3.metric("Total Output Tokens", f"{total_output:,}")
         col4.metric("Total Tokens", f"{total_tokens:,}")
 
-        # Estimated cost (Claude Sonnet pricing: $3/1M input, $15/1M output)
+        if routed_turns:
+            st.caption(
+                f"*{routed_turns:,} turns answered without an API call "
+                "(intent router or answer cache)*"
+            )
+
+        # Prompt cache effectiveness (input_tokens excludes cached tokens)
+        st.subheader("Prompt Caching")
+        total_cache_write = df["cache_creation_input_tokens"].sum()
+        total_cache_read = df["cache_read_input_tokens"].sum()
+        total_prompt = total_input + total_cache_write + total_cache_read
+        cache_hit_rate = total_cache_read / total_prompt if total_prompt else 0
+        cached_calls = df["cached_calls"].sum()
+
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Cache Hit Rate", f"{cache_hit_rate:.1%}")
+        col2.metric("Cache Read Tokens", f"{total_cache_read:,}")
+        col3.metric("Cache Write Tokens", f"{total_cache_write:,}")
+        col4.metric("Calls With Cache Hits", f"{cached_calls:,}")
+
+        st.caption("*Hit rate = cache reads / all prompt tokens (uncached + cache writes + cache reads)*")
+
+        # Estimated cost, priced per model (rows logged before the model
+        # column existed are priced as Sonnet)
         st.subheader("Estimated Cost")
-        input_cost = (total_input / 1_000_000) * 3
-        output_cost = (total_output / 1_000_000) * 15
-        total_cost = input_cost + output_cost
+        df["model"] = df["model"].fillna(DEFAULT_PRICING_MODEL)
+        model_usage = df[~df["tool_used"].isin(["router", "cache"])].groupby("model").agg({
+            "input_tokens": "sum",
+            "output_tokens": "sum",
+            "cache_creation_input_tokens": "sum",
+            "cache_read_input_tokens": "sum",
+            "call_count": "sum",
+        }).rename(columns={"call_count": "calls"})
+
+        def price(model, kind):
+            pricing = MODEL_PRICING.get(model, MODEL_PRICING[DEFAULT_PRICING_MODEL])
+            return pricing[kind] / 1_000_000
+
+        model_usage["input_cost"] = [
+            row.input_tokens * price(model, "input")
+            + row.cache_creation_input_tokens * price(model, "cache_write")
+            + row.cache_read_input_tokens * price(model, "cache_read")
+            for model, row in model_usage.iterrows()
+        ]
+        model_usage["output_cost"] = [
+            row.output_tokens * price(model, "output") for model, row in model_usage.iterrows()
+        ]
+        model_usage["uncached_cost"] = [
+            (row.input_tokens + row.cache_creation_input_tokens + row.cache_read_input_tokens)
+            * price(model, "input")
+            + row.output_cost
+            for model, row in model_usage.iterrows()
+        ]
+        model_usage["total_cost"] = model_usage["input_cost"] + model_usage["output_cost"]
+
+        input_cost = model_usage["input_cost"].sum()
+        output_cost = model_usage["output_cost"].sum()
+        total_cost = model_usage["total_cost"].sum()
+        uncached_cost = model_usage["uncached_cost"].sum()
 
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4 = st.columns(4)
         col1.metric("Input Cost", f"${input_cost:.4f}")
         col2.metric("Output Cost", f"${output_cost:.4f}")
         col3.metric("Total Cost", f"${total_cost:.4f}")
+        col4.metric("Saved by Caching", f"${uncached_cost - total_cost:.4f}")
+
+        st.write("**Cost by Model**")
+        st.dataframe(
+            model_usage.reset_index()[
+                ["model", "calls", "input_tokens", "output_tokens", "total_cost"]
+            ].rename(columns={
+                "model": "Model",
+                "calls": "Calls",
+                "input_tokens": "Input Tokens",
+                "output_tokens": "Output Tokens",
+                "total_cost": "Cost ($)",
+            }),
+            use_container_width=True,
+            hide_index=True,
+        )
 
-        st.caption("*Estimated based on Claude Sonnet pricing: $3/1M input, $15/1M output*")
+        st.caption(
+            "*Estimated from per-model pricing (USD per 1M tokens): "
+            + "; ".join(
+                f"{model}: ${p['input']} input, ${p['output']} output, "
+                f"${p['cache_write']} cache writes, ${p['cache_read']} cache reads"
+                for model, p in MODEL_PRICING.items()
+            )
+            + "*"
+        )
 
         st.divider()
 
         # Token usage over time
         st.subheader("Token Usage Over Time")
-        if df["timestamp"].notna().any():
-            df["date"] = pd.to_datetime(df["timestamp"]).dt.date
-            daily_usage = df.groupby("date").agg({
-                "input_tokens": "sum",
-                "output_tokens": "sum",
-                "total_tokens": "sum",
-            }).reset_index()
-
-            st.line_chart(
-                daily_usage.set_index("date")[["input_tokens", "output_tokens"]],
-                use_container_width=True,
-            )
-        else:
-            st.info("No timestamp data available for time series.")
+        df["date"] = pd.to_datetime(df["day"]).dt.date
+        daily_usage = df.groupby("date").agg({
+            "input_tokens": "sum",
+            "output_tokens": "sum",
+            "total_tokens": "sum",
+        }).reset_index()
+
+        st.line_chart(
+            daily_usage.set_index("date")[["input_tokens", "output_tokens"]],
+            use_container_width=True,
+        )
 
         st.divider()
 
         # Tool usage breakdown
         st.subheader("Tool Usage Breakdown")
-        tool_counts = df["tool_used"].value_counts(dropna=False)
-        tool_counts.index = tool_counts.index.fillna("No tool")
+        tool_counts = (
+            df.assign(tool=df["tool_used"].fillna("No tool"))
+            .groupby("tool")["call_count"]
+            .sum()
+            .sort_values(ascending=False)
+        )
 
         col1, col2 = st.columns(2)
 
@@ -252,18 +393,12 @@ elif page == "Token Usage Metrics":
 
         # Token usage by session
         st.subheader("Token Usage by Session")
-        if "session_id" in df.columns and df["session_id"].notna().any():
-            session_usage = df.groupby("session_id").agg({
-                "input_tokens": "sum",
-                "output_tokens": "sum",
-                "total_tokens": "sum",
-            }).reset_index()
-
-            session_usage = session_usage.sort_values("total_tokens", ascending=False)
-
+        top_sessions = load_top_sessions(start_date, end_date)
+        if top_sessions:
             # Show top 10 sessions
             st.write("**Top 10 Sessions by Token Usage**")
-            top_sessions = session_usage.head(10).copy()
+            top_sessions = pd.DataFrame(top_sessions)[["session_id", "input_tokens", "output_tokens"]]
+            top_sessions["total_tokens"] = top_sessions["input_tokens"] + top_sessions["output_tokens"]
             top_sessions["session_id"] = top_sessions["session_id"].str[:8] + "..."
             st.dataframe(
                 top_sessions.rename(columns={
@@ -275,6 +410,7 @@ elif page == "Token Usage Metrics":
                 use_container_width=True,
                 hide_index=True,
             )
+            st.caption("*Sessions active in the selected range; totals cover the whole session*")
 
             # Bar chart
             st.bar_chart(
@@ -290,9 +426,11 @@ elif page == "Token Usage Metrics":
         st.subheader("Averages")
         col1, col2, col3 = st.columns(3)
 
-        avg_input = df["input_tokens"].mean()
-        avg_output = df["output_tokens"].mean()
-        avg_total = df["total_tokens"].mean()
+        # Router and cache rows carry no tokens, so average over real API calls
+        calls = max(total_calls, 1)
+        avg_input = total_input / calls
+        avg_output = total_output / calls
+        avg_total = total_tokens / calls
 
         col1.metric("Avg Input Tokens/Call", f"{avg_input:,.0f}")
         col2.metric("Avg Output Tokens/Call", f"{avg_output:,.0f}")
@@ -300,13 +438,12 @@ elif page == "Token Usage Metrics":
 
         st.divider()
 
-        # Raw data view
+        # Raw data view, fetched only when asked for
         st.subheader("Raw API Call Data")
         with st.expander("View raw data"):
-            display_df = df.copy()
-            if "timestamp" in display_df.columns:
-                display_df = display_df.sort_values("timestamp", ascending=False)
-            st.dataframe(display_df, use_container_width=True, hide_index=True)
+            if st.toggle(f"Load the latest {RAW_API_CALLS_LIMIT} API calls in this range"):
+                display_df = pd.DataFrame(load_api_calls(start_date, end_date, RAW_API_CALLS_LIMIT))
+                st.dataframe(display_df, use_container_width=True, hide_index=True)
 
 # -----------------------------------------------------------------------------
 # Edit Details Page
@@ -314,11 +451,7 @@ elif page == "Token Usage Metrics":
 elif page == "Edit Details":
     st.header("📝 Knowledge Base Management")
 
-    # Initialize ChromaDB
-    @st.cache_resource
-    def get_chroma_db():
-        return ChromaDB()
-
+    # Shared ChromaDB handle (reused across sessions and reruns)
     chroma_db = get_chroma_db()
 
     # Create tabs for different operations
@@ -330,9 +463,8 @@ elif page == "Edit Details":
     with tab1:
         st.subheader("Existing Documents")
 
-        # Refresh button
+        # Refresh button (documents are read live from the shared handle)
         if st.button("🔄 Refresh Documents", key="refresh_docs"):
-            st.cache_resource.clear()
             st.rerun()
 
         # Get all documents
@@ -373,7 +505,6 @@ elif page == "Edit Details":
                                     chroma_db.update_document(doc_id, new_content)
                                     st.session_state[edit_key] = False
                                     st.success(f"Document '{doc_id}' updated successfully!")
-                                    st.cache_resource.clear()
                                     st.rerun()
                                 else:
                                     st.error("Document content cannot be empty.")
@@ -409,7 +540,6 @@ elif page == "Edit Details":
                                     chroma_db.delete_document(doc_id)
                                     st.session_state[f"confirm_delete_{doc_id}"] = False
                                     st.success(f"Document '{doc_id}' deleted successfully!")
-                                    st.cache_resource.clear()
                                     st.rerun()
                             with col2:
                                 if st.button("No, Cancel", key=f"cancel_del_{doc_id}"):
@@ -456,5 +586,4 @@ elif page == "Edit Details":
                 else:
                     chroma_db.add_to_knowledge_base(new_doc_content, new_doc_id)
                     st.success(f"Document '{new_doc_id}' added successfully!")
-                    st.cache_resource.clear()
                     st.rerun()
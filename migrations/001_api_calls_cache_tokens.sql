@@ -0,0 +1,6 @@
+-- Prompt cache accounting for Claude API calls.
+-- input_tokens keeps its meaning (uncached input only); cached input is
+-- reported separately so cost can use cache write/read pricing.
+alter table api_calls
+    add column if not exists cache_creation_input_tokens integer not null default 0,
+    add column if not exists cache_read_input_tokens integer not null default 0;
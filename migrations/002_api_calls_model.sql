@@ -0,0 +1,13 @@
+-- Record which Claude model served each API call so cost can be priced
+-- per model. Rows written before model tiering used Sonnet, except the
+-- conversation summaries, which always used Haiku.
+alter table api_calls
+    add column if not exists model text;
+
+update api_calls
+set model = case
+        when tool_used = 'summary' then 'claude-3-5-haiku-20241022'
+        else 'claude-sonnet-4-20250514'
+    end
+where model is null
+  and tool_used is distinct from 'router';
@@ -0,0 +1,69 @@
+-- Per-session summary so the dashboard can list and count sessions without
+-- scanning messages. The app adds each flushed batch of messages and API
+-- calls through record_session_activity(); after applying this migration,
+-- fill it from existing history with:
+--     python -m utils.db_manager rebuild-sessions
+-- topics is a bit set of utils.db_manager.SESSION_TOPICS.
+create table if not exists sessions (
+    session_id text primary key,
+    first_message_at timestamptz,
+    last_message_at timestamptz,
+    message_count integer not null default 0,
+    show_calendly boolean not null default false,
+    preview text,
+    topics integer not null default 0,
+    api_call_count integer not null default 0,
+    input_tokens bigint not null default 0,
+    output_tokens bigint not null default 0,
+    cache_creation_input_tokens bigint not null default 0,
+    cache_read_input_tokens bigint not null default 0,
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists sessions_last_message_idx on sessions (last_message_at);
+create index if not exists sessions_first_message_idx on sessions (first_message_at);
+create index if not exists sessions_message_count_idx on sessions (message_count);
+
+-- Merge per-session deltas: counts and tokens add up, time bounds widen,
+-- the calendly flag and topics accumulate, and the first preview is kept.
+create or replace function record_session_activity(activity jsonb)
+returns void
+language sql
+as $$
+    insert into sessions (
+        session_id, first_message_at, last_message_at, message_count, show_calendly,
+        preview, topics, api_call_count, input_tokens, output_tokens,
+        cache_creation_input_tokens, cache_read_input_tokens
+    )
+    select
+        session_id, first_message_at, last_message_at, message_count, show_calendly,
+        preview, topics, api_call_count, input_tokens, output_tokens,
+        cache_creation_input_tokens, cache_read_input_tokens
+    from jsonb_to_recordset(activity) as a(
+        session_id text,
+        first_message_at timestamptz,
+        last_message_at timestamptz,
+        message_count integer,
+        show_calendly boolean,
+        preview text,
+        topics integer,
+        api_call_count integer,
+        input_tokens bigint,
+        output_tokens bigint,
+        cache_creation_input_tokens bigint,
+        cache_read_input_tokens bigint
+    )
+    on conflict (session_id) do update set
+        first_message_at = least(sessions.first_message_at, excluded.first_message_at),
+        last_message_at = greatest(sessions.last_message_at, excluded.last_message_at),
+        message_count = sessions.message_count + excluded.message_count,
+        show_calendly = sessions.show_calendly or excluded.show_calendly,
+        preview = coalesce(sessions.preview, excluded.preview),
+        topics = sessions.topics | excluded.topics,
+        api_call_count = sessions.api_call_count + excluded.api_call_count,
+        input_tokens = sessions.input_tokens + excluded.input_tokens,
+        output_tokens = sessions.output_tokens + excluded.output_tokens,
+        cache_creation_input_tokens = sessions.cache_creation_input_tokens + excluded.cache_creation_input_tokens,
+        cache_read_input_tokens = sessions.cache_read_input_tokens + excluded.cache_read_input_tokens,
+        updated_at = now();
+$$;
@@ -0,0 +1,29 @@
+-- Token totals for a page of sessions in one grouped query, so the
+-- Conversations page does not fetch API calls session by session.
+-- session_id is cast to text as in search_sessions (006), so the function
+-- works whether api_calls.session_id is text or uuid.
+create or replace function token_totals_by_sessions(session_ids text[])
+returns table (
+    session_id text,
+    api_call_count bigint,
+    input_tokens bigint,
+    output_tokens bigint,
+    cache_creation_input_tokens bigint,
+    cache_read_input_tokens bigint
+)
+language sql
+stable
+as $$
+    select
+        c.session_id::text,
+        count(*),
+        coalesce(sum(c.input_tokens), 0),
+        coalesce(sum(c.output_tokens), 0),
+        coalesce(sum(c.cache_creation_input_tokens), 0),
+        coalesce(sum(c.cache_read_input_tokens), 0)
+    from api_calls c
+    where c.session_id::text = any(session_ids)
+    group by c.session_id::text;
+$$;
+
+create index if not exists api_calls_session_timestamp_idx on api_calls (session_id, timestamp);
@@ -0,0 +1,71 @@
+-- Daily token usage per tool and model, so the metrics page reads a few
+-- rollup rows instead of every API call. The app adds each flushed batch
+-- of API calls through record_api_usage(); existing calls are rolled up
+-- below, and the table can be recomputed at any time with:
+--     python -m utils.db_manager rebuild-rollups
+-- Calls without a tool or model are stored under ''.
+create table if not exists api_usage_daily (
+    day date not null,
+    tool_used text not null default '',
+    model text not null default '',
+    call_count integer not null default 0,
+    cached_calls integer not null default 0,
+    input_tokens bigint not null default 0,
+    output_tokens bigint not null default 0,
+    cache_creation_input_tokens bigint not null default 0,
+    cache_read_input_tokens bigint not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (day, tool_used, model)
+);
+
+insert into api_usage_daily (
+    day, tool_used, model, call_count, cached_calls, input_tokens, output_tokens,
+    cache_creation_input_tokens, cache_read_input_tokens
+)
+select
+    "timestamp"::date, coalesce(tool_used, ''), coalesce(model, ''), count(*),
+    count(*) filter (where cache_read_input_tokens > 0), sum(input_tokens), sum(output_tokens),
+    sum(cache_creation_input_tokens), sum(cache_read_input_tokens)
+from api_calls
+group by 1, 2, 3
+on conflict (day, tool_used, model) do nothing;
+
+create or replace function record_api_usage(usage jsonb)
+returns void
+language sql
+as $$
+    insert into api_usage_daily (
+        day, tool_used, model, call_count, cached_calls, input_tokens, output_tokens,
+        cache_creation_input_tokens, cache_read_input_tokens
+    )
+    select
+        day, tool_used, model, call_count, cached_calls, input_tokens, output_tokens,
+        cache_creation_input_tokens, cache_read_input_tokens
+    from jsonb_to_recordset(usage) as u(
+        day date,
+        tool_used text,
+        model text,
+        call_count integer,
+        cached_calls integer,
+        input_tokens bigint,
+        output_tokens bigint,
+        cache_creation_input_tokens bigint,
+        cache_read_input_tokens bigint
+    )
+    on conflict (day, tool_used, model) do update set
+        call_count = api_usage_daily.call_count + excluded.call_count,
+        cached_calls = api_usage_daily.cached_calls + excluded.cached_calls,
+        input_tokens = api_usage_daily.input_tokens + excluded.input_tokens,
+        output_tokens = api_usage_daily.output_tokens + excluded.output_tokens,
+        cache_creation_input_tokens = api_usage_daily.cache_creation_input_tokens + excluded.cache_creation_input_tokens,
+        cache_read_input_tokens = api_usage_daily.cache_read_input_tokens + excluded.cache_read_input_tokens,
+        updated_at = now();
+$$;
+
+-- Per-session totals already live in the sessions summary; expose their
+-- sum so the top sessions can be ordered and limited in the database.
+alter table sessions
+    add column if not exists total_tokens bigint
+        generated always as (input_tokens + output_tokens) stored;
+
+create index if not exists sessions_total_tokens_idx on sessions (total_tokens);
@@ -0,0 +1,69 @@
+-- Full-text search over message content. search_sessions() takes a
+-- to_tsquery() string built by utils.supabase_store.tsquery() (terms
+-- ANDed, phrases as <->, prefixes as :*). It returns one page of sessions
+-- ordered by their best matching message, with a highlighted snippet.
+alter table messages
+    add column if not exists content_tsv tsvector
+        generated always as (to_tsvector('english', coalesce(content, ''))) stored;
+
+create index if not exists messages_content_tsv_idx on messages using gin (content_tsv);
+
+create or replace function search_sessions(search_query text, page_size integer default 25, page_offset integer default 0)
+returns table (
+    session_id text,
+    first_message_at timestamptz,
+    last_message_at timestamptz,
+    message_count integer,
+    show_calendly boolean,
+    preview text,
+    topics integer,
+    api_call_count integer,
+    input_tokens bigint,
+    output_tokens bigint,
+    cache_creation_input_tokens bigint,
+    cache_read_input_tokens bigint,
+    rank real,
+    match_count bigint,
+    snippet text
+)
+language sql
+stable
+as $$
+    with query as (
+        select to_tsquery('english', search_query) as q
+    ),
+    hits as (
+        select m.session_id::text as session_id, m.content, ts_rank_cd(m.content_tsv, query.q) as rank
+        from messages m, query
+        where m.content_tsv @@ query.q
+    ),
+    best as (
+        select distinct on (h.session_id)
+            h.session_id,
+            h.content,
+            h.rank,
+            count(*) over (partition by h.session_id) as match_count
+        from hits h
+        order by h.session_id, h.rank desc
+    ),
+    page as (
+        select *
+        from best
+        order by rank desc, match_count desc, session_id
+        limit page_size
+        offset page_offset
+    )
+    select
+        s.session_id, s.first_message_at, s.last_message_at, s.message_count, s.show_calendly,
+        s.preview, s.topics, s.api_call_count, s.input_tokens, s.output_tokens,
+        s.cache_creation_input_tokens, s.cache_read_input_tokens,
+        p.rank, p.match_count,
+        ts_headline(
+            'english', p.content, query.q,
+            'StartSel=**, StopSel=**, MaxWords=30, MinWords=10, MaxFragments=1'
+        ) as snippet
+    from page p
+    join sessions s on s.session_id = p.session_id
+    cross join query
+    order by p.rank desc, p.match_count desc, p.session_id;
+$$;
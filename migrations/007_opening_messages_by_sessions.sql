@@ -0,0 +1,33 @@
+-- The first messages of several sessions in one query, so the answer cache
+-- can read each session's opening question and answer without fetching
+-- messages session by session. session_id is cast to text as in
+-- token_totals_by_sessions (004).
+create or replace function opening_messages_by_sessions(session_ids text[], per_session integer default 2)
+returns table (
+    session_id text,
+    role text,
+    content text,
+    show_calendly boolean,
+    created_at timestamptz,
+    position bigint
+)
+language sql
+stable
+as $$
+    select o.session_id, o.role, o.content, o.show_calendly, o.created_at, o.position
+    from (
+        select
+            m.session_id::text as session_id,
+            m.role::text as role,
+            m.content::text as content,
+            coalesce(m.show_calendly, false) as show_calendly,
+            m.created_at::timestamptz as created_at,
+            row_number() over (partition by m.session_id order by m.created_at) as position
+        from messages m
+        where m.session_id::text = any(session_ids)
+    ) o
+    where o.position <= per_session
+    order by o.session_id, o.position;
+$$;
+
+create index if not exists messages_session_created_idx on messages (session_id, created_at);
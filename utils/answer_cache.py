@@ -0,0 +1,263 @@
+import hashlib
+import logging
+import re
+import threading
+from datetime import datetime, timezone
+
+from utils.config import get_bool_setting, get_float_setting, get_int_setting
+from utils.model_policy import is_routine_question
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Semantic answer cache for the opening question of a session: a new
+# question within FAQ_CACHE_THRESHOLD cosine similarity of a cached one
+# gets the cached answer without calling Claude
+FAQ_CACHE = get_bool_setting("FAQ_CACHE", True)
+FAQ_CACHE_THRESHOLD = get_float_setting("FAQ_CACHE_THRESHOLD", 0.9)
+FAQ_CACHE_WARM_LIMIT = get_int_setting("FAQ_CACHE_WARM_LIMIT", 1000)
+FAQ_CACHE_COLLECTION = "faq-answers"
+
+MIN_ANSWER_CHARS = 40
+MAX_ANSWER_CHARS = 1500
+
+# Answers that admit a miss or apologise are not worth repeating
+WEAK_ANSWER_PATTERN = re.compile(
+    r"\b(sorry|apologi[sz]e|couldn't find|could not find|don't have (that|any|specific)|"
+    r"do not have (that|any|specific)|unable to|not sure)\b",
+    re.IGNORECASE,
+)
+
+# Answers written for one patient or leaning on earlier turns do not stand
+# alone: references back to the conversation, the patient's own condition,
+# or a greeting by name
+CONTEXTUAL_ANSWER_PATTERN = re.compile(
+    r"\b(you (mentioned|said|told me|described|noted)|as (i|we) (said|mentioned)|"
+    r"(mentioned|said|discussed) (earlier|before|above)|earlier|previously|"
+    r"in your case|for you specifically|sorry to hear|"
+    r"your (knee|back|shoulder|neck|hip|ankle|wrist|elbow|foot|leg|arm|pain|injury|"
+    r"surgery|condition|symptoms|diagnosis|recovery|situation|case))\b",
+    re.IGNORECASE,
+)
+GREETING_BY_NAME_PATTERN = re.compile(r"^\s*(?i:hi|hello|hey|dear)\s+(?!There\b|Again\b)[A-Z][a-z]+\b")
+
+UNVERSIONED = "unversioned"
+
+
+def _as_utc(value):
+    """Parse an ISO timestamp as an aware UTC datetime; naive values are local time."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).astimezone(timezone.utc)
+    except ValueError:
+        logger.warning(f"Ignoring unparseable timestamp: {value}")
+        return None
+
+
+def _normalize_question(text):
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+
+def is_cacheable_question(text):
+    """True for a standalone routine question (hours, insurance, parking...)."""
+    return bool(text) and is_routine_question(text)
+
+
+def is_good_answer(text, show_calendly=False):
+    """True for an answer worth serving again to other patients.
+
+    Misses, apologies and answers that address one patient personally or
+    depend on earlier turns are left out.
+    """
+    return (
+        not show_calendly
+        and MIN_ANSWER_CHARS <= len(text or "") <= MAX_ANSWER_CHARS
+        and not WEAK_ANSWER_PATTERN.search(text)
+        and not CONTEXTUAL_ANSWER_PATTERN.search(text)
+        and not GREETING_BY_NAME_PATTERN.search(text)
+    )
+
+
+class AnswerCache:
+    """Question -> answer cache stored in a vector collection next to the KB.
+
+    Each entry records the KB version it was answered against, and lookups
+    only match entries from the current version, so editing the knowledge
+    base (including from the dashboard) retires every cached answer. When a
+    new version is first seen the cache is refilled in the background from
+    past sessions whose opening answer was given after the last KB edit.
+    """
+
+    def __init__(self, chroma_db=None):
+        if chroma_db is None:
+            from utils.chroma_db import get_chroma_db
+
+            chroma_db = get_chroma_db()
+        self.chroma_db = chroma_db
+        self._collection = None
+        self._collection_generation = None
+        self._lock = threading.Lock()
+        self._warmed_versions = set()
+
+    @property
+    def collection(self):
+        # Re-fetch the handle after the KB client reconnects
+        with self._lock:
+            if self._collection is None or self._collection_generation != self.chroma_db._generation:
+                self._collection = self.chroma_db.get_client().get_or_create_collection(
+                    name=FAQ_CACHE_COLLECTION, metadata={"hnsw:space": "cosine"}
+                )
+                self._collection_generation = self.chroma_db._generation
+            return self._collection
+
+    def _version(self):
+        return self.chroma_db.get_kb_version() or UNVERSIONED
+
+    def lookup(self, question):
+        """Return the cached answer for a near-duplicate question, if any.
+
+        Returns:
+            {"answer", "question", "similarity"} or None
+        """
+        version = self._version()
+        self._warm_in_background(version)
+
+        result = self.collection.query(
+            query_texts=[_normalize_question(question)],
+            n_results=1,
+            where={"kb_version": version},
+        )
+        ids = (result.get("ids") or [[]])[0]
+        if not ids:
+            return None
+
+        similarity = 1.0 - result["distances"][0][0]
+        metadata = result["metadatas"][0][0] or {}
+        if similarity < FAQ_CACHE_THRESHOLD:
+            logger.debug(f"Closest cached question too far ({similarity:.3f}): {metadata.get('question')}")
+            return None
+
+        return {
+            "answer": metadata.get("answer", ""),
+            "question": metadata.get("question", ""),
+            "similarity": similarity,
+        }
+
+    def store(self, question, answer, version=None):
+        """Cache an answer to a question under the current (or given) KB version."""
+        version = version or self._version()
+        normalized = _normalize_question(question)
+        entry_id = hashlib.sha1(f"{version}:{normalized}".encode("utf-8")).hexdigest()
+        self.collection.upsert(
+            ids=[entry_id],
+            documents=[normalized],
+            metadatas=[
+                {
+                    "question": question,
+                    "answer": answer,
+                    "kb_version": version,
+                    "cached_at": datetime.now(timezone.utc).isoformat(),
+                }
+            ],
+        )
+
+    def warm(self, version=None, limit=FAQ_CACHE_WARM_LIMIT):
+        """Fill the cache from the opening question and answer of past sessions.
+
+        Sessions are read from the sessions summary, most recent first, and
+        their first two messages are fetched in one query, so a session is
+        never cut off part way through. Only answers given after the last KB
+        edit (compared as UTC) are used, and only when the question is
+        routine and the answer passes is_good_answer; for repeated questions
+        the most recent answer wins.
+
+        Args:
+            limit: Maximum number of recent sessions to read
+
+        Returns:
+            Number of answers cached
+        """
+        from utils.db_manager import get_opening_messages, get_sessions_page
+
+        version = version or self._version()
+        updated_at = _as_utc(self.chroma_db.kb_updated_at)
+
+        # Retire entries from older KB versions
+        self.collection.delete(where={"kb_version": {"$ne": version}})
+
+        # The preview is the opening question, so most sessions are skipped
+        # without fetching their messages
+        candidates = []
+        read = 0
+        cursor = None
+        while read < limit:
+            sessions, cursor = get_sessions_page("recent", after=cursor, page_size=min(limit - read, 200))
+            read += len(sessions)
+            candidates.extend(
+                session["session_id"]
+                for session in sessions
+                if session["message_count"] >= 2 and is_cacheable_question(session["preview"])
+            )
+
+            # Later pages only hold sessions last active before the KB edit
+            last_active = _as_utc(sessions[-1]["last_message_time"]) if sessions else None
+            if cursor is None or (updated_at and last_active and last_active < updated_at):
+                break
+
+        pairs = {}
+        for messages in get_opening_messages(candidates).values():
+            if len(messages) < 2 or messages[0]["role"] != "user" or messages[1]["role"] != "assistant":
+                continue
+            question, answer = messages[:2]
+            answered_at = _as_utc(answer.get("created_at"))
+            if updated_at and (answered_at is None or answered_at < updated_at):
+                continue
+            if not is_cacheable_question(question["content"]):
+                continue
+            if not is_good_answer(answer["content"], answer.get("show_calendly")):
+                continue
+            key = _normalize_question(question["content"])
+            if key not in pairs or answered_at > pairs[key][2]:
+                pairs[key] = (question, answer, answered_at)
+
+        for question, answer, _ in pairs.values():
+            self.store(question["content"], answer["content"], version)
+
+        logger.info(f"Answer cache warmed with {len(pairs)} answers for KB version {version}")
+        return len(pairs)
+
+    def _warm_in_background(self, version):
+        with self._lock:
+            if version in self._warmed_versions:
+                return
+            self._warmed_versions.add(version)
+
+        def run():
+            try:
+                self.warm(version)
+            except Exception as e:
+                logger.error(f"Could not warm answer cache: {e}")
+
+        threading.Thread(target=run, name="answer-cache-warm", daemon=True).start()
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Return the process-wide answer cache."""
+    global _answer_cache
+
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = AnswerCache()
+
+    return _answer_cache
+
+
+if __name__ == "__main__":
+    cache = get_answer_cache()
+    print(f"cached answers: {cache.warm()}")
@@ -0,0 +1,210 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import uuid
+from collections import Counter
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does",
+    "for", "from", "how", "i", "if", "in", "is", "it", "me", "my", "of",
+    "on", "or", "our", "the", "to", "we", "what", "when", "where", "which",
+    "who", "with", "you", "your",
+}
+
+
+def tokenize(text):
+    """Lowercase text and split it into index terms, dropping stopwords."""
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOPWORDS
+    ]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse several ranked ID lists into one.
+
+    Each ID scores sum(1 / (k + rank)) over the lists it appears in, so IDs
+    ranked well by either retriever rise to the top.
+
+    Args:
+        rankings: Iterable of ID lists, best first
+        k: Damping constant; 60 is the usual choice
+
+    Returns:
+        List of IDs ordered by fused score
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class BM25Index:
+    """A compact on-disk inverted index with Okapi BM25 scoring.
+
+    The index is a JSON file holding per-document term frequencies, the
+    document texts and the KB version it was built from. It is updated in
+    place when documents change and reloaded if another process rewrites it.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        self.version = None
+        self._lock = threading.RLock()
+        self._loaded_stat = None
+        self._term_freqs = {}
+        self._documents = {}
+        self._postings = {}
+        self._lengths = {}
+        self._total_length = 0
+        self._reload_if_changed()
+
+    @property
+    def exists(self):
+        return self.path.exists()
+
+    def __len__(self):
+        return len(self._term_freqs)
+
+    def _reload_if_changed(self):
+        try:
+            stat = os.stat(self.path)
+            current = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            return
+
+        if current == self._loaded_stat:
+            return
+
+        with self._lock:
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logging.error(f"Could not load BM25 index {self.path}: {e}")
+                return
+
+            self.version = data.get("version")
+            self._documents = data.get("documents", {})
+            self._term_freqs = {}
+            self._postings = {}
+            self._lengths = {}
+            self._total_length = 0
+            for doc_id, freqs in data.get("term_freqs", {}).items():
+                self._index_document(doc_id, freqs)
+            self._loaded_stat = current
+
+    def _index_document(self, doc_id, freqs):
+        self._term_freqs[doc_id] = freqs
+        self._lengths[doc_id] = sum(freqs.values())
+        self._total_length += self._lengths[doc_id]
+        for term, count in freqs.items():
+            self._postings.setdefault(term, {})[doc_id] = count
+
+    def _unindex_document(self, doc_id):
+        freqs = self._term_freqs.pop(doc_id, None)
+        self._documents.pop(doc_id, None)
+        if freqs is None:
+            return
+        self._total_length -= self._lengths.pop(doc_id)
+        for term in freqs:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def save(self):
+        """Atomically write the index to disk."""
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {
+                        "version": self.version,
+                        "documents": self._documents,
+                        "term_freqs": self._term_freqs,
+                    },
+                    f,
+                )
+            os.replace(tmp_path, self.path)
+            stat = os.stat(self.path)
+            self._loaded_stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def rebuild(self, documents, version=None):
+        """Replace the whole index with documents ({"id", "content"} dicts)."""
+        with self._lock:
+            self._term_freqs = {}
+            self._documents = {}
+            self._postings = {}
+            self._lengths = {}
+            self._total_length = 0
+            self._apply_upsert(
+                [doc["id"] for doc in documents],
+                [doc["content"] for doc in documents],
+            )
+            self.version = version
+            self.save()
+            logging.info(f"BM25 index rebuilt with {len(documents)} documents")
+
+    def upsert(self, ids, documents, version=None):
+        """Add or replace documents and save the index."""
+        with self._lock:
+            self._reload_if_changed()
+            self._apply_upsert(ids, documents)
+            self.version = version
+            self.save()
+
+    def _apply_upsert(self, ids, documents):
+        for doc_id, text in zip(ids, documents):
+            self._unindex_document(doc_id)
+            self._documents[doc_id] = text
+            self._index_document(doc_id, dict(Counter(tokenize(text or ""))))
+
+    def remove(self, ids, version=None):
+        """Remove documents and save the index."""
+        with self._lock:
+            self._reload_if_changed()
+            for doc_id in ids:
+                self._unindex_document(doc_id)
+            self.version = version
+            self.save()
+
+    def get_document(self, doc_id):
+        return self._documents.get(doc_id)
+
+    def search(self, query, n_results=10):
+        """Return up to n_results (doc_id, score) pairs, best first."""
+        self._reload_if_changed()
+        with self._lock:
+            count = len(self._term_freqs)
+            if not count:
+                return []
+
+            avg_length = self._total_length / count
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, freq in postings.items():
+                    length = self._lengths[doc_id]
+                    norm = freq + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (self.k1 + 1) / norm
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:n_results]
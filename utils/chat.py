@@ -1,7 +1,21 @@
 import anthropic
+import hashlib
+import json
+import logging
+import re
 import streamlit as st
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from utils.config import get_bool_setting, get_float_setting, get_int_setting, get_setting
+from utils.answer_cache import FAQ_CACHE, get_answer_cache, is_cacheable_question, is_good_answer
+from utils.bm25_index import tokenize
 from utils.db_manager import save_api_call
+from utils.intent_router import BOOKING, INTENT_ROUTER, RESPONSES, get_intent_router
+from utils.model_policy import LARGE, MODEL_TIERS, choose_tier, is_routine_question
+
+logger = logging.getLogger(__name__)
 
 # Try st.secrets first (Streamlit Cloud), fall back to os.getenv (local)
 api_key = st.secrets.get("ANTHROPIC_API_KEY") or os.getenv("ANTHROPIC_API_KEY")
@@ -58,110 +72,928 @@ IMPORTANT RULES:
 Be conversational, helpful, and focused on patient care."""
 
 
-def get_response(messages: list[dict], session_id: str = None) -> dict:
-    """Send messages to Claude and return response with optional tool calls."""
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=4096,
-        system=SYSTEM_PROMPT,
-        tools=TOOLS,
-        messages=messages,
+# Model and max_tokens come from the tier chosen per call (see utils.model_policy)
+
+# Prompt caching: the tools and system prompt (~650 tokens) are below the
+# minimum prompt length Anthropic caches, so a breakpoint on them alone
+# does nothing. The breakpoint goes on the conversation so far instead,
+# caching tools, system prompt and history together so the next turn
+# only pays for new text; in KB-in-context mode the KB block carries one.
+CACHE_CONTROL = {"type": "ephemeral"}
+PROMPT_CACHE_HISTORY = get_bool_setting("PROMPT_CACHE_HISTORY", True)
+
+# Passages returned per knowledge base lookup (hybrid retrieval keeps this small)
+KB_N_RESULTS = get_int_setting("KB_N_RESULTS", 3)
+
+# Conversation window: history sent to Claude is kept under this many
+# (estimated) tokens; older turns are folded into a rolling summary
+CONTEXT_TOKEN_BUDGET = get_int_setting("CONTEXT_TOKEN_BUDGET", 8000)
+SUMMARY_MODEL = "claude-3-5-haiku-20241022"
+SUMMARY_MAX_TOKENS = 400
+
+# KB tool results from turns older than this many completed turns are
+# replaced by a short reference once they have been answered
+TOOL_RESULT_KEEP_TURNS = get_int_setting("TOOL_RESULT_KEEP_TURNS", 1)
+
+# Agent loop: model calls per turn, and the pool that runs tool calls from
+# one assistant message concurrently
+MAX_AGENT_ITERATIONS = get_int_setting("MAX_AGENT_ITERATIONS", 4)
+TOOL_WORKERS = get_int_setting("TOOL_WORKERS", 4)
+TOOL_TIMEOUT = get_float_setting("TOOL_TIMEOUT", 20.0)
+
+# KB prefetch: look up the raw user message while the first model call runs.
+# "speculative" reuses the result if the model asks for a similar query,
+# "inject" also puts it into the first call for routine questions, "off"
+# disables it
+KB_PREFETCH = get_setting("KB_PREFETCH", "speculative").lower()
+KB_PREFETCH_MIN_OVERLAP = get_float_setting("KB_PREFETCH_MIN_OVERLAP", 0.5)
+
+# KB-in-context mode: the whole knowledge base goes into a cached system
+# block and get_information_about_me is not offered; if the KB grows past
+# KB_CONTEXT_MAX_TOKENS the tool-based retrieval is used instead
+KB_IN_CONTEXT = get_bool_setting("KB_IN_CONTEXT", False)
+KB_CONTEXT_MAX_TOKENS = get_int_setting("KB_CONTEXT_MAX_TOKENS", 20000)
+
+SYSTEM_BLOCKS = [{"type": "text", "text": SYSTEM_PROMPT}]
+KB_CONTEXT_TOOLS = [tool for tool in TOOLS if tool["name"] == "show_calendly"]
+
+
+def get_response(
+    messages: list[dict], session_id: str = None, window: "ConversationWindow" = None
+) -> dict:
+    """Send messages to Claude and return response with optional tool calls.
+
+    If a ConversationWindow is given, only the part of messages that fits its
+    token budget is sent, preceded by a summary of the older turns.
+    """
+    result = {}
+    for event in _run_turn(messages, session_id, stream=False, window=window):
+        if event["type"] == "done":
+            result = event
+
+    return {
+        "text": result["text"],
+        "displayed_text": result["displayed_text"],
+        "show_calendly": result["show_calendly"],
+        "query_kb": result["query_kb"],
+        "tokens_saved": result["tokens_saved"],
+        "intent": result["intent"],
+        "cached": result["cached"],
+        "prefetch": result["prefetch"],
+    }
+
+
+def stream_response(
+    messages: list[dict], session_id: str = None, window: "ConversationWindow" = None
+):
+    """Stream Claude's reply as a sequence of events.
+
+    Yields dictionaries with a "type" key:
+        text: {"text": <delta>} as soon as Claude produces it
+        tool_use: {"id", "name", "input"} for each tool Claude calls
+        done: {"text", "displayed_text", "show_calendly", "query_kb", "tokens_saved",
+            "intent", "cached", "prefetch"} once the turn is complete (text: the
+            final answer, for the model history; displayed_text: everything
+            streamed, including text written before a tool call; tokens_saved:
+            estimated tokens removed from the history by compaction this turn; intent:
+            set when the intent router answered without calling Claude;
+            cached: True when the answer came from the answer cache;
+            prefetch: {"outcome", "saved_ms"} when a KB prefetch ran)
+
+    The follow-up call after get_information_about_me is streamed too.
+    """
+    yield from _run_turn(messages, session_id, stream=True, window=window)
+
+
+def _block_to_dict(block) -> dict:
+    """Convert an SDK content block to a plain dict."""
+    if isinstance(block, dict):
+        return dict(block)
+    return block.model_dump(exclude_none=True)
+
+
+def _with_history_breakpoint(messages: list[dict]) -> list[dict]:
+    """Return a copy of messages with a cache breakpoint on the last block.
+
+    The caller's list is left untouched so breakpoints never pile up in the
+    stored conversation (the API allows at most four per request).
+    """
+    if not messages:
+        return messages
+
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content}]
+    else:
+        blocks = [_block_to_dict(block) for block in content]
+
+    if not blocks:
+        return messages
+
+    blocks[-1] = {**blocks[-1], "cache_control": CACHE_CONTROL}
+    return messages[:-1] + [{"role": last["role"], "content": blocks}]
+
+
+def _call_claude(
+    messages: list[dict],
+    stream: bool,
+    system: list[dict] = None,
+    tool_choice: dict = None,
+    tier: str = LARGE,
+    tools: list[dict] = None,
+):
+    """Call Claude on the given model tier, yielding text events, and return the final message."""
+    if PROMPT_CACHE_HISTORY:
+        messages = _with_history_breakpoint(messages)
+
+    kwargs = {
+        "model": MODEL_TIERS[tier]["model"],
+        "max_tokens": MODEL_TIERS[tier]["max_tokens"],
+        "system": system or SYSTEM_BLOCKS,
+        "tools": tools or TOOLS,
+        "messages": messages,
+    }
+    if tool_choice:
+        kwargs["tool_choice"] = tool_choice
+
+    if not stream:
+        response = client.messages.create(**kwargs)
+        for block in response.content:
+            if block.type == "text":
+                yield {"type": "text", "text": block.text}
+        return response
+
+    with client.messages.stream(**kwargs) as response_stream:
+        for text in response_stream.text_stream:
+            yield {"type": "text", "text": text}
+        return response_stream.get_final_message()
+
+
+def _response_text(response) -> str:
+    return "".join(block.text for block in response.content if block.type == "text")
+
+
+def _log_api_call(response, tool_used: str, session_id: str):
+    """Log a response's token usage, including prompt cache reads and writes."""
+    usage = response.usage
+    save_api_call(
+        input_tokens=usage.input_tokens,
+        output_tokens=usage.output_tokens,
+        tool_used=tool_used,
+        session_id=session_id,
+        cache_creation_input_tokens=getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        cache_read_input_tokens=getattr(usage, "cache_read_input_tokens", 0) or 0,
+        model=getattr(response, "model", None),
     )
 
-    # Check if Claude wants to use a tool
+
+def _request_context(messages: list[dict], window, session_id: str, system: list[dict] = None):
+    """Return the (messages, system) pair to send for the current history."""
+    system = system or SYSTEM_BLOCKS
+    if window is None:
+        return messages, system
+    return window.prepare(messages, session_id), window.system_blocks(system)
+
+
+_kb_context_lock = threading.Lock()
+_kb_context = {"version": None, "system": None}
+
+
+def knowledge_base_system_blocks():
+    """Return system blocks carrying the whole KB, or None to use the KB tool.
+
+    The blocks are built once per KB version: an edit (in this process or
+    from the dashboard, picked up with the KB version check) rebuilds them
+    on the next turn. None is returned when KB_IN_CONTEXT is off, the KB
+    is larger than KB_CONTEXT_MAX_TOKENS, or it cannot be read.
+    """
+    if not KB_IN_CONTEXT:
+        return None
+
+    from utils.chroma_db import get_chroma_db
+
+    try:
+        chroma_db = get_chroma_db()
+        version = chroma_db.get_kb_version()
+        with _kb_context_lock:
+            if _kb_context["system"] is not None and _kb_context["version"] == version:
+                return _kb_context["system"] or None
+
+            documents = [doc["content"] for doc in chroma_db.get_all_documents() if doc["content"]]
+            knowledge = "\n\n".join(documents)
+            tokens = _estimate_tokens(knowledge)
+            if not documents or tokens > KB_CONTEXT_MAX_TOKENS:
+                logger.info(
+                    f"Knowledge base is ~{tokens} tokens (limit {KB_CONTEXT_MAX_TOKENS}), "
+                    "using the retrieval tool"
+                )
+                system = []
+            else:
+                system = [
+                    {"type": "text", "text": SYSTEM_PROMPT},
+                    {
+                        "type": "text",
+                        "text": (
+                            "Clinic knowledge base. Answer questions about the business, "
+                            f"insurance and policies from it:\n\n{knowledge}"
+                        ),
+                        "cache_control": CACHE_CONTROL,
+                    },
+                ]
+                logger.info(f"Knowledge base (~{tokens} tokens) loaded into the system prompt")
+
+            _kb_context.update(version=version, system=system)
+            return system or None
+    except Exception as e:
+        logger.error(f"Could not load the knowledge base into context, using the retrieval tool: {e}")
+        return None
+
+
+def _show_calendly(tool_input: dict) -> str:
+    return "Booking link displayed to the user."
+
+
+def _lookup_information(tool_input: dict) -> list[str]:
+    return get_information_about_me(tool_input.get("query", "")) or []
+
+
+# Tool name -> handler(tool_input). Handlers run on the tool thread pool, so
+# they must not touch Streamlit state.
+TOOL_HANDLERS = {
+    "show_calendly": _show_calendly,
+    "get_information_about_me": _lookup_information,
+}
+
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="chat-tool")
+
+# KB prefetches get their own pool: a tool handler reusing a prefetch waits
+# on it, so the prefetch must never sit queued behind tool handlers
+_prefetch_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="chat-prefetch")
+
+# Answer cache writes are off the critical path and done one at a time
+_cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-cache")
+
+
+def _timed_call(handler, tool_input: dict):
+    start = time.perf_counter()
+    result = handler(tool_input)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _execute_tools(
+    tool_blocks: list, messages: list[dict], overrides: dict = None
+) -> tuple[list[dict], dict]:
+    """Run the tool calls from one assistant message, concurrently if several.
+
+    Args:
+        tool_blocks: tool_use blocks from the assistant message
+        messages: Conversation so far (used to dedupe KB passages)
+        overrides: {tool_use_id: handler} replacing the registered handler
+            for specific calls (e.g. to reuse a prefetched result)
+
+    Returns:
+        Tuple of (tool_result blocks in tool_use order, {tool_use_id: ms})
+    """
+    overrides = overrides or {}
+    handlers = {
+        block.id: overrides.get(block.id) or TOOL_HANDLERS.get(block.name) for block in tool_blocks
+    }
+
+    outcomes = {}
+    if len(tool_blocks) == 1:
+        block = tool_blocks[0]
+        handler = handlers[block.id]
+        try:
+            outcomes[block.id] = _timed_call(handler, block.input) if handler else None
+        except Exception as e:
+            outcomes[block.id] = e
+    else:
+        futures = {
+            block.id: _tool_executor.submit(_timed_call, handlers[block.id], block.input)
+            for block in tool_blocks
+            if handlers[block.id]
+        }
+        # One deadline for the whole batch, not TOOL_TIMEOUT per tool
+        wait(futures.values(), timeout=TOOL_TIMEOUT)
+        for block in tool_blocks:
+            future = futures.get(block.id)
+            if future is None:
+                outcomes[block.id] = None
+            elif not future.done():
+                future.cancel()
+                outcomes[block.id] = TimeoutError(f"no result after {TOOL_TIMEOUT:g}s")
+            else:
+                try:
+                    outcomes[block.id] = future.result()
+                except Exception as e:
+                    outcomes[block.id] = e
+
+    tool_results = []
+    timings = {}
+    for block in tool_blocks:
+        outcome = outcomes[block.id]
+        if outcome is None or isinstance(outcome, Exception):
+            error = (
+                f"Unknown tool: {block.name}"
+                if outcome is None
+                else f"{block.name} failed: {outcome or type(outcome).__name__}"
+            )
+            logger.error(error)
+            tool_results.append(
+                {"type": "tool_result", "tool_use_id": block.id, "content": error, "is_error": True}
+            )
+            continue
+
+        result, timings[block.id] = outcome
+        if block.name == "get_information_about_me":
+            # Dedupe against the history and the results gathered so far
+            seen = messages + [{"role": "user", "content": tool_results}]
+            tool_results.append(_kb_tool_result(block.id, result, seen))
+        else:
+            content = result if isinstance(result, str) else json.dumps(result)
+            tool_results.append({"type": "tool_result", "tool_use_id": block.id, "content": content})
+
+    return tool_results, timings
+
+
+_prefetch_lock = threading.Lock()
+_prefetch_stats = {"prefetches": 0, "used": 0, "injected": 0, "wasted": 0, "saved_ms": 0.0}
+
+
+def get_prefetch_stats() -> dict:
+    """Return process-wide KB prefetch counters (saved_ms: KB latency taken off the critical path)."""
+    with _prefetch_lock:
+        return dict(_prefetch_stats)
+
+
+class KBPrefetch:
+    """A knowledge base lookup for the raw user message, started before the model asks for it."""
+
+    def __init__(self, query: str):
+        self.query = query
+        self.terms = set(tokenize(query))
+        self.started = time.perf_counter()
+        self.finished = None
+        self.used = False
+        self.injected = False
+        self.saved_ms = 0.0
+        self.future = _prefetch_executor.submit(self._lookup)
+
+    def _lookup(self):
+        try:
+            return get_information_about_me(self.query) or []
+        finally:
+            self.finished = time.perf_counter()
+
+    def matches(self, query: str) -> bool:
+        """True if query shares enough terms with the prefetched one to reuse its result."""
+        terms = set(tokenize(query))
+        if not terms or not self.terms:
+            return False
+        return len(terms & self.terms) / min(len(terms), len(self.terms)) >= KB_PREFETCH_MIN_OVERLAP
+
+    def passages(self) -> list[str]:
+        return self.future.result(timeout=TOOL_TIMEOUT)
+
+    def reuse(self, tool_input: dict) -> list[str]:
+        """Return the prefetched passages in place of a new lookup."""
+        requested = time.perf_counter()
+        try:
+            passages = self.passages()
+        except Exception as e:
+            logger.warning(f"KB prefetch failed, looking up again: {e}")
+            return _lookup_information(tool_input)
+        waited = time.perf_counter() - requested
+        self.used = True
+        self.saved_ms = max(0.0, (self.finished - self.started - waited) * 1000)
+        return passages
+
+    def report(self, session_id: str) -> dict:
+        """Record the outcome in the process-wide counters and log it."""
+        outcome = "used" if self.used else "injected" if self.injected else "wasted"
+        with _prefetch_lock:
+            _prefetch_stats["prefetches"] += 1
+            _prefetch_stats[outcome] += 1
+            _prefetch_stats["saved_ms"] += self.saved_ms
+        if outcome == "injected":
+            detail = "answered from the injected passages, no KB tool round trip"
+        elif outcome == "used":
+            detail = f"saved {self.saved_ms:.0f} ms of KB latency"
+        else:
+            detail = "model did not ask for a matching KB lookup"
+        logger.info(f"KB prefetch {outcome}: {detail} (session: {session_id})")
+        return {"outcome": outcome, "saved_ms": self.saved_ms}
+
+
+def _with_prefetched_passages(messages: list[dict], passages: list[str]) -> list[dict]:
+    """Return a copy of messages with KB passages prepended to the last user message."""
+    if not passages:
+        return messages
+    last = messages[-1]
+    context = "Knowledge base passages that may help answer this message:\n\n" + "\n\n---\n\n".join(passages)
+    return messages[:-1] + [
+        {
+            "role": last["role"],
+            "content": [{"type": "text", "text": context}] + _message_blocks(last),
+        }
+    ]
+
+
+def _separated(call, separator: str):
+    """Relay a _call_claude generator, emitting separator before its first text."""
+    while True:
+        try:
+            event = next(call)
+        except StopIteration as stop:
+            return stop.value
+        if separator and event["type"] == "text" and event["text"]:
+            yield {"type": "text", "text": separator}
+            separator = ""
+        yield event
+
+
+def _run_turn(messages: list[dict], session_id: str, stream: bool, window=None):
+    """Run one chat turn as an agent loop, yielding text, tool_use and done events.
+
+    Claude is called until it answers without requesting a tool, at most
+    MAX_AGENT_ITERATIONS times; the last call has tools disabled so the
+    turn always ends with an answer. Tool calls from the same assistant
+    message run in parallel.
+    """
     show_calendly = False
     query_kb = False
-    text_response = ""
-    tool_used = None
-
-    for block in response.content:
-        if block.type == "tool_use" and block.name == "show_calendly":
-            show_calendly = True
-            tool_used = "show_calendly"
-        elif (
-            block.type == "tool_use"
-            and block.name == "get_information_about_me"
-        ):
-            query_kb = True
-            tool_used = "get_information_about_me"
-            # Execute the KB query and send result back to Claude
-            tool_id = block.id
-            query = block.input.get("query", "")
-            kb_result = get_information_about_me([query])
-
-            # Add assistant's tool use and tool result to messages
-            messages.append({"role": "assistant", "content": response.content})
-            messages.append(
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "tool_result",
-                            "tool_use_id": tool_id,
-                            "content": str(kb_result),
-                        }
-                    ],
-                }
-            )
+    text = ""
+    displayed = []
+    tool_calls = []
+
+    route = get_intent_router().route(messages) if INTENT_ROUTER else None
+    if route is not None:
+        logger.info(
+            f"Answered locally as {route['intent']} "
+            f"(confidence {route['confidence']:.2f}, session: {session_id})"
+        )
+        save_api_call(input_tokens=0, output_tokens=0, tool_used="router", session_id=session_id)
+        yield {"type": "text", "text": route["text"]}
+        yield {
+            "type": "done",
+            "text": route["text"],
+            "displayed_text": route["text"],
+            "show_calendly": route["show_calendly"],
+            "query_kb": False,
+            "tokens_saved": 0,
+            "intent": route["intent"],
+            "cached": False,
+            "prefetch": None,
+        }
+        return
 
-            # Log the first API call (with tool use)
-            save_api_call(
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                tool_used=tool_used,
-                session_id=session_id,
+    # The opening question of a session does not depend on earlier context,
+    # so a near-duplicate answered before can be served from the answer cache
+    question = _opening_question(messages) if FAQ_CACHE else None
+    if question is not None and not is_cacheable_question(question):
+        question = None
+    if question is not None:
+        try:
+            hit = get_answer_cache().lookup(question)
+        except Exception as e:
+            logger.error(f"Answer cache lookup failed: {e}")
+            hit, question = None, None
+        if hit is not None:
+            logger.info(
+                f"Answer cache hit (similarity {hit['similarity']:.3f}) for {question!r} "
+                f"matching {hit['question']!r} (session: {session_id})"
             )
+            save_api_call(input_tokens=0, output_tokens=0, tool_used="cache", session_id=session_id)
+            yield {"type": "text", "text": hit["answer"]}
+            yield {
+                "type": "done",
+                "text": hit["answer"],
+                "displayed_text": hit["answer"],
+                "show_calendly": False,
+                "query_kb": False,
+                "tokens_saved": 0,
+                "intent": None,
+                "cached": True,
+                "prefetch": None,
+            }
+            return
+
+    tokens_saved = compact_history(messages)
+    if tokens_saved:
+        logger.info(f"History compaction saved ~{tokens_saved} tokens (session: {session_id})")
+
+    # With the whole KB in the system prompt there is no KB tool to prefetch for
+    kb_system = knowledge_base_system_blocks()
+    tools = KB_CONTEXT_TOOLS if kb_system else TOOLS
+
+    prefetch = None
+    prompt = messages[-1]["content"] if messages and _is_user_prompt(messages[-1]) else None
+    if (
+        kb_system is None
+        and KB_PREFETCH in ("speculative", "inject")
+        and isinstance(prompt, str)
+        and prompt.strip()
+    ):
+        prefetch = KBPrefetch(prompt)
+
+    for step in range(1, MAX_AGENT_ITERATIONS + 1):
+        final_step = step == MAX_AGENT_ITERATIONS
+        tier = choose_tier(messages, tool_calls)
 
-            # Get Claude's final response with the KB information
-            final_response = client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=4096,
-                system=SYSTEM_PROMPT,
-                tools=TOOLS,
-                messages=messages,
+        start = time.perf_counter()
+        request_messages, system = _request_context(messages, window, session_id, kb_system)
+        if step == 1 and prefetch is not None and KB_PREFETCH == "inject" and is_routine_question(prompt):
+            try:
+                request_messages = _with_prefetched_passages(request_messages, prefetch.passages())
+                prefetch.injected = True
+            except Exception as e:
+                logger.error(f"KB prefetch failed, not injecting context: {e}")
+        call = _call_claude(
+            request_messages,
+            stream,
+            system,
+            tool_choice={"type": "none"} if final_step else None,
+            tier=tier,
+            tools=tools,
+        )
+        response = yield from _separated(call, "\n\n" if displayed else "")
+        model_ms = (time.perf_counter() - start) * 1000
+
+        # Only the last step's text is the answer: text written before a
+        # tool call is kept in the tool_use message already in the history.
+        # The patient saw all of it, so that is kept apart for display.
+        text = _response_text(response)
+        if text:
+            displayed.append(text)
+
+        tool_blocks = [block for block in response.content if block.type == "tool_use"]
+        for block in tool_blocks:
+            yield {
+                "type": "tool_use",
+                "id": block.id,
+                "name": block.name,
+                "input": block.input,
+            }
+            tool_calls.append(block.name)
+            show_calendly = show_calendly or block.name == "show_calendly"
+            query_kb = query_kb or block.name == "get_information_about_me"
+
+        _log_api_call(response, tool_blocks[0].name if tool_blocks else None, session_id)
+
+        if response.stop_reason != "tool_use" or not tool_blocks:
+            logger.info(
+                f"Agent step {step}: {tier} model {model_ms:.0f} ms, final answer (session: {session_id})"
             )
+            break
 
-            # Log the follow-up API call
-            save_api_call(
-                input_tokens=final_response.usage.input_tokens,
-                output_tokens=final_response.usage.output_tokens,
-                tool_used=None,
-                session_id=session_id,
+        # The app shows the booking link itself, so a booking-only tool call
+        # needs no follow-up call; the tool_use is left out of the history
+        if all(block.name == "show_calendly" for block in tool_blocks):
+            if not text:
+                text = RESPONSES[BOOKING]
+                yield {"type": "text", "text": ("\n\n" if displayed else "") + text}
+                displayed.append(text)
+            logger.info(
+                f"Agent step {step}: {tier} model {model_ms:.0f} ms, booking link shown "
+                f"(session: {session_id})"
             )
+            break
 
-            # Extract text from final response
-            for final_block in final_response.content:
-                if final_block.type == "text":
-                    text_response = final_block.text
+        # Reuse the prefetched lookup for the first KB query close to the user's message
+        overrides = {}
+        if prefetch is not None and not prefetch.used:
+            for block in tool_blocks:
+                if block.name == "get_information_about_me" and prefetch.matches(
+                    block.input.get("query", "")
+                ):
+                    overrides[block.id] = prefetch.reuse
                     break
 
-            return {
-                "text": text_response,
-                "show_calendly": show_calendly,
-                "query_kb": query_kb,
-            }
-        elif block.type == "text":
-            text_response = block.text
+        tools_start = time.perf_counter()
+        tool_results, timings = _execute_tools(tool_blocks, messages, overrides)
+        tools_ms = (time.perf_counter() - tools_start) * 1000
+        per_tool = ", ".join(
+            f"{b.name} {timings[b.id]:.0f} ms" if b.id in timings else f"{b.name} failed"
+            for b in tool_blocks
+        )
+        logger.info(
+            f"Agent step {step}: {tier} model {model_ms:.0f} ms, tools {tools_ms:.0f} ms "
+            f"({per_tool}) (session: {session_id})"
+        )
 
-    # Log API call for non-KB responses
-    save_api_call(
-        input_tokens=response.usage.input_tokens,
-        output_tokens=response.usage.output_tokens,
-        tool_used=tool_used,
-        session_id=session_id,
-    )
+        # Add assistant's tool use and the tool results to messages
+        messages.append({"role": "assistant", "content": response.content})
+        messages.append({"role": "user", "content": tool_results})
 
-    return {
-        "text": text_response,
+    prefetch_report = prefetch.report(session_id) if prefetch is not None else None
+
+    if question is not None and (query_kb or kb_system) and is_good_answer(text, show_calendly):
+        _cache_executor.submit(_cache_answer, question, text)
+
+    yield {
+        "type": "done",
+        "text": text,
+        "displayed_text": "\n\n".join(displayed),
         "show_calendly": show_calendly,
         "query_kb": query_kb,
+        "tokens_saved": tokens_saved,
+        "intent": None,
+        "cached": False,
+        "prefetch": prefetch_report,
     }
 
 
+def _opening_question(messages: list[dict]):
+    """Return the text of the first user message if it is the one being answered."""
+    prompts = [m for m in messages if _is_user_prompt(m)]
+    if len(prompts) != 1 or messages[-1] is not prompts[0] or not isinstance(prompts[0]["content"], str):
+        return None
+    return prompts[0]["content"]
+
+
+def _cache_answer(question: str, answer: str):
+    try:
+        get_answer_cache().store(question, answer)
+    except Exception as e:
+        logger.error(f"Could not cache answer: {e}")
+
+
+def _estimate_tokens(text: str) -> int:
+    """Roughly estimate the token count of text (about 4 characters per token)."""
+    return len(text) // 4 + 1 if text else 0
+
+
+def _block_text(block: dict) -> str:
+    """Flatten a content block to the text that counts towards its size."""
+    if block.get("type") == "text":
+        return block.get("text", "")
+    if block.get("type") == "tool_use":
+        return f"{block.get('name')} {json.dumps(block.get('input', {}))}"
+    if block.get("type") == "tool_result":
+        content = block.get("content", "")
+        if isinstance(content, list):
+            return "\n".join(_block_text(item) for item in content)
+        return str(content)
+    return ""
+
+
+def _message_blocks(message: dict) -> list[dict]:
+    content = message["content"]
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return [_block_to_dict(block) for block in content]
+
+
+def _message_tokens(message: dict) -> int:
+    return 4 + sum(_estimate_tokens(_block_text(b)) for b in _message_blocks(message))
+
+
+def _is_user_prompt(message: dict) -> bool:
+    """True for a user message typed by the patient (not a tool_result carrier)."""
+    if message["role"] != "user":
+        return False
+    return not any(b.get("type") == "tool_result" for b in _message_blocks(message))
+
+
+def _split_turns(messages: list[dict]) -> list[list[dict]]:
+    """Group messages into turns that each start with a patient prompt.
+
+    An assistant tool_use and the user tool_result answering it always land
+    in the same turn, so trimming whole turns never separates them.
+    """
+    turns = []
+    for message in messages:
+        if _is_user_prompt(message) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+class ConversationWindow:
+    """Keeps the history sent to Claude within a token budget.
+
+    The most recent turns are sent verbatim. When the history outgrows the
+    budget, the oldest turns are folded into a rolling summary that is sent
+    as an extra system block. Folding happens rarely (only when the budget
+    is exceeded), so the summary stays stable and cacheable between folds.
+    Keep one instance per chat session, next to the session's message list.
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, summarizer=None):
+        self.token_budget = token_budget
+        self.summarizer = summarizer or _summarize_turns
+        self.summary = ""
+        self.folded = 0
+
+    def prepare(self, messages: list[dict], session_id: str = None) -> list[dict]:
+        """Return the slice of messages to send, folding old turns if needed."""
+        if self.folded > len(messages):
+            # History was reset underneath us
+            self.summary = ""
+            self.folded = 0
+
+        turns = _split_turns(messages[self.folded:])
+        sizes = [sum(_message_tokens(m) for m in turn) for turn in turns]
+        total = sum(sizes) + _estimate_tokens(self.summary)
+
+        # Always keep the latest turn, even if it alone is over budget
+        fold_count = 0
+        while total > self.token_budget and fold_count < len(turns) - 1:
+            total -= sizes[fold_count]
+            fold_count += 1
+
+        if fold_count:
+            folded_messages = [m for turn in turns[:fold_count] for m in turn]
+            self.summary = self.summarizer(self.summary, folded_messages, session_id)
+            self.folded += len(folded_messages)
+            logger.info(
+                f"Folded {len(folded_messages)} messages into the conversation summary "
+                f"(session: {session_id})"
+            )
+
+        return messages[self.folded:]
+
+    def system_blocks(self, system: list[dict] = None) -> list[dict]:
+        """System prompt blocks, with the rolling summary appended if there is one."""
+        system = system or SYSTEM_BLOCKS
+        if not self.summary:
+            return system
+        return system + [
+            {
+                "type": "text",
+                "text": f"Summary of the earlier part of this conversation:\n{self.summary}",
+            }
+        ]
+
+
+DUPLICATE_PASSAGE = "[Passage {key} repeated from an earlier lookup: {heading}]"
+DUPLICATE_PASSAGE_PATTERN = re.compile(r"^\[Passage ([0-9a-f]{10}) repeated from an earlier lookup")
+COMPACTED_RESULT_PREFIX = "[Earlier knowledge base lookup"
+
+
+def _passage_key(passage: str) -> str:
+    return hashlib.sha1(passage.encode("utf-8")).hexdigest()[:10]
+
+
+def _passage_heading(passage: str) -> str:
+    return passage.strip().splitlines()[0][:80] if passage.strip() else ""
+
+
+def _tool_result_blocks(messages: list[dict]):
+    """Yield every tool_result block (as a mutable dict) in messages."""
+    for message in messages:
+        if message["role"] != "user" or isinstance(message["content"], str):
+            continue
+        for block in message["content"]:
+            if isinstance(block, dict) and block.get("type") == "tool_result":
+                yield block
+
+
+def _result_passages(block: dict) -> list[str]:
+    content = block.get("content", "")
+    if isinstance(content, list):
+        return [item.get("text", "") for item in content if item.get("type") == "text"]
+    return [str(content)]
+
+
+def _kb_tool_result(tool_use_id: str, passages, messages: list[dict]) -> dict:
+    """Build a KB tool_result with one text block per passage.
+
+    Passages already present verbatim in the history are replaced by a
+    short reference instead of being sent a second time.
+    """
+    seen = {
+        _passage_key(passage)
+        for block in _tool_result_blocks(messages)
+        for passage in _result_passages(block)
+    }
+
+    content = []
+    for passage in passages or []:
+        key = _passage_key(passage)
+        if key in seen:
+            passage = DUPLICATE_PASSAGE.format(key=key, heading=_passage_heading(passage))
+        seen.add(key)
+        content.append({"type": "text", "text": passage})
+
+    if not content:
+        content = [{"type": "text", "text": "No matching information found in the knowledge base."}]
+
+    return {"type": "tool_result", "tool_use_id": tool_use_id, "content": content}
+
+
+def compact_history(messages: list[dict], keep_turns: int = TOOL_RESULT_KEEP_TURNS) -> int:
+    """Replace answered KB tool results in older turns with a short reference.
+
+    The last keep_turns completed turns (and the turn in progress) keep their
+    passages so follow-up questions can still use them. Duplicate-passage
+    references in those turns that point at a result being compacted are
+    expanded back to the full passage first. messages is modified in place.
+
+    Returns:
+        Estimated number of tokens removed from the history
+    """
+    turns = _split_turns(messages)
+    old_turns = turns[: max(0, len(turns) - keep_turns - 1)]
+    if not old_turns:
+        return 0
+
+    queries = {}
+    for message in messages:
+        if message["role"] == "assistant":
+            for block in _message_blocks(message):
+                if block.get("type") == "tool_use":
+                    queries[block["id"]] = (block.get("name"), block.get("input", {}).get("query", ""))
+
+    saved = 0
+    released = {}
+    for turn in old_turns:
+        for block in _tool_result_blocks(turn):
+            name, query = queries.get(block.get("tool_use_id"), (None, ""))
+            passages = _result_passages(block)
+            if name != "get_information_about_me" or passages[0].startswith(COMPACTED_RESULT_PREFIX):
+                continue
+
+            for passage in passages:
+                if not DUPLICATE_PASSAGE_PATTERN.match(passage):
+                    released[_passage_key(passage)] = passage
+
+            headings = [_passage_heading(p) for p in passages if not DUPLICATE_PASSAGE_PATTERN.match(p)]
+            reference = (
+                f"{COMPACTED_RESULT_PREFIX} for {json.dumps(query)}: {len(passages)} passages "
+                f"({'; '.join(h for h in headings if h)}). Already answered above; "
+                "look it up again if the details are needed.]"
+            )
+            before = _estimate_tokens(_block_text(block))
+            block["content"] = reference
+            saved += before - _estimate_tokens(reference)
+
+    # Kept turns must not point at passages that were just compacted away
+    kept = [m for turn in turns[len(old_turns):] for m in turn]
+    present = {
+        _passage_key(p)
+        for block in _tool_result_blocks(kept)
+        for p in _result_passages(block)
+        if not DUPLICATE_PASSAGE_PATTERN.match(p)
+    }
+    for block in _tool_result_blocks(kept):
+        if not isinstance(block.get("content"), list):
+            continue
+        for item in block["content"]:
+            match = DUPLICATE_PASSAGE_PATTERN.match(item.get("text", ""))
+            if match and match.group(1) in released and match.group(1) not in present:
+                restored = released[match.group(1)]
+                saved -= _estimate_tokens(restored) - _estimate_tokens(item["text"])
+                item["text"] = restored
+                present.add(match.group(1))
+
+    return max(0, saved)
+
+
+def _transcript(messages: list[dict], max_chars: int = 500) -> str:
+    lines = []
+    for message in messages:
+        for block in _message_blocks(message):
+            if block.get("type") == "tool_use":
+                lines.append(f"[assistant looked up: {json.dumps(block.get('input', {}))}]")
+            elif block.get("type") == "tool_result":
+                lines.append("[knowledge base result omitted]")
+            elif block.get("type") == "text" and block.get("text"):
+                lines.append(f"{message['role']}: {block['text'][:max_chars]}")
+    return "\n".join(lines)
+
+
+def _summarize_turns(previous_summary: str, messages: list[dict], session_id: str = None) -> str:
+    """Fold messages into the running summary with a small, fast model."""
+    prompt = (
+        "Update the running summary of a chat between a patient and the "
+        "Bridgeport Physical Wellness assistant. Keep only what the assistant "
+        "may need later: the patient's concerns and details, questions asked, "
+        "facts already given (hours, insurance, prices), and whether a booking "
+        "link was shown. Reply with the summary only, under 150 words.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\n"
+        f"New messages:\n{_transcript(messages)}"
+    )
+    try:
+        response = client.messages.create(
+            model=SUMMARY_MODEL,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        _log_api_call(response, "summary", session_id)
+        return _response_text(response).strip()
+    except Exception as e:
+        # Fall back to a plain extract so the window still stays bounded
+        logger.error(f"Error summarizing conversation, using extract: {e}")
+        extract = f"{previous_summary}\n{_transcript(messages, max_chars=150)}".strip()
+        return extract[-2000:]
+
+
 def get_information_about_me(query: str):
-    from utils.chroma_db import ChromaDB
+    from utils.chroma_db import get_chroma_db
 
-    chroma_db = ChromaDB()
-    result = chroma_db.search_knowledge_base(query)
+    chroma_db = get_chroma_db()
+    result = chroma_db.search_knowledge_base(query, n_results=KB_N_RESULTS)
 
     return result
@@ -2,12 +2,80 @@ import chromadb
 import logging
 import streamlit as st
 import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from utils.bm25_index import BM25Index, reciprocal_rank_fusion
+from utils.config import get_setting, get_int_setting, get_float_setting, get_bool_setting
 
 logging.basicConfig(level=logging.INFO)
 
+# Query result cache (repeated questions skip the Chroma round trip)
+QUERY_CACHE_SIZE = get_int_setting("KB_QUERY_CACHE_SIZE", 256)
+QUERY_CACHE_TTL = get_float_setting("KB_QUERY_CACHE_TTL", 600.0)
+
+# How often to re-read the KB version written by other processes (dashboard)
+KB_VERSION_CHECK_INTERVAL = get_float_setting("KB_VERSION_CHECK_INTERVAL", 30.0)
+
+# Retrieval backend: "chroma" (Chroma Cloud) or "local" (memory-mapped NumPy index)
+KB_BACKEND = get_setting("KB_BACKEND", "chroma").lower()
+KB_LOCAL_PATH = get_setting("KB_LOCAL_PATH", "data/vector_index")
+
+# Hybrid retrieval: fuse vector results with a local BM25 keyword index
+KB_HYBRID = get_bool_setting("KB_HYBRID", True)
+KB_BM25_PATH = get_setting("KB_BM25_PATH", "data/kb_bm25.json")
+KB_HYBRID_CANDIDATES = get_int_setting("KB_HYBRID_CANDIDATES", 10)
+
+# Process-wide handle shared by every Streamlit session and rerun
+_shared_db = None
+_shared_lock = threading.Lock()
+
+
+def get_chroma_db():
+    """Return the process-wide ChromaDB handle, creating it on first use.
+
+    The client handshake and collection lookup happen once per process
+    instead of once per knowledge base query.
+    """
+    global _shared_db
+
+    if _shared_db is None:
+        with _shared_lock:
+            if _shared_db is None:
+                _shared_db = ChromaDB()
+
+    return _shared_db
+
 
 class ChromaDB:
     def __init__(self):
+        self.client = None
+        self.collection = None
+        self._connect_lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self._generation = 0
+        self._stats = {
+            "operations": 0,
+            "errors": 0,
+            "reconnects": 0,
+            "total_latency_ms": 0.0,
+            "last_latency_ms": None,
+            "last_error": None,
+            "healthy": True,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "cache_invalidations": 0,
+        }
+        self._cache_lock = threading.Lock()
+        self._query_cache = OrderedDict()
+        self.kb_version = None
+        self.kb_updated_at = None
+        self._kb_version_checked_at = 0.0
+        self.bm25 = BM25Index(KB_BM25_PATH) if KB_HYBRID else None
+        self._bm25_lock = threading.Lock()
         self.initialize_client()
         self.initiate_collection()
 
@@ -19,11 +87,19 @@ class ChromaDB:
         self.collection = self.client.get_or_create_collection(
             name="office-data"
         )
+        self._set_kb_version(self.collection.metadata)
 
         logging.info("Collection created")
 
     def initialize_client(self):
 
+        if KB_BACKEND == "local":
+            from utils.vector_index import LocalVectorClient
+
+            self.client = LocalVectorClient(KB_LOCAL_PATH)
+            logging.info(f"Local vector index client initialized at {KB_LOCAL_PATH}")
+            return
+
         # Try st.secrets first (Streamlit Cloud), fall back to os.getenv (local)
         api_key = st.secrets.get("CHROMA_API_KEY") or os.getenv(
             "CHROMA_API_KEY"
@@ -47,26 +123,333 @@ class ChromaDB:
 
         return self.client
 
+    def reconnect(self, generation=None):
+        """Rebuild the client and collection after a failed operation.
+
+        Args:
+            generation: Connection generation the caller saw before failing.
+                If another thread already reconnected since then, the
+                existing connection is reused.
+        """
+        with self._connect_lock:
+            if generation is not None and generation != self._generation:
+                return
+
+            self.initialize_client()
+            self.initiate_collection()
+            self._generation += 1
+
+            with self._stats_lock:
+                self._stats["reconnects"] += 1
+
+            logging.info("ChromaDB reconnected")
+
+    def _run(self, operation, fn):
+        """Run a collection operation, reconnecting once if it fails."""
+        generation = self._generation
+        start = time.perf_counter()
+
+        try:
+            try:
+                result = fn()
+            except Exception as e:
+                logging.warning(f"ChromaDB {operation} failed, reconnecting: {e}")
+                self._record_error(e)
+                self.reconnect(generation)
+                result = fn()
+        except Exception as e:
+            self._record_error(e)
+            raise
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self._stats["operations"] += 1
+            self._stats["total_latency_ms"] += latency_ms
+            self._stats["last_latency_ms"] = latency_ms
+            self._stats["healthy"] = True
+
+        return result
+
+    def _record_error(self, error):
+        with self._stats_lock:
+            self._stats["errors"] += 1
+            self._stats["last_error"] = str(error)
+            self._stats["healthy"] = False
+
+    def get_stats(self):
+        """Return health and latency counters for this handle.
+
+        Returns:
+            Dictionary with operation, error and reconnect counts, latency
+            figures in milliseconds and a healthy flag
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        operations = stats["operations"]
+        stats["avg_latency_ms"] = (
+            stats["total_latency_ms"] / operations if operations else None
+        )
+        lookups = stats["cache_hits"] + stats["cache_misses"]
+        stats["cache_hit_rate"] = stats["cache_hits"] / lookups if lookups else None
+        stats["cache_size"] = len(self._query_cache)
+        stats["kb_version"] = self.kb_version
+        return stats
+
+    def _set_kb_version(self, metadata):
+        """Record the KB version from collection metadata, dropping cached results if it changed."""
+        metadata = metadata or {}
+        version = metadata.get("kb_version")
+        with self._cache_lock:
+            self._kb_version_checked_at = time.monotonic()
+            if version == self.kb_version:
+                return
+            self.kb_version = version
+            self.kb_updated_at = metadata.get("kb_updated_at")
+            self._query_cache.clear()
+
+        with self._stats_lock:
+            self._stats["cache_invalidations"] += 1
+
+    def get_kb_version(self, max_age=KB_VERSION_CHECK_INTERVAL):
+        """Return the knowledge base version, refreshing it if it is stale.
+
+        The version changes on every write (from this process or another one,
+        such as the dashboard), so it can key caches built from KB content.
+
+        Args:
+            max_age: Seconds a previously read version may be reused
+
+        Returns:
+            Version string, or None if the KB was never written with versioning
+        """
+        if time.monotonic() - self._kb_version_checked_at >= max_age:
+            try:
+                collection = self._run(
+                    "version",
+                    lambda: self.client.get_collection(name=self.collection.name),
+                )
+                self._set_kb_version(collection.metadata)
+            except Exception as e:
+                logging.warning(f"Could not refresh KB version: {e}")
+
+        return self.kb_version
+
+    def _invalidate(self, upserted=None, removed=None):
+        """Publish a new KB version after a write and clear cached results.
+
+        The BM25 index is patched in place when the write is known
+        (upserted=(ids, documents) or removed=ids) and the index was in sync
+        before it; otherwise it stays on the old version and is rebuilt on
+        the next search.
+        """
+        previous_version = self.kb_version
+        metadata = {"kb_version": uuid.uuid4().hex, "kb_updated_at": datetime.now(timezone.utc).isoformat()}
+        version = metadata["kb_version"]
+        try:
+            self._run("modify", lambda: self.collection.modify(metadata=metadata))
+        except Exception as e:
+            logging.error(f"Could not publish KB version: {e}")
+        self._set_kb_version(metadata)
+
+        if self.bm25 is None or not (upserted or removed):
+            return
+
+        with self._bm25_lock:
+            if not self.bm25.exists or self.bm25.version != previous_version:
+                return
+            try:
+                if upserted:
+                    self.bm25.upsert(*upserted, version=version)
+                if removed:
+                    self.bm25.remove(removed, version=version)
+            except Exception as e:
+                logging.error(f"Could not update BM25 index: {e}")
+
+    def _ensure_bm25(self, version):
+        """Rebuild the BM25 index if it is missing or built from an older KB version."""
+        if self.bm25 is None:
+            return
+
+        with self._bm25_lock:
+            if self.bm25.exists and self.bm25.version == version:
+                return
+            try:
+                self.bm25.rebuild(self.get_all_documents(), version=version)
+            except Exception as e:
+                logging.error(f"Could not rebuild BM25 index: {e}")
+
+    @staticmethod
+    def _normalize_query(query):
+        if isinstance(query, str):
+            query = [query]
+        return tuple(
+            re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", q.lower())).strip()
+            for q in query
+        )
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            entry = self._query_cache.get(key)
+            if entry is not None and time.monotonic() - entry[0] > QUERY_CACHE_TTL:
+                del self._query_cache[key]
+                entry = None
+            if entry is not None:
+                self._query_cache.move_to_end(key)
+
+        with self._stats_lock:
+            self._stats["cache_hits" if entry is not None else "cache_misses"] += 1
+
+        return entry[1] if entry is not None else None
+
+    def _cache_put(self, key, value, version):
+        with self._cache_lock:
+            # Drop results computed against a KB version that has since changed
+            if version != self.kb_version:
+                return
+            self._query_cache[key] = (time.monotonic(), value)
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+
+    def clear_query_cache(self):
+        """Drop every cached search result."""
+        with self._cache_lock:
+            self._query_cache.clear()
+
+    def ping(self):
+        """Check that Chroma is reachable, reconnecting if needed.
+
+        Returns:
+            True if the heartbeat succeeded, False otherwise
+        """
+        try:
+            self._run("heartbeat", lambda: self.client.heartbeat())
+            return True
+        except Exception as e:
+            logging.error(f"ChromaDB heartbeat failed: {e}")
+            return False
+
     def search_knowledge_base(self, query, n_results=5):
 
-        results = self.collection.query(query_texts=query, n_results=n_results)
-        logging.debug(f"Search results: {results}")
+        if not isinstance(query, str):
+            query = query[0] if query else ""
+
+        documents = self.search_knowledge_base_batch([query], n_results)[0]
+        logging.debug(f"Search results: {documents}")
 
-        if "documents" not in results or len(results["documents"]) == 0:
+        if not documents:
             logging.info("No documents found for the given query.")
             return None
 
-        return results["documents"][0]
+        return documents
+
+    def search_knowledge_base_batch(self, queries, n_results=5):
+        """Search for several queries at once.
+
+        Cached queries are answered locally; the rest go to the backend in
+        a single request. With KB_HYBRID on, vector results are fused with
+        BM25 keyword results using reciprocal rank fusion, so exact terms
+        such as plan names or "fax" rank well even at small n_results.
+
+        Returns:
+            List with one list of documents per query (empty if none found)
+        """
+        version = self.get_kb_version()
+        results = [None] * len(queries)
+        missing = []
+        for i, query in enumerate(queries):
+            cached = self._cache_get((self._normalize_query(query), n_results))
+            if cached is not None:
+                results[i] = list(cached)
+            else:
+                missing.append(i)
+
+        if not missing:
+            return results
+
+        n_candidates = max(n_results, KB_HYBRID_CANDIDATES) if self.bm25 else n_results
+        response = self._run(
+            "query",
+            lambda: self.collection.query(
+                query_texts=[queries[i] for i in missing], n_results=n_candidates
+            ),
+        )
+        self._ensure_bm25(version)
+
+        all_ids = response.get("ids") or []
+        all_documents = response.get("documents") or []
+        for position, i in enumerate(missing):
+            ids = all_ids[position] if position < len(all_ids) else []
+            documents = all_documents[position] if position < len(all_documents) else []
+
+            if self.bm25 is not None:
+                texts = dict(zip(ids, documents))
+                keyword_ids = [
+                    doc_id for doc_id, _ in self.bm25.search(queries[i], n_candidates)
+                ]
+                found = []
+                for doc_id in reciprocal_rank_fusion([ids, keyword_ids]):
+                    text = texts.get(doc_id) or self.bm25.get_document(doc_id)
+                    if text:
+                        found.append(text)
+                    if len(found) == n_results:
+                        break
+            else:
+                found = list(documents[:n_results])
+
+            results[i] = found
+            if found:
+                self._cache_put(
+                    (self._normalize_query(queries[i]), n_results),
+                    tuple(found),
+                    version,
+                )
 
-    def add_to_knowledge_base(self, document, doc_id="doc"):
+        return results
 
-        self.collection.add(ids=[doc_id], documents=[document])
+    def add_to_knowledge_base(self, document, doc_id="doc", metadata=None):
+
+        self._run(
+            "add",
+            lambda: self.collection.add(
+                ids=[doc_id],
+                documents=[document],
+                metadatas=[metadata] if metadata else None,
+            ),
+        )
+        self._invalidate(upserted=([doc_id], [document]))
 
         logging.info("Document added to knowledge base")
 
+    def add_documents(self, ids, documents, metadatas=None):
+        """Add or replace several documents (e.g. chunks) in one request."""
+        if not ids:
+            return
+
+        self._run(
+            "upsert",
+            lambda: self.collection.upsert(
+                ids=ids, documents=documents, metadatas=metadatas
+            ),
+        )
+        self._invalidate(upserted=(ids, documents))
+        logging.info(f"{len(ids)} documents upserted into knowledge base")
+
+    def delete_documents(self, ids=None, where=None):
+        """Delete documents by ID list and/or metadata filter in one request."""
+        if not ids and not where:
+            return
+
+        self._run(
+            "delete", lambda: self.collection.delete(ids=ids, where=where)
+        )
+        # Filtered deletes remove unknown IDs, so leave BM25 to be rebuilt
+        self._invalidate(removed=None if where else ids)
+
     def get_all_documents(self):
         """Retrieve all documents from the collection."""
-        results = self.collection.get()
+        results = self._run("get", lambda: self.collection.get())
         if not results or "ids" not in results:
             return []
 
@@ -77,34 +460,58 @@ class ChromaDB:
 
         return documents
 
+    def get_manifest(self):
+        """Return {doc_id: metadata} for every document, without fetching text."""
+        results = self._run(
+            "get", lambda: self.collection.get(include=["metadatas"])
+        )
+        if not results or "ids" not in results:
+            return {}
+
+        metadatas = results.get("metadatas") or []
+        return {
+            doc_id: (metadatas[i] if i < len(metadatas) else None) or {}
+            for i, doc_id in enumerate(results["ids"])
+        }
+
     def delete_document(self, doc_id):
         """Delete a document from the collection by its ID."""
-        self.collection.delete(ids=[doc_id])
+        self._run("delete", lambda: self.collection.delete(ids=[doc_id]))
+        self._invalidate(removed=[doc_id])
         logging.info(f"Document '{doc_id}' deleted from knowledge base")
 
     def update_document(self, doc_id, new_content):
-        """Update a document by deleting the old one and adding the new content."""
-        self.delete_document(doc_id)
-        self.add_to_knowledge_base(new_content, doc_id)
+        """Update a document's content in place, keeping its other metadata.
+
+        A chunk ingested from a file gets the hash of its new text, so the
+        next sync sees that it no longer matches the source file; the edit
+        time is recorded in edited_at.
+        """
+        from utils.document_ingester import content_hash
+
+        results = self._run(
+            "get", lambda: self.collection.get(ids=[doc_id], include=["metadatas"])
+        )
+        metadata = dict(((results or {}).get("metadatas") or [None])[0] or {})
+        if metadata.get("content_hash"):
+            metadata["content_hash"] = content_hash(new_content)
+        metadata["edited_at"] = datetime.now(timezone.utc).isoformat()
+
+        self._run(
+            "update",
+            lambda: self.collection.update(ids=[doc_id], documents=[new_content], metadatas=[metadata]),
+        )
+        self._invalidate(upserted=([doc_id], [new_content]))
         logging.info(f"Document '{doc_id}' updated in knowledge base")
 
     def add_to_knowledge_base_from_directory(self, directory_path):
-        file_paths = [
-            os.path.join(directory_path, file)
-            for file in os.listdir(directory_path)
-            if file.endswith(".txt")
-        ]
-
-        documents = []
-        for file_path in file_paths:
-            with open(file_path, "r") as file:
-                documents.append(file.read())
+        """Sync the knowledge base with the .txt files in a directory.
 
-        # file names as prefixes
-        prefixes = [os.path.basename(file_path) for file_path in file_paths]
+        Only new or changed chunks are written; see DocumentIngester.sync_directory.
+        """
+        from utils.document_ingester import DocumentIngester
 
-        for i, document in enumerate(documents):
-            self.add_to_knowledge_base(document, doc_id=prefixes[i])
+        return DocumentIngester(self).sync_directory(directory_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+import os
+import streamlit as st
+
+
+def get_setting(name: str, default=None):
+    """Read a setting, trying st.secrets first (Streamlit Cloud) then os.getenv (local).
+
+    Args:
+        name: Setting name, e.g. "SUPABASE_POOL_SIZE"
+        default: Value returned when the setting is not defined anywhere
+
+    Returns:
+        The configured value, or default
+    """
+    try:
+        value = st.secrets.get(name)
+    except FileNotFoundError:
+        # No secrets.toml (plain local runs)
+        value = None
+
+    if value is None or value == "":
+        value = os.getenv(name)
+
+    if value is None or value == "":
+        return default
+
+    return value
+
+
+def get_int_setting(name: str, default: int) -> int:
+    """Read an integer setting, falling back to default if it is missing or invalid."""
+    try:
+        return int(get_setting(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_float_setting(name: str, default: float) -> float:
+    """Read a float setting, falling back to default if it is missing or invalid."""
+    try:
+        return float(get_setting(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_bool_setting(name: str, default: bool) -> bool:
+    """Read a boolean setting ("1", "true", "yes", "on" are truthy)."""
+    value = get_setting(name, default)
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
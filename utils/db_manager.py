@@ -1,32 +1,296 @@
+import re
 import uuid
 import logging
+import threading
 from datetime import datetime
-import streamlit as st
-from supabase import create_client, Client
+from utils.config import get_setting, get_int_setting, get_float_setting, get_bool_setting
+from utils.write_behind import WriteBehindQueue
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Database connection parameters from Streamlit secrets
-SUPABASE_URL = st.secrets["SUPABASE_URL"]
-SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
+# Storage backend: "supabase" (default) or "sqlite" for a local database
+DB_BACKEND = get_setting("DB_BACKEND", "supabase").lower()
+DB_SQLITE_PATH = get_setting("DB_SQLITE_PATH", "data/app.db")
 
+# Write-behind logging of messages and API calls (off = synchronous inserts)
+DB_WRITE_BEHIND = get_bool_setting("DB_WRITE_BEHIND", True)
+DB_WRITE_BATCH_SIZE = get_int_setting("DB_WRITE_BATCH_SIZE", 50)
+DB_WRITE_FLUSH_INTERVAL = get_float_setting("DB_WRITE_FLUSH_INTERVAL", 2.0)
+DB_WRITE_QUEUE_SIZE = get_int_setting("DB_WRITE_QUEUE_SIZE", 1000)
+DB_SPILL_MAX_ATTEMPTS = get_int_setting("DB_SPILL_MAX_ATTEMPTS", 10)
+DB_SPILL_RETRY_DELAY = get_float_setting("DB_SPILL_RETRY_DELAY", 30.0)
 
-def get_db_connection() -> Client:
-    """Get a Supabase client connection."""
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+# Shared store, created lazily and reused by every Streamlit script thread
+_store = None
+_store_lock = threading.Lock()
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _create_store():
+    """Create the store selected by DB_BACKEND."""
+    if DB_BACKEND == "sqlite":
+        from utils.sqlite_store import SQLiteStore
+
+        logger.info(f"Using SQLite storage at {DB_SQLITE_PATH}")
+        return SQLiteStore(DB_SQLITE_PATH)
+    if DB_BACKEND == "supabase":
+        from utils.supabase_store import SupabaseStore
+
+        return SupabaseStore()
+    raise ValueError(f"Unknown DB_BACKEND: {DB_BACKEND!r} (expected 'supabase' or 'sqlite')")
+
+
+def get_db_connection():
+    """Get the shared storage backend (a SupabaseStore or SQLiteStore).
+
+    The store is created on first use and reused afterwards. Connections
+    (the Supabase pool, or a SQLite connection per thread) are opened lazily.
+    """
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _create_store()
+
+    return _store
+
+
+def reset_db_connection():
+    """Close the store's connections so the next call reconnects."""
+    if _store is not None:
+        _store.reset()
+
+
+# Conversation topics recorded in sessions.topics as a bit set, matched
+# against user messages
+SESSION_TOPICS = [
+    ("Appointment booking", ["appointment", "book", "schedule", "calendly"]),
+    ("Insurance inquiry", ["insurance", "coverage", "plan"]),
+    ("Pricing questions", ["price", "cost", "fee", "payment"]),
+    ("Service information", ["service", "treatment", "therapy"]),
+    ("Location/Hours", ["location", "address", "hour", "open"]),
+]
+
+SESSION_PREVIEW_CHARS = 200
+
+TOKEN_COLUMNS = [
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+]
+
+
+def topic_flags(text: str) -> int:
+    """Return the SESSION_TOPICS bit set matched by a user message."""
+    text = (text or "").lower()
+    flags = 0
+    for bit, (_, words) in enumerate(SESSION_TOPICS):
+        if any(word in text for word in words):
+            flags |= 1 << bit
+    return flags
+
+
+def session_topics(flags: int) -> list[str]:
+    """Return the topic names in a sessions.topics bit set."""
+    return [name for bit, (name, _) in enumerate(SESSION_TOPICS) if flags & (1 << bit)]
+
+
+def _session_activity(table: str, rows: list[dict]) -> list[dict]:
+    """Summarize message or API-call rows as per-session deltas for the sessions table."""
+    if table == "messages":
+        rows = sorted(rows, key=lambda row: row["created_at"])
+
+    activity = {}
+    for row in rows:
+        session_id = row.get("session_id")
+        if not session_id:
+            continue
+        entry = activity.setdefault(
+            session_id,
+            {
+                "session_id": session_id,
+                "first_message_at": None,
+                "last_message_at": None,
+                "message_count": 0,
+                "show_calendly": False,
+                "preview": None,
+                "topics": 0,
+                "api_call_count": 0,
+                **{column: 0 for column in TOKEN_COLUMNS},
+            },
+        )
+        if table == "messages":
+            entry["message_count"] += 1
+            entry["first_message_at"] = entry["first_message_at"] or row["created_at"]
+            entry["last_message_at"] = row["created_at"]
+            entry["show_calendly"] = entry["show_calendly"] or bool(row.get("show_calendly"))
+            if row["role"] == "user":
+                entry["preview"] = entry["preview"] or row["content"][:SESSION_PREVIEW_CHARS]
+                entry["topics"] |= topic_flags(row["content"])
+        elif table == "api_calls":
+            entry["api_call_count"] += 1
+            for column in TOKEN_COLUMNS:
+                entry[column] += row.get(column) or 0
+    return list(activity.values())
+
+
+def _api_usage(rows: list[dict]) -> list[dict]:
+    """Summarize API-call rows as deltas for the daily tool x model rollup."""
+    usage = {}
+    for row in rows:
+        key = ((row.get("timestamp") or "")[:10], row.get("tool_used") or "", row.get("model") or "")
+        if not key[0]:
+            continue
+        entry = usage.setdefault(
+            key,
+            {
+                "day": key[0],
+                "tool_used": key[1],
+                "model": key[2],
+                "call_count": 0,
+                "cached_calls": 0,
+                **{column: 0 for column in TOKEN_COLUMNS},
+            },
+        )
+        entry["call_count"] += 1
+        if row.get("cache_read_input_tokens"):
+            entry["cached_calls"] += 1
+        for column in TOKEN_COLUMNS:
+            entry[column] += row.get(column) or 0
+    return list(usage.values())
+
+
+def _insert_rows(table: str, rows: list[dict]):
+    """Insert rows into a table with a single multi-row request.
+
+    The sessions summary and, for API calls, the daily usage rollup are
+    then updated with the batch's deltas. A failed summary update is only
+    logged, so the rows are not written twice; rebuild_sessions() and
+    rebuild_rollups() recover the summaries.
+    """
+    store = get_db_connection()
+    store.insert(table, rows)
+
+    activity = _session_activity(table, rows)
+    if activity:
+        try:
+            store.record_session_activity(activity)
+        except Exception as e:
+            logger.error(f"Error updating sessions summary for {len(activity)} sessions: {e}")
+
+    if table == "api_calls":
+        try:
+            store.record_api_usage(_api_usage(rows))
+        except Exception as e:
+            logger.error(f"Error updating daily usage rollup for {len(rows)} API calls: {e}")
+
+
+def _select_all(table: str, order: str, page_size: int = 1000):
+    """Yield every row of a table in pages, ordered by a column."""
+    store = get_db_connection()
+    offset = 0
+    while True:
+        rows = store.select(table, order=order, limit=page_size, offset=offset)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        offset += page_size
+
+
+def rebuild_sessions() -> int:
+    """Recompute the sessions summary from every message and API call.
+
+    Used to backfill the table after migrating and to repair it after a
+    failed update. Rows written while the rebuild runs may be missed, so
+    run it when the app is idle.
+
+    Returns:
+        Number of sessions
+    """
+    sessions = {}
+    for table, order in (("messages", "created_at"), ("api_calls", "timestamp")):
+        for entry in _session_activity(table, list(_select_all(table, order))):
+            merged = sessions.setdefault(entry["session_id"], entry)
+            if merged is not entry:
+                for column in ["api_call_count", *TOKEN_COLUMNS]:
+                    merged[column] += entry[column]
+
+    get_db_connection().replace_sessions(list(sessions.values()))
+    logger.info(f"Rebuilt sessions summary with {len(sessions)} sessions")
+    return len(sessions)
+
+
+def rebuild_rollups() -> int:
+    """Recompute the daily tool x model usage rollup from every API call.
+
+    This is the catch-up job for the rollup: run it after a failed update,
+    or after API calls were written without going through db_manager.
+    Calls written while it runs may be missed, so run it when the app is
+    idle.
+
+    Returns:
+        Number of rollup rows
+    """
+    usage = _api_usage(list(_select_all("api_calls", "timestamp")))
+    get_db_connection().replace_api_usage(usage)
+    logger.info(f"Rebuilt daily usage rollup with {len(usage)} rows")
+    return len(usage)
+
+
+def _get_writer() -> WriteBehindQueue:
+    """Get the shared write-behind queue, starting its flush thread on first use."""
+    global _writer
+
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteBehindQueue(
+                    _insert_rows,
+                    max_queue_size=DB_WRITE_QUEUE_SIZE,
+                    batch_size=DB_WRITE_BATCH_SIZE,
+                    flush_interval=DB_WRITE_FLUSH_INTERVAL,
+                    max_attempts=DB_SPILL_MAX_ATTEMPTS,
+                    retry_delay=DB_SPILL_RETRY_DELAY,
+                )
+
+    return _writer
+
+
+def _write_row(table: str, row: dict):
+    """Queue a row for background insertion, or insert it now if write-behind is off."""
+    if DB_WRITE_BEHIND:
+        _get_writer().enqueue(table, row)
+    else:
+        _insert_rows(table, [row])
+
+
+def flush_pending_writes():
+    """Write any queued messages and API calls to the database immediately."""
+    if _writer is not None:
+        _writer.flush()
 
 
 def initialize_database():
-    """Initialize database - Supabase manages schema automatically."""
-    pass
+    """Create or upgrade the local schema (Supabase manages its own, see migrations/)."""
+    try:
+        get_db_connection().initialize()
+    except Exception as e:
+        logger.error(f"Error initializing database: {e}")
 
 
 def save_message_to_db(
     role: str, content: str, show_calendly: bool = False, session_id: str = None
 ):
-    """Save a message to the Supabase database.
+    """Save a message to the database.
+
+    With DB_WRITE_BEHIND enabled the row is queued and inserted by the
+    background flush thread as part of a batch.
 
     Args:
         role: "user" or "assistant"
@@ -34,15 +298,14 @@ def save_message_to_db(
         show_calendly: Whether a calendly link was shown (for assistant messages)
         session_id: UUID for the chat dialog session
     """
-    client = get_db_connection()
-
     message_id = str(uuid.uuid4())
     session_id = session_id or str(uuid.uuid4())
     timestamp = datetime.now().isoformat()
 
     try:
-        logger.info(f"Inserting message - role: {role}, session_id: {session_id}, message_id: {message_id}")
-        client.table("messages").insert(
+        logger.info(f"Saving message - role: {role}, session_id: {session_id}, message_id: {message_id}")
+        _write_row(
+            "messages",
             {
                 "message_id": message_id,
                 "session_id": session_id,
@@ -50,9 +313,8 @@ def save_message_to_db(
                 "content": content,
                 "show_calendly": show_calendly,
                 "created_at": timestamp,
-            }
-        ).execute()
-        logger.info(f"Successfully saved message - message_id: {message_id}")
+            },
+        )
     except Exception as e:
         logger.error(f"Error saving message to database: {e}")
 
@@ -66,26 +328,42 @@ def get_messages_by_session(session_id: str):
     Returns:
         List of message dictionaries
     """
-    client = get_db_connection()
-
     try:
         logger.info(f"Fetching messages for session: {session_id}")
-        response = (
-            client.table("messages")
-            .select("*")
-            .eq("session_id", session_id)
-            .order("created_at", desc=False)
-            .execute()
+        messages = get_db_connection().select(
+            "messages", eq={"session_id": session_id}, order="created_at"
         )
 
-        message_count = len(response.data) if response.data else 0
-        logger.info(f"Retrieved {message_count} messages for session: {session_id}")
-        return response.data if response.data else []
+        logger.info(f"Retrieved {len(messages)} messages for session: {session_id}")
+        return messages
     except Exception as e:
         logger.error(f"Error retrieving messages for session {session_id}: {e}")
         return []
 
 
+def get_opening_messages(session_ids: list[str], per_session: int = 2) -> dict:
+    """Get the first messages of several sessions with one query.
+
+    Args:
+        session_ids: UUIDs of the chat sessions
+        per_session: Number of messages to return per session
+
+    Returns:
+        Dictionary mapping each session_id to its first messages, oldest
+        first; sessions without messages map to an empty list
+    """
+    openings = {session_id: [] for session_id in session_ids}
+
+    try:
+        logger.info(f"Fetching opening messages for {len(openings)} sessions")
+        for row in get_db_connection().opening_messages(list(openings), per_session):
+            openings.setdefault(row["session_id"], []).append(row)
+    except Exception as e:
+        logger.error(f"Error fetching opening messages: {e}")
+
+    return openings
+
+
 def get_all_messages(limit: int = 1000):
     """Retrieve all messages from the database.
 
@@ -95,21 +373,14 @@ def get_all_messages(limit: int = 1000):
     Returns:
         List of message dictionaries
     """
-    client = get_db_connection()
-
     try:
         logger.info(f"Fetching all messages with limit: {limit}")
-        response = (
-            client.table("messages")
-            .select("*")
-            .order("created_at", desc=True)
-            .limit(limit)
-            .execute()
+        messages = get_db_connection().select(
+            "messages", order="created_at", desc=True, limit=limit
         )
 
-        message_count = len(response.data) if response.data else 0
-        logger.info(f"Retrieved {message_count} total messages")
-        return response.data if response.data else []
+        logger.info(f"Retrieved {len(messages)} total messages")
+        return messages
     except Exception as e:
         logger.error(f"Error retrieving all messages: {e}")
         return []
@@ -121,15 +392,9 @@ def get_session_count():
     Returns:
         Integer count of sessions
     """
-    client = get_db_connection()
-
     try:
         logger.info("Fetching session count")
-        response = client.table("messages").select("*").execute()
-
-        # Count unique session IDs
-        unique_sessions = set(msg["session_id"] for msg in response.data)
-        session_count = len(unique_sessions)
+        session_count = get_db_connection().count("sessions", gt={"message_count": 0})
         logger.info(f"Found {session_count} unique chat sessions")
         return session_count
     except Exception as e:
@@ -143,11 +408,11 @@ def delete_session_messages(session_id: str):
     Args:
         session_id: UUID of the chat session to delete
     """
-    client = get_db_connection()
-
     try:
         logger.info(f"Deleting all messages for session: {session_id}")
-        client.table("messages").delete().eq("session_id", session_id).execute()
+        store = get_db_connection()
+        store.delete("messages", eq={"session_id": session_id})
+        store.delete("sessions", eq={"session_id": session_id})
         logger.info(f"Successfully deleted messages for session: {session_id}")
     except Exception as e:
         logger.error(f"Error deleting session messages for {session_id}: {e}")
@@ -158,76 +423,171 @@ def save_api_call(
     output_tokens: int,
     tool_used: str = None,
     session_id: str = None,
+    cache_creation_input_tokens: int = 0,
+    cache_read_input_tokens: int = 0,
+    model: str = None,
 ):
-    """Log a Claude API call to the Supabase database.
+    """Log a Claude API call to the database.
+
+    With DB_WRITE_BEHIND enabled the row is queued and inserted by the
+    background flush thread as part of a batch.
 
     Args:
         input_tokens: Number of input tokens used
         output_tokens: Number of output tokens generated
         tool_used: Name of tool used (if any)
         session_id: UUID for the chat dialog session
+        cache_creation_input_tokens: Input tokens written to the prompt cache
+        cache_read_input_tokens: Input tokens read from the prompt cache
+        model: Claude model that served the call
     """
-    client = get_db_connection()
     timestamp = datetime.now().isoformat()
 
     try:
-        logger.info(f"Logging API call - input: {input_tokens}, output: {output_tokens}, tool: {tool_used}, session: {session_id}")
-        client.table("api_calls").insert(
+        logger.info(
+            f"Logging API call - input: {input_tokens}, output: {output_tokens}, "
+            f"cache write: {cache_creation_input_tokens}, cache read: {cache_read_input_tokens}, "
+            f"model: {model}, tool: {tool_used}, session: {session_id}"
+        )
+        _write_row(
+            "api_calls",
             {
                 "input_tokens": input_tokens,
                 "output_tokens": output_tokens,
+                "cache_creation_input_tokens": cache_creation_input_tokens,
+                "cache_read_input_tokens": cache_read_input_tokens,
                 "tool_used": tool_used,
+                "model": model,
                 "session_id": session_id,
                 "timestamp": timestamp,
-            }
-        ).execute()
-        logger.info("Successfully logged API call")
+            },
+        )
     except Exception as e:
         logger.error(f"Error logging API call: {e}")
 
 
-def get_all_sessions():
-    """Get all unique sessions with metadata.
+def _session_from_row(row: dict) -> dict:
+    return {
+        "session_id": row["session_id"],
+        "message_count": row["message_count"],
+        "first_message_time": row["first_message_at"],
+        "last_message_time": row["last_message_at"],
+        "show_calendly": bool(row["show_calendly"]),
+        "preview": row["preview"] or "",
+        "topics": session_topics(row["topics"] or 0),
+        "api_call_count": row["api_call_count"],
+        **{column: row[column] or 0 for column in TOKEN_COLUMNS},
+    }
+
+
+SEARCH_TERM_PATTERN = re.compile(r'"([^"]*)"(\*?)|(\S+)')
+
+
+def parse_search_query(text: str) -> list[dict]:
+    """Parse a search box query into terms that must all match.
+
+    "quoted words" are a phrase, a trailing * makes a word (or the last
+    word of a phrase) a prefix, and everything else is a plain word.
+    Punctuation is dropped, so the terms are safe to render into either
+    backend's query syntax.
 
     Returns:
-        List of dictionaries with session_id, message_count, first_message_time, last_message_time
+        List of {"words": [...], "prefix": bool} dictionaries
     """
-    client = get_db_connection()
+    terms = []
+    for phrase, phrase_prefix, word in SEARCH_TERM_PATTERN.findall(text or ""):
+        words = re.findall(r"\w+", (phrase or word).lower())
+        if words:
+            terms.append({"words": words, "prefix": bool(phrase_prefix) or word.endswith("*")})
+    return terms
+
+
+def search_sessions(query: str, page: int = 0, page_size: int = 25):
+    """Full-text search over message content, returning matching sessions.
+
+    Sessions are ranked by their best matching message (Postgres
+    ts_rank_cd on Supabase, FTS5 bm25 on SQLite) and carry a snippet of
+    that message with the matches in **bold**. Transcripts are not loaded.
+
+    Args:
+        query: Search text; supports "quoted phrases" and prefix* words
+        page: Zero-based page number
+        page_size: Sessions per page
 
+    Returns:
+        (sessions, has_more) where sessions are shaped like
+        get_all_sessions() items plus rank, match_count and snippet
+    """
+    terms = parse_search_query(query)
+    if not terms:
+        return [], False
+
+    try:
+        logger.info(f"Searching sessions for {query!r} - page: {page}")
+        rows = get_db_connection().search_sessions(
+            terms, limit=page_size + 1, offset=page * page_size
+        )
+
+        sessions = [
+            {
+                **_session_from_row(row),
+                "rank": row["rank"],
+                "match_count": row["match_count"],
+                "snippet": row["snippet"],
+            }
+            for row in rows[:page_size]
+        ]
+        logger.info(f"Found {len(sessions)} matching sessions on page {page}")
+        return sessions, len(rows) > page_size
+    except Exception as e:
+        logger.error(f"Error searching sessions for {query!r}: {e}")
+        return [], False
+
+
+def get_token_totals_by_sessions(session_ids: list[str]) -> dict:
+    """Get API-call token totals for several sessions with one grouped query.
+
+    Args:
+        session_ids: UUIDs of the chat sessions
+
+    Returns:
+        Dictionary mapping each session_id to a dictionary with
+        api_call_count and the TOKEN_COLUMNS totals; sessions without API
+        calls map to zeros
+    """
+    totals = {
+        session_id: {"api_call_count": 0, **{column: 0 for column in TOKEN_COLUMNS}}
+        for session_id in session_ids
+    }
+
+    try:
+        logger.info(f"Fetching token totals for {len(totals)} sessions")
+        for row in get_db_connection().token_totals(list(totals)):
+            totals[row["session_id"]] = {
+                "api_call_count": row["api_call_count"] or 0,
+                **{column: row[column] or 0 for column in TOKEN_COLUMNS},
+            }
+    except Exception as e:
+        logger.error(f"Error fetching token totals by session: {e}")
+
+    return totals
+
+
+def get_all_sessions():
+    """Get all sessions with metadata from the sessions summary.
+
+    Returns:
+        List of dictionaries with session_id, message_count,
+        first_message_time, last_message_time, show_calendly, preview,
+        topics (names) and token totals, most recent first
+    """
     try:
         logger.info("Fetching all sessions")
-        response = client.table("messages").select("*").order("created_at", desc=False).execute()
-
-        if not response.data:
-            return []
-
-        # Group messages by session
-        sessions = {}
-        for msg in response.data:
-            sid = msg["session_id"]
-            if sid not in sessions:
-                sessions[sid] = {
-                    "session_id": sid,
-                    "messages": [],
-                    "first_message_time": msg["created_at"],
-                    "last_message_time": msg["created_at"],
-                }
-            sessions[sid]["messages"].append(msg)
-            sessions[sid]["last_message_time"] = msg["created_at"]
-
-        # Convert to list with metadata
-        result = []
-        for sid, data in sessions.items():
-            result.append({
-                "session_id": sid,
-                "message_count": len(data["messages"]),
-                "first_message_time": data["first_message_time"],
-                "last_message_time": data["last_message_time"],
-                "messages": data["messages"],
-            })
-
-        # Sort by last message time (most recent first)
-        result.sort(key=lambda x: x["last_message_time"], reverse=True)
+        rows = get_db_connection().select(
+            "sessions", gt={"message_count": 0}, order="last_message_at", desc=True
+        )
+
+        result = [_session_from_row(row) for row in rows]
         logger.info(f"Found {len(result)} sessions")
         return result
     except Exception as e:
@@ -235,21 +595,148 @@ def get_all_sessions():
         return []
 
 
+# Session list orders: sort column and direction (session_id breaks ties)
+SESSION_ORDERS = {
+    "recent": ("last_message_at", True),
+    "oldest": ("first_message_at", False),
+    "most_messages": ("message_count", True),
+}
+
+
+def get_sessions_page(order: str = "recent", after: tuple = None, page_size: int = 25):
+    """Get one page of sessions using keyset pagination.
+
+    Args:
+        order: A SESSION_ORDERS key
+        after: Cursor returned with the previous page; the first page when omitted
+        page_size: Sessions per page
+
+    Returns:
+        (sessions, next_cursor) where sessions are shaped like
+        get_all_sessions() items and next_cursor is None on the last page
+    """
+    sort, desc = SESSION_ORDERS[order]
+
+    try:
+        logger.info(f"Fetching sessions page - order: {order}, after: {after}")
+        rows = get_db_connection().select_page(
+            "sessions",
+            sort=sort,
+            key="session_id",
+            desc=desc,
+            after=after,
+            limit=page_size + 1,
+            gt={"message_count": 0},
+        )
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = (rows[-1][sort], rows[-1]["session_id"])
+
+        logger.info(f"Retrieved {len(rows)} sessions")
+        return [_session_from_row(row) for row in rows], next_cursor
+    except Exception as e:
+        logger.error(f"Error fetching sessions page: {e}")
+        return [], None
+
+
 def get_all_api_calls():
     """Get all API call records for metrics.
 
     Returns:
         List of API call dictionaries
     """
-    client = get_db_connection()
-
     try:
         logger.info("Fetching all API calls")
-        response = client.table("api_calls").select("*").order("timestamp", desc=True).execute()
+        calls = get_db_connection().select("api_calls", order="timestamp", desc=True)
 
-        call_count = len(response.data) if response.data else 0
-        logger.info(f"Retrieved {call_count} API calls")
-        return response.data if response.data else []
+        logger.info(f"Retrieved {len(calls)} API calls")
+        return calls
+    except Exception as e:
+        logger.error(f"Error fetching API calls: {e}")
+        return []
+
+
+def _date_range(start_date=None, end_date=None, column="day", as_timestamp=False):
+    """Build gte/lte filters for an inclusive date range (datetime.date or ISO strings)."""
+    gte, lte = {}, {}
+    if start_date:
+        gte[column] = str(start_date)
+    if end_date:
+        lte[column] = f"{end_date}T23:59:59.999999" if as_timestamp else str(end_date)
+    return gte, lte
+
+
+def get_daily_api_usage(start_date=None, end_date=None):
+    """Get daily token usage per tool and model from the rollup table.
+
+    Args:
+        start_date: First day to include (datetime.date or "YYYY-MM-DD"); all history when omitted
+        end_date: Last day to include; up to today when omitted
+
+    Returns:
+        List of dictionaries with day, tool_used, model, call_count,
+        cached_calls and the TOKEN_COLUMNS totals; tool_used and model are
+        "" for calls without one
+    """
+    gte, lte = _date_range(start_date, end_date)
+
+    try:
+        logger.info(f"Fetching daily API usage from {start_date} to {end_date}")
+        rows = get_db_connection().select("api_usage_daily", gte=gte, lte=lte, order="day")
+
+        logger.info(f"Retrieved {len(rows)} daily usage rows")
+        return rows
+    except Exception as e:
+        logger.error(f"Error fetching daily API usage: {e}")
+        return []
+
+
+def get_top_sessions_by_tokens(start_date=None, end_date=None, limit: int = 10):
+    """Get the sessions with the most tokens among those active in a date range.
+
+    Totals cover the whole session, not just the part inside the range.
+
+    Returns:
+        List of dictionaries shaped like get_all_sessions() items
+    """
+    gte, _ = _date_range(start_date, None, "last_message_at")
+    _, lte = _date_range(None, end_date, "first_message_at", as_timestamp=True)
+
+    try:
+        logger.info(f"Fetching top {limit} sessions by tokens from {start_date} to {end_date}")
+        rows = get_db_connection().select(
+            "sessions",
+            gt={"total_tokens": 0},
+            gte=gte,
+            lte=lte,
+            order="total_tokens",
+            desc=True,
+            limit=limit,
+        )
+        return [_session_from_row(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Error fetching top sessions by tokens: {e}")
+        return []
+
+
+def get_api_calls_in_range(start_date=None, end_date=None, limit: int = 500):
+    """Get the most recent API call records in a date range.
+
+    Returns:
+        List of API call dictionaries, newest first
+    """
+    gte, lte = _date_range(start_date, end_date, "timestamp", as_timestamp=True)
+
+    try:
+        logger.info(f"Fetching up to {limit} API calls from {start_date} to {end_date}")
+        calls = get_db_connection().select(
+            "api_calls", gte=gte, lte=lte, order="timestamp", desc=True, limit=limit
+        )
+
+        logger.info(f"Retrieved {len(calls)} API calls")
+        return calls
     except Exception as e:
         logger.error(f"Error fetching API calls: {e}")
         return []
@@ -264,21 +751,33 @@ def get_api_calls_by_session(session_id: str):
     Returns:
         List of API call dictionaries
     """
-    client = get_db_connection()
-
     try:
         logger.info(f"Fetching API calls for session: {session_id}")
-        response = (
-            client.table("api_calls")
-            .select("*")
-            .eq("session_id", session_id)
-            .order("timestamp", desc=False)
-            .execute()
+        calls = get_db_connection().select(
+            "api_calls", eq={"session_id": session_id}, order="timestamp"
         )
 
-        call_count = len(response.data) if response.data else 0
-        logger.info(f"Retrieved {call_count} API calls for session: {session_id}")
-        return response.data if response.data else []
+        logger.info(f"Retrieved {len(calls)} API calls for session: {session_id}")
+        return calls
     except Exception as e:
         logger.error(f"Error fetching API calls for session {session_id}: {e}")
         return []
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser(
+        "rebuild-sessions", help="recompute the sessions summary from messages and API calls"
+    )
+    subcommands.add_parser(
+        "rebuild-rollups", help="recompute the daily token usage rollup from API calls"
+    )
+    args = parser.parse_args()
+
+    if args.command == "rebuild-sessions":
+        print(f"Rebuilt {rebuild_sessions()} sessions")
+    elif args.command == "rebuild-rollups":
+        print(f"Rebuilt {rebuild_rollups()} daily usage rows")
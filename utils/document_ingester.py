@@ -1,39 +1,282 @@
-from utils.chroma_db import ChromaDB
+from utils.chroma_db import get_chroma_db
+from utils.config import get_int_setting
+import hashlib
 import logging
 import os
+import re
 
 logging.basicConfig(level=logging.INFO)
 
+# Chunk size budget and overlap, in approximate tokens
+CHUNK_MAX_TOKENS = get_int_setting("KB_CHUNK_MAX_TOKENS", 300)
+CHUNK_OVERLAP_TOKENS = get_int_setting("KB_CHUNK_OVERLAP_TOKENS", 50)
+
+# Lines like "---" separate top-level parts of a document
+SEPARATOR_PATTERN = re.compile(r"^\s*[-=_*]{3,}\s*$")
+
+
+def estimate_tokens(text):
+    """Roughly estimate the token count of text (about 4 characters per token)."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def is_section_header(line):
+    """Return True for uppercase header lines such as "WORKING HOURS"."""
+    stripped = line.strip()
+    return (
+        0 < len(stripped) <= 80
+        and stripped.isupper()
+        and not stripped.startswith(("-", "*", "•"))
+    )
+
+
+def split_sections(text):
+    """Split a document into sections on its uppercase header lines.
+
+    A header with no body of its own (a document title, or a heading such as
+    "SERVICE PRICING" followed directly by sub-headings) is kept as context
+    for the sections that follow it, until the next "---" separator.
+
+    Returns:
+        List of (heading, body) tuples; heading is "" for text before the
+        first header
+    """
+    sections = []
+    context = []
+    heading = ""
+    body = []
+
+    def close_section():
+        nonlocal heading, body
+        content = "\n".join(body).strip()
+        if content:
+            path = context + [heading] if heading else context
+            sections.append((" > ".join(path), content))
+        elif heading:
+            # Empty section: its header scopes the sections below it
+            context.append(heading)
+        heading = ""
+        body = []
+
+    for line in text.splitlines():
+        if SEPARATOR_PATTERN.match(line):
+            close_section()
+            context = []
+        elif is_section_header(line):
+            close_section()
+            heading = line.strip()
+        else:
+            body.append(line.rstrip())
+
+    close_section()
+    return sections
+
+
+def _slugify(text):
+    slug = re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+    return slug or "intro"
+
+
+def _split_long_line(line, max_tokens):
+    """Split a single line that is over budget on word boundaries."""
+    pieces = []
+    current = []
+    for word in line.split():
+        if current and estimate_tokens(" ".join(current + [word])) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def _split_body(body, max_tokens, overlap_tokens):
+    """Pack body lines into pieces of at most max_tokens, with line overlap."""
+    lines = []
+    for line in body.splitlines():
+        if estimate_tokens(line) > max_tokens:
+            lines.extend(_split_long_line(line, max_tokens))
+        else:
+            lines.append(line)
+
+    pieces = []
+    current = []
+    for line in lines:
+        if current and estimate_tokens("\n".join(current + [line])) > max_tokens:
+            pieces.append("\n".join(current).strip())
+
+            # Carry trailing lines into the next piece as overlap
+            overlap = []
+            while current and estimate_tokens("\n".join([current[-1]] + overlap)) <= overlap_tokens:
+                overlap.insert(0, current.pop())
+            current = overlap
+        current.append(line)
+
+    if "\n".join(current).strip():
+        pieces.append("\n".join(current).strip())
+
+    return pieces
+
+
+def chunk_document(text, source, max_tokens=None, overlap_tokens=None):
+    """Split a document into section-aware chunks for the knowledge base.
+
+    Each chunk starts with its section heading so it reads on its own, and
+    gets an ID derived from the source name, section and position, so
+    re-ingesting the same file produces the same IDs.
+
+    Args:
+        text: Full document text
+        source: Source name, usually the file name (e.g. "insurance.txt")
+        max_tokens: Token budget per chunk (defaults to KB_CHUNK_MAX_TOKENS)
+        overlap_tokens: Tokens repeated between consecutive chunks of a section
+
+    Returns:
+        List of {"id", "text", "metadata"} dictionaries
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+
+    chunks = []
+    seen_slugs = {}
+    for heading, body in split_sections(text):
+        slug = _slugify(heading.split(" > ")[-1])
+        seen_slugs[slug] = seen_slugs.get(slug, 0) + 1
+        if seen_slugs[slug] > 1:
+            slug = f"{slug}-{seen_slugs[slug]}"
+
+        budget = max(1, max_tokens - estimate_tokens(heading))
+        overlap = min(overlap_tokens, budget // 2)
+        for i, piece in enumerate(_split_body(body, budget, overlap)):
+            chunks.append(
+                {
+                    "id": f"{source}::{slug}::{i}",
+                    "text": f"{heading}\n{piece}" if heading else piece,
+                    "metadata": {
+                        "source": source,
+                        "section": heading,
+                        "chunk_index": i,
+                    },
+                }
+            )
+
+    return chunks
+
+
+def content_hash(text):
+    """Return the SHA-256 hex digest used to detect changed chunks."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
 
 class DocumentIngester:
-    def __init__(self):
-        self.chroma_db = ChromaDB()
-        self.chroma_db.initiate_collection()
+    def __init__(self, chroma_db=None):
+        self.chroma_db = chroma_db or get_chroma_db()
 
-    def ingest_documents(self, documents, prefixes=None):
+    def ingest_documents(self, documents, prefixes=None, prune_missing=False, dry_run=False):
+        """Chunk documents and sync the chunks into the knowledge base.
 
+        Chunk content hashes are stored in chunk metadata and act as the
+        manifest: only new or changed chunks are upserted (in one request),
+        and chunks a source no longer produces are deleted (in one request).
+        Unchanged text is never re-embedded.
+
+        Args:
+            documents: List of document texts
+            prefixes: Source name for each document (defaults to "doc<i>")
+            prune_missing: Also delete hashed chunks whose source is not in
+                this batch (used when syncing a whole directory)
+            dry_run: Compute the diff without writing anything
+
+        Returns:
+            Dictionary with "added", "updated" and "removed" chunk ID lists
+            and an "unchanged" count
+        """
+        wanted = {}
+        sources = set()
         for i, document in enumerate(documents):
-            prefix = prefixes[i] if prefixes and i < len(prefixes) else "doc"
-            self.chroma_db.add_to_knowledge_base(document, key_prefix=prefix)
+            source = prefixes[i] if prefixes and i < len(prefixes) else f"doc{i}"
+            sources.add(source)
+            for chunk in chunk_document(document, source):
+                chunk["metadata"]["content_hash"] = content_hash(chunk["text"])
+                wanted[chunk["id"]] = chunk
+
+        manifest = self.chroma_db.get_manifest()
 
-    def ingest_files(self, file_paths, prefixes=None):
+        diff = {"added": [], "updated": [], "removed": [], "unchanged": 0}
+        for chunk_id, chunk in wanted.items():
+            existing = manifest.get(chunk_id)
+            if existing is None:
+                diff["added"].append(chunk_id)
+            elif existing.get("content_hash") != chunk["metadata"]["content_hash"]:
+                diff["updated"].append(chunk_id)
+            else:
+                diff["unchanged"] += 1
+
+        for doc_id, metadata in manifest.items():
+            if doc_id in wanted:
+                continue
+            source = metadata.get("source")
+            if source in sources or doc_id in sources:
+                # Chunk the source no longer produces, or a legacy whole-file entry
+                diff["removed"].append(doc_id)
+            elif prune_missing and metadata.get("content_hash") and source:
+                # Ingested from a file that is gone; documents added from the
+                # dashboard carry no hash and are left alone
+                diff["removed"].append(doc_id)
+
+        if not dry_run:
+            changed = [wanted[chunk_id] for chunk_id in diff["added"] + diff["updated"]]
+            self.chroma_db.add_documents(
+                ids=[chunk["id"] for chunk in changed],
+                documents=[chunk["text"] for chunk in changed],
+                metadatas=[chunk["metadata"] for chunk in changed],
+            )
+            self.chroma_db.delete_documents(ids=diff["removed"])
+
+        logging.info(
+            f"KB sync{' (dry run)' if dry_run else ''}: {len(diff['added'])} added, "
+            f"{len(diff['updated'])} updated, {len(diff['removed'])} removed, "
+            f"{diff['unchanged']} unchanged"
+        )
+        return diff
+
+    def ingest_files(self, file_paths, prefixes=None, prune_missing=False, dry_run=False):
         documents = []
         for file_path in file_paths:
             with open(file_path, "r") as file:
                 documents.append(file.read())
-        self.ingest_documents(documents, prefixes)
+        prefixes = prefixes or [os.path.basename(file_path) for file_path in file_paths]
+        return self.ingest_documents(documents, prefixes, prune_missing, dry_run)
 
     def ingest_files_from_directory(self, directory_path, prefixes=None):
         file_paths = [
             os.path.join(directory_path, file)
-            for file in os.listdir(directory_path)
+            for file in sorted(os.listdir(directory_path))
+            if file.endswith(".txt")
+        ]
+        return self.ingest_files(file_paths, prefixes)
+
+    def sync_directory(self, directory_path, dry_run=False):
+        """Make the knowledge base match the .txt files in a directory.
+
+        New and changed chunks are upserted, and chunks from files that were
+        removed are deleted. See ingest_documents for the diff format.
+        """
+        file_paths = [
+            os.path.join(directory_path, file)
+            for file in sorted(os.listdir(directory_path))
             if file.endswith(".txt")
         ]
-        self.ingest_files(file_paths, prefixes)
+        return self.ingest_files(file_paths, prune_missing=True, dry_run=dry_run)
 
 
 if __name__ == "__main__":
+    import sys
+
     document_ingester = DocumentIngester()
-    document_ingester.ingest_files_from_directory(
-        "../data/docs", ["general", "insurance"]
-    )
+    diff = document_ingester.sync_directory("../data", dry_run="--dry-run" in sys.argv)
+    for key in ("added", "updated", "removed"):
+        for doc_id in diff[key]:
+            print(f"{key:>8}  {doc_id}")
+    print(f"unchanged: {diff['unchanged']}")
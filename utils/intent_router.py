@@ -0,0 +1,326 @@
+import json
+import logging
+import math
+import re
+from collections import Counter
+from pathlib import Path
+
+from utils.config import get_bool_setting, get_float_setting, get_int_setting
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Answer acknowledgements, off-topic requests and plain booking requests
+# locally; anything the router is unsure about goes to Claude
+INTENT_ROUTER = get_bool_setting("INTENT_ROUTER", True)
+INTENT_THRESHOLD = get_float_setting("INTENT_THRESHOLD", 0.9)
+INTENT_RULE_THRESHOLD = get_float_setting("INTENT_RULE_THRESHOLD", 0.5)
+INTENT_MAX_WORDS = get_int_setting("INTENT_MAX_WORDS", 12)
+INTENT_EXAMPLES_PATH = Path(__file__).resolve().parent.parent / "data" / "intent_examples.jsonl"
+
+ACKNOWLEDGEMENT = "acknowledgement"
+OFF_TOPIC = "off_topic"
+BOOKING = "booking"
+OTHER = "other"
+LOCAL_INTENTS = (ACKNOWLEDGEMENT, OFF_TOPIC, BOOKING)
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# A message made only of these words (with at least one core word) is an
+# acknowledgement, e.g. "ok thanks", "great, thank you so much"
+ACK_CORE_WORDS = {
+    "ok", "okay", "k", "thanks", "thank", "thx", "ty", "great", "cool", "perfect",
+    "awesome", "got", "nice", "alright", "appreciate", "appreciated", "wonderful",
+    "excellent", "helpful", "helps", "good",
+}
+ACK_FILLER_WORDS = {
+    "you", "so", "much", "very", "a", "lot", "it", "that", "that's", "sounds",
+    "for", "your", "the", "help", "info", "to", "know", "really", "again", "this",
+}
+
+BOOKING_PATTERN = re.compile(
+    r"\b(book(ing)?|schedule|make an appointment|set up (an appointment|a call)|sign me up)\b"
+)
+
+# "book" and "schedule" alone are not enough ("book a flight", "schedule a
+# meeting"): every other word of a booking request must name something the
+# clinic books or be filler, so "book me in please" qualifies but "book a
+# table for two" does not
+BOOKING_OBJECT_WORDS = {
+    "appointment", "appointments", "session", "sessions", "visit", "visits", "therapy",
+    "therapist", "physical", "physiotherapy", "physio", "pt", "consultation", "consult",
+    "evaluation", "eval", "assessment", "call", "link",
+}
+BOOKING_VERBS = {"book", "booking", "schedule"}
+BOOKING_FILLER_WORDS = {
+    "i", "i'd", "i'm", "me", "my", "you", "we", "let's", "can", "could", "would", "will",
+    "want", "like", "need", "to", "a", "an", "the", "for", "in", "up", "please", "how",
+    "where", "do", "make", "set", "sign", "book", "booking", "schedule", "get", "send",
+    "come", "first", "initial", "new",
+}
+
+# Words that tie a message to the clinic; such a message is never off-topic
+DOMAIN_WORDS = {
+    "pain", "hurt", "hurts", "injury", "injured", "knee", "back", "shoulder", "neck",
+    "hip", "ankle", "surgery", "therapy", "therapist", "therapists", "physio", "pt", "ot",
+    "exercise", "exercises", "insurance", "copay", "referral", "medicare", "medicaid",
+    "medical", "records", "doctor", "prescription", "appointment", "session", "evaluation",
+    "cost", "price", "pay", "covered", "cover", "cancel", "reschedule", "hours", "open",
+    "location", "parking", "rehab", "treatment", "clinic", "sciatica",
+    "phone", "fax", "email", "address", "park", "parked", "directions", "located",
+    "accessible", "wheelchair", "elevator", "entrance",
+}
+
+# A booking request that also asks about one of these needs a real answer
+BOOKING_QUESTION_WORDS = {
+    "insurance", "copay", "referral", "prescription", "medicare", "medicaid", "cost",
+    "price", "pay", "covered", "cover", "cancel", "reschedule", "hours", "open", "long",
+    "and", "but",
+}
+
+RESPONSES = {
+    ACKNOWLEDGEMENT: "You're welcome! Let me know if there's anything else I can help you with.",
+    OFF_TOPIC: (
+        "I'm a Physical Therapy Assistant and can only help with physical therapy, "
+        "appointments, and clinic services. Do you have any questions about your "
+        "therapy or scheduling?"
+    ),
+    BOOKING: (
+        "You can book your appointment using the link below. "
+        "Please let me know if you need any help with the booking."
+    ),
+}
+
+
+def normalize(text):
+    """Lowercase text and return its words."""
+    return WORD_PATTERN.findall(text.lower().replace("’", "'"))
+
+
+def _features(words):
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class NaiveBayesClassifier:
+    """Multinomial naive Bayes over word unigrams and bigrams."""
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.labels = []
+        self._priors = {}
+        self._counts = {}
+        self._totals = {}
+        self._vocabulary = set()
+
+    def fit(self, texts, labels):
+        self.labels = sorted(set(labels))
+        label_counts = Counter(labels)
+        self._priors = {label: math.log(label_counts[label] / len(labels)) for label in self.labels}
+        self._counts = {label: Counter() for label in self.labels}
+        for text, label in zip(texts, labels):
+            self._counts[label].update(_features(normalize(text)))
+        self._totals = {label: sum(counts.values()) for label, counts in self._counts.items()}
+        self._vocabulary = set().union(*self._counts.values()) if self._counts else set()
+        return self
+
+    def predict_proba(self, text):
+        """Return {label: probability} for text."""
+        features = [f for f in _features(normalize(text)) if f in self._vocabulary]
+        vocabulary_size = len(self._vocabulary)
+        scores = {}
+        for label in self.labels:
+            denominator = self._totals[label] + self.alpha * vocabulary_size
+            scores[label] = self._priors[label] + sum(
+                math.log((self._counts[label][f] + self.alpha) / denominator) for f in features
+            )
+
+        top = max(scores.values())
+        exp_scores = {label: math.exp(score - top) for label, score in scores.items()}
+        total = sum(exp_scores.values())
+        return {label: value / total for label, value in exp_scores.items()}
+
+
+def load_examples(path=INTENT_EXAMPLES_PATH):
+    """Load labelled {"text", "label"} examples from a JSONL file."""
+    examples = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                examples.append((entry["text"], entry["label"]))
+    return examples
+
+
+class IntentRouter:
+    """Keyword rules plus a naive Bayes classifier with confidence thresholds."""
+
+    def __init__(self, examples=None, threshold=None, rule_threshold=None):
+        self.threshold = INTENT_THRESHOLD if threshold is None else threshold
+        self.rule_threshold = INTENT_RULE_THRESHOLD if rule_threshold is None else rule_threshold
+        self.classifier = None
+
+        if examples is None:
+            try:
+                examples = load_examples()
+            except OSError as e:
+                logger.warning(f"No intent examples found, using keyword rules only: {e}")
+                examples = []
+
+        if examples:
+            texts, labels = zip(*examples)
+            self.classifier = NaiveBayesClassifier().fit(texts, labels)
+
+    def classify(self, text):
+        """Return (intent, confidence); intent is OTHER when unsure."""
+        words = normalize(text)
+        if not words or len(words) > INTENT_MAX_WORDS:
+            return OTHER, 1.0
+
+        if (
+            set(words) <= ACK_CORE_WORDS | ACK_FILLER_WORDS
+            and set(words) & ACK_CORE_WORDS
+            and "?" not in text
+        ):
+            return ACKNOWLEDGEMENT, 1.0
+
+        if self.classifier is None:
+            return OTHER, 0.0
+
+        probabilities = self.classifier.predict_proba(text)
+
+        # Booking needs the keyword rule; the classifier only has to agree
+        if BOOKING_PATTERN.search(" ".join(words)):
+            confidence = probabilities.get(BOOKING, 0.0)
+            if not set(words) <= BOOKING_OBJECT_WORDS | BOOKING_FILLER_WORDS:
+                # Booking something else ("book a flight"): judge what is being
+                # booked, since the booking verbs themselves point at the clinic
+                probabilities = self.classifier.predict_proba(
+                    " ".join(word for word in words if word not in BOOKING_VERBS)
+                )
+            elif confidence >= self.rule_threshold and not set(words) & BOOKING_QUESTION_WORDS:
+                return BOOKING, confidence
+            else:
+                return OTHER, confidence
+
+        # Acknowledgements and bookings were settled by the rules above, so
+        # what is left is off-topic against everything else
+        off_topic = probabilities.get(OFF_TOPIC, 0.0)
+        confidence = off_topic / ((off_topic + probabilities.get(OTHER, 0.0)) or 1.0)
+        if confidence < self.threshold or set(words) & DOMAIN_WORDS:
+            return OTHER, 1.0 - confidence
+        return OFF_TOPIC, confidence
+
+    def route(self, messages):
+        """Decide whether the latest user message can be answered locally.
+
+        Returns:
+            {"intent", "confidence", "text", "show_calendly"} for a local
+            answer, or None to send the turn to Claude
+        """
+        if not messages or messages[-1]["role"] != "user" or not isinstance(messages[-1]["content"], str):
+            return None
+
+        intent, confidence = self.classify(messages[-1]["content"])
+        if intent not in LOCAL_INTENTS:
+            return None
+
+        # "ok" after a question from the assistant is an answer, not a thank-you
+        previous = next((m for m in reversed(messages[:-1]) if m["role"] == "assistant"), None)
+        if (
+            intent == ACKNOWLEDGEMENT
+            and previous is not None
+            and isinstance(previous["content"], str)
+            and previous["content"].rstrip().endswith("?")
+        ):
+            return None
+
+        return {
+            "intent": intent,
+            "confidence": confidence,
+            "text": RESPONSES[intent],
+            "show_calendly": intent == BOOKING,
+        }
+
+
+_router = None
+
+
+def get_intent_router():
+    """Return the process-wide router, training it on first use."""
+    global _router
+    if _router is None:
+        _router = IntentRouter()
+    return _router
+
+
+def evaluate(examples, folds=5, threshold=None):
+    """Cross-validate the router on labelled examples.
+
+    Each fold trains the classifier on the other folds, so every example
+    is scored by a model that has not seen it.
+
+    Returns:
+        Dictionary with overall accuracy, local coverage and precision,
+        per-intent precision/recall and the misrouted examples
+    """
+    by_label = {}
+    for example in examples:
+        by_label.setdefault(example[1], []).append(example)
+    assignments = [
+        (i % folds, example)
+        for examples_for_label in by_label.values()
+        for i, example in enumerate(examples_for_label)
+    ]
+
+    predictions = []
+    for fold in range(folds):
+        train = [example for f, example in assignments if f != fold]
+        router = IntentRouter(train, threshold=threshold)
+        for f, (text, label) in assignments:
+            if f == fold:
+                predictions.append((text, label, router.classify(text)[0]))
+
+    labels = sorted(by_label)
+    per_intent = {}
+    for label in labels:
+        true_positive = sum(1 for _, gold, predicted in predictions if gold == predicted == label)
+        predicted_count = sum(1 for _, _, predicted in predictions if predicted == label)
+        gold_count = sum(1 for _, gold, _ in predictions if gold == label)
+        per_intent[label] = {
+            "precision": true_positive / predicted_count if predicted_count else 0.0,
+            "recall": true_positive / gold_count if gold_count else 0.0,
+            "support": gold_count,
+        }
+
+    local = [p for p in predictions if p[2] in LOCAL_INTENTS]
+    return {
+        "examples": len(predictions),
+        "accuracy": sum(1 for _, gold, predicted in predictions if gold == predicted) / len(predictions),
+        "local_coverage": len(local) / len(predictions),
+        "local_precision": sum(1 for _, gold, predicted in local if gold == predicted) / len(local) if local else 0.0,
+        "per_intent": per_intent,
+        "misrouted": [p for p in predictions if p[1] != p[2]],
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline accuracy report for the intent router")
+    parser.add_argument("--examples", default=str(INTENT_EXAMPLES_PATH))
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=None)
+    args = parser.parse_args()
+
+    report = evaluate(load_examples(args.examples), folds=args.folds, threshold=args.threshold)
+    print(f"examples:        {report['examples']}")
+    print(f"accuracy:        {report['accuracy']:.1%}")
+    print(f"answered locally: {report['local_coverage']:.1%} (precision {report['local_precision']:.1%})")
+    print()
+    print(f"{'intent':<16}{'precision':>10}{'recall':>10}{'support':>9}")
+    for label, scores in report["per_intent"].items():
+        print(f"{label:<16}{scores['precision']:>10.1%}{scores['recall']:>10.1%}{scores['support']:>9}")
+    if report["misrouted"]:
+        print("\nmisrouted:")
+        for text, gold, predicted in report["misrouted"]:
+            print(f"  {gold:>15} -> {predicted:<15} {text}")
@@ -1,24 +1,154 @@
 import json
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 import uuid
 
-# History file path
-HISTORY_FILE = Path("data/message_history.json")
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# History log: one JSON message per line, only ever appended to
+HISTORY_FILE = Path("data/message_history.jsonl")
+
+# Side index: one "session_id<TAB>offset<TAB>length" line per message, so a
+# single session can be read with a few seeks instead of parsing the log
+INDEX_FILE = Path("data/message_history.idx")
+
+# Exclusive lock held while appending, compacting or repairing the index
+LOCK_FILE = Path("data/message_history.lock")
+
+# Whole-file JSON history written by earlier versions; migrated on first use
+LEGACY_HISTORY_FILE = Path("data/message_history.json")
+
+_write_lock = threading.Lock()
+_index_lock = threading.Lock()
+_index_cache = {"key": None, "read": 0, "end": 0, "sessions": {}}
+
+
+@contextmanager
+def _locked():
+    """Hold an exclusive lock across threads and processes."""
+    LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with _write_lock, open(LOCK_FILE, "a+b") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        else:
+            lock.seek(0)
+            msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+            else:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
 
 
 def _ensure_history_file():
-    """Ensure the history file and directory exist."""
+    """Ensure the log and index exist, migrating a legacy JSON history once."""
+    if HISTORY_FILE.exists() and INDEX_FILE.exists():
+        return
+
+    with _locked():
+        if not HISTORY_FILE.exists():
+            messages = []
+            if LEGACY_HISTORY_FILE.exists():
+                messages = json.loads(LEGACY_HISTORY_FILE.read_text() or "[]")
+            _write_log(messages)
+        elif not INDEX_FILE.exists():
+            _repair_index()
+
+
+def _encode(message: dict) -> bytes:
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _write_log(messages: list[dict]):
+    """Atomically replace the log and index with messages (caller holds the lock)."""
     HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
-    if not HISTORY_FILE.exists():
-        HISTORY_FILE.write_text(json.dumps([]))
+    tmp_log = HISTORY_FILE.with_suffix(".jsonl.tmp")
+    tmp_index = INDEX_FILE.with_suffix(".idx.tmp")
+
+    offset = 0
+    with open(tmp_log, "wb") as log, open(tmp_index, "w") as index:
+        for message in messages:
+            line = _encode(message)
+            log.write(line)
+            index.write(f"{message.get('session_id', '')}\t{offset}\t{len(line)}\n")
+            offset += len(line)
+
+    os.replace(tmp_log, HISTORY_FILE)
+    os.replace(tmp_index, INDEX_FILE)
+
+
+def _repair_index():
+    """Index log lines that are missing from the index (caller holds the lock).
+
+    An append writes the log line first and its index line second, so a
+    crash in between leaves the index short; the tail is re-indexed here.
+    """
+    if not INDEX_FILE.exists():
+        INDEX_FILE.write_text("")
+
+    end = _load_index()["end"]
+    if end >= HISTORY_FILE.stat().st_size:
+        return
+
+    with open(HISTORY_FILE, "rb") as log, open(INDEX_FILE, "a") as index:
+        log.seek(end)
+        offset = end
+        for line in log:
+            if not line.endswith(b"\n"):
+                break  # partial write; the next append starts after it
+            try:
+                session_id = json.loads(line).get("session_id", "")
+                index.write(f"{session_id}\t{offset}\t{len(line)}\n")
+            except json.JSONDecodeError:
+                pass
+            offset += len(line)
+
+
+def _load_index() -> dict:
+    """Return the in-memory session index, reading only new index lines."""
+    try:
+        stat = INDEX_FILE.stat()
+    except FileNotFoundError:
+        return {"end": 0, "sessions": {}}
+
+    key = (stat.st_ino, stat.st_dev)
+    with _index_lock:
+        if _index_cache["key"] != key or stat.st_size < _index_cache["read"]:
+            # Replaced by compaction or cleared: start over
+            _index_cache.update(key=key, read=0, end=0, sessions={})
+
+        if stat.st_size > _index_cache["read"]:
+            with open(INDEX_FILE, "rb") as index:
+                index.seek(_index_cache["read"])
+                data = index.read(stat.st_size - _index_cache["read"])
+            complete = data[: data.rfind(b"\n") + 1]
+            for line in complete.decode("utf-8").splitlines():
+                session_id, offset, length = line.split("\t")
+                _index_cache["sessions"].setdefault(session_id, []).append((int(offset), int(length)))
+                _index_cache["end"] = max(_index_cache["end"], int(offset) + int(length))
+            _index_cache["read"] += len(complete)
+
+        return {"end": _index_cache["end"], "sessions": _index_cache["sessions"]}
 
 
 def save_message(
     role: str, content: str, show_calendly: bool = False, session_id: str = None
 ):
-    """Save a message to the history file.
+    """Append a message to the history log.
+
+    The message is written as one line under an exclusive file lock, then
+    its byte offset is recorded in the session index. Nothing already in
+    the log is read or rewritten.
 
     Args:
         role: "user" or "assistant"
@@ -28,9 +158,6 @@ def save_message(
     """
     _ensure_history_file()
 
-    # Load existing history
-    history = json.loads(HISTORY_FILE.read_text())
-
     # Create message entry with timestamp and session_id
     message = {
         "role": role,
@@ -43,38 +170,91 @@ def save_message(
     if role == "assistant":
         message["show_calendly"] = show_calendly
 
-    # Append and save
-    history.append(message)
-    HISTORY_FILE.write_text(json.dumps(history, indent=2))
+    line = _encode(message)
+    with _locked():
+        _repair_index()
+        with open(HISTORY_FILE, "a+b") as log:
+            offset = log.seek(0, os.SEEK_END)
+            if offset:
+                # Terminate a line left partial by a crashed writer
+                log.seek(offset - 1)
+                if log.read(1) != b"\n":
+                    log.write(b"\n")
+                    offset += 1
+            log.write(line)
+            log.flush()
+            os.fsync(log.fileno())
+        with open(INDEX_FILE, "a") as index:
+            index.write(f"{message['session_id']}\t{offset}\t{len(line)}\n")
+
 
+def _read_session(session_id: str) -> list[dict]:
+    """Read one session's messages at the offsets recorded in the index."""
+    for _ in range(3):
+        messages = []
+        try:
+            with open(HISTORY_FILE, "rb") as log:
+                for offset, length in _load_index()["sessions"].get(session_id, []):
+                    log.seek(offset)
+                    messages.append(json.loads(log.read(length)))
+        except json.JSONDecodeError:
+            messages = None
+        # A compaction may have replaced the log under us; retry with the new index
+        if messages is not None and all(m.get("session_id") == session_id for m in messages):
+            return messages
+    raise RuntimeError(f"Could not read session {session_id} from {HISTORY_FILE}")
 
-def load_message_history():
-    """Load all messages from history file.
+
+def load_message_history(session_id: str = None):
+    """Load messages from the history log.
+
+    Args:
+        session_id: Only load this session (read via the index); all
+            messages when omitted
 
     Returns:
-        List of message dictionaries
+        List of message dictionaries in the order they were saved
     """
     _ensure_history_file()
-    return json.loads(HISTORY_FILE.read_text())
+
+    if session_id is not None:
+        return _read_session(session_id)
+
+    messages = []
+    with open(HISTORY_FILE, "rb") as log:
+        for line in log:
+            if line.endswith(b"\n"):
+                try:
+                    messages.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return messages
 
 
-def get_api_messages_from_history():
+def get_session_ids():
+    """Return the IDs of every session in the history, oldest first."""
+    _ensure_history_file()
+    sessions = _load_index()["sessions"]
+    return sorted(sessions, key=lambda session_id: sessions[session_id][0][0])
+
+
+def get_api_messages_from_history(session_id: str = None):
     """Get messages in the format needed for Claude API (role + content only).
 
     Returns:
         List of {'role': ..., 'content': ...} dictionaries
     """
-    history = load_message_history()
+    history = load_message_history(session_id)
     return [{"role": msg["role"], "content": msg["content"]} for msg in history]
 
 
-def get_ui_messages_from_history():
+def get_ui_messages_from_history(session_id: str = None):
     """Get messages in the format needed for UI display.
 
     Returns:
         List of message dictionaries with UI metadata
     """
-    history = load_message_history()
+    history = load_message_history(session_id)
     ui_messages = []
     for msg in history:
         ui_msg = {
@@ -89,15 +269,69 @@ def get_ui_messages_from_history():
 
 def clear_history():
     """Clear all message history."""
-    _ensure_history_file()
-    HISTORY_FILE.write_text(json.dumps([]))
+    with _locked():
+        _write_log([])
 
 
-def get_message_count():
-    """Get the total number of messages in history.
+def get_message_count(session_id: str = None):
+    """Get the number of messages in history (from the index, without reading the log).
 
     Returns:
         Integer count of messages
     """
-    history = load_message_history()
-    return len(history)
+    _ensure_history_file()
+    sessions = _load_index()["sessions"]
+    if session_id is not None:
+        return len(sessions.get(session_id, []))
+    return sum(len(entries) for entries in sessions.values())
+
+
+def compact(drop_before: str = None):
+    """Rewrite the log with each session's messages stored together.
+
+    Corrupt or partial lines are dropped, and so are sessions whose last
+    message is older than drop_before (an ISO date), if given. The log and
+    index are replaced atomically while holding the writer lock.
+
+    Returns:
+        Dictionary with "sessions", "messages" and "dropped" counts
+    """
+    _ensure_history_file()
+    with _locked():
+        messages = load_message_history()
+        sessions = {}
+        for message in messages:
+            sessions.setdefault(message.get("session_id", ""), []).append(message)
+
+        dropped = 0
+        kept = []
+        for session_messages in sessions.values():
+            if drop_before and max(m.get("timestamp", "") for m in session_messages) < drop_before:
+                dropped += len(session_messages)
+                continue
+            kept.extend(session_messages)
+
+        _write_log(kept)
+
+    return {"sessions": len(sessions), "messages": len(kept), "dropped": dropped}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local message history maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subcommands.add_parser(
+        "compact", help="group messages by session and rebuild the index"
+    )
+    compact_parser.add_argument(
+        "--drop-before", help="drop sessions whose last message is older than this ISO date"
+    )
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        result = compact(args.drop_before)
+        print(
+            f"Compacted {result['messages']} messages in {result['sessions']} sessions "
+            f"({result['dropped']} dropped)"
+        )
@@ -0,0 +1,115 @@
+import logging
+import re
+
+from utils.config import get_bool_setting, get_int_setting, get_setting
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SMALL = "small"
+LARGE = "large"
+
+# Routine questions go to the small tier; anything clinical, long or
+# multi-part is escalated to the large tier
+MODEL_TIERING = get_bool_setting("MODEL_TIERING", True)
+MODEL_TIERS = {
+    SMALL: {
+        "model": get_setting("SMALL_MODEL", "claude-3-5-haiku-20241022"),
+        "max_tokens": get_int_setting("SMALL_MAX_TOKENS", 1024),
+    },
+    LARGE: {
+        "model": get_setting("LARGE_MODEL", "claude-sonnet-4-20250514"),
+        "max_tokens": get_int_setting("LARGE_MAX_TOKENS", 4096),
+    },
+}
+SMALL_TIER_MAX_WORDS = get_int_setting("SMALL_TIER_MAX_WORDS", 25)
+SMALL_TIER_MAX_TURNS = get_int_setting("SMALL_TIER_MAX_TURNS", 10)
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# Front-desk topics the knowledge base answers directly
+FAQ_WORDS = {
+    "hours", "open", "close", "closed", "saturday", "sunday", "weekend", "holiday",
+    "location", "located", "address", "where", "parking", "park", "directions",
+    "phone", "number", "fax", "email", "mail", "website", "contact", "call",
+    "bus", "train", "subway", "transit", "accessible", "accessibility", "wheelchair",
+    "elevator", "building", "entrance", "map", "parked",
+    "insurance", "accept", "take", "covered", "cover", "copay", "medicare", "medicaid",
+    "aetna", "cigna", "humana", "blue", "cross", "hsa", "fsa", "price", "cost",
+    "pricing", "rates", "fee", "fees", "payment", "pay", "walk", "walkin", "walk-ins",
+    "cancellation", "policy", "wear", "bring", "arrive", "long", "last", "book", "booking",
+}
+
+# Symptoms, conditions and treatment questions need the stronger model
+CLINICAL_WORDS = {
+    "pain", "painful", "hurt", "hurts", "hurting", "ache", "aches", "sore", "stiff",
+    "swelling", "swollen", "numb", "numbness", "tingling", "injury", "injured",
+    "surgery", "post-op", "fracture", "sprain", "strain", "torn", "tear", "sciatica",
+    "arthritis", "tendonitis", "tendinitis", "herniated", "disc", "concussion", "stroke",
+    "symptom", "symptoms", "diagnosis", "diagnosed", "treatment", "treat", "exercise",
+    "exercises", "stretch", "stretches", "recovery", "recover", "rehab", "worse",
+    "medication", "dizzy", "dizziness", "knee", "back", "shoulder", "neck", "hip", "ankle",
+    "wrist", "elbow", "spine",
+}
+
+
+def _last_user_text(messages):
+    for message in reversed(messages):
+        if message["role"] == "user" and isinstance(message["content"], str):
+            return message["content"]
+    return ""
+
+
+def _user_turns(messages):
+    return sum(1 for m in messages if m["role"] == "user" and isinstance(m["content"], str))
+
+
+def routine_question_issue(text):
+    """Return why text is not a routine front-desk question, or None if it is."""
+    words = set(WORD_PATTERN.findall(text.lower()))
+    if words & CLINICAL_WORDS:
+        return "clinical terms"
+    if len(text.split()) > SMALL_TIER_MAX_WORDS or text.count("?") > 1:
+        return "long or multi-part question"
+    if not words & FAQ_WORDS:
+        return "not a routine question"
+    return None
+
+
+def is_routine_question(text):
+    """True for a short, single, non-clinical front-desk question."""
+    return routine_question_issue(text) is None
+
+
+def choose_tier(messages, tool_calls=None):
+    """Pick the model tier for the next call of a chat turn.
+
+    The small tier is used only when every signal points to a routine
+    question: front-desk vocabulary, no clinical terms, a short single
+    question, a conversation that is still short, and at most one
+    knowledge base lookup so far this turn. Anything else escalates.
+
+    Args:
+        messages: Conversation so far, ending with the current turn
+        tool_calls: Names of the tools called earlier in this turn
+
+    Returns:
+        SMALL or LARGE
+    """
+    if not MODEL_TIERING:
+        return LARGE
+
+    tool_calls = tool_calls or []
+
+    reason = routine_question_issue(_last_user_text(messages))
+    if reason is None and _user_turns(messages) > SMALL_TIER_MAX_TURNS:
+        reason = "long conversation"
+    if reason is None and (
+        len(tool_calls) > 1 or any(name != "get_information_about_me" for name in tool_calls)
+    ):
+        reason = "several tool calls"
+    if reason is None:
+        return SMALL
+
+    logger.debug(f"Using large model tier: {reason}")
+    return LARGE
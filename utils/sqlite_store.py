@@ -0,0 +1,481 @@
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+from utils.config import get_float_setting
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SQLITE_BUSY_TIMEOUT = get_float_setting("SQLITE_BUSY_TIMEOUT", 5.0)
+
+# Schema migrations, applied in order; PRAGMA user_version records how many ran.
+# Each one runs in a single transaction together with its user_version bump.
+MIGRATIONS = [
+    """
+    create table if not exists messages (
+        message_id text primary key,
+        session_id text not null,
+        role text not null,
+        content text not null,
+        show_calendly integer not null default 0,
+        created_at text not null
+    );
+    create index if not exists messages_session_created_idx on messages (session_id, created_at);
+    create index if not exists messages_created_idx on messages (created_at);
+
+    create table if not exists api_calls (
+        id integer primary key autoincrement,
+        input_tokens integer not null default 0,
+        output_tokens integer not null default 0,
+        cache_creation_input_tokens integer not null default 0,
+        cache_read_input_tokens integer not null default 0,
+        tool_used text,
+        model text,
+        session_id text,
+        timestamp text not null
+    );
+    create index if not exists api_calls_session_timestamp_idx on api_calls (session_id, timestamp);
+    create index if not exists api_calls_timestamp_idx on api_calls (timestamp);
+    """,
+    # Per-session summary maintained on write (rebuild: python -m utils.db_manager rebuild-sessions)
+    """
+    create table if not exists sessions (
+        session_id text primary key,
+        first_message_at text,
+        last_message_at text,
+        message_count integer not null default 0,
+        show_calendly integer not null default 0,
+        preview text,
+        topics integer not null default 0,
+        api_call_count integer not null default 0,
+        input_tokens integer not null default 0,
+        output_tokens integer not null default 0,
+        cache_creation_input_tokens integer not null default 0,
+        cache_read_input_tokens integer not null default 0,
+        updated_at text not null default (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+    );
+    create index if not exists sessions_last_message_idx on sessions (last_message_at);
+    create index if not exists sessions_first_message_idx on sessions (first_message_at);
+    create index if not exists sessions_message_count_idx on sessions (message_count);
+    """,
+    # Daily token usage rollup maintained on write (rebuild: python -m utils.db_manager rebuild-rollups)
+    """
+    create table if not exists api_usage_daily (
+        day text not null,
+        tool_used text not null default '',
+        model text not null default '',
+        call_count integer not null default 0,
+        cached_calls integer not null default 0,
+        input_tokens integer not null default 0,
+        output_tokens integer not null default 0,
+        cache_creation_input_tokens integer not null default 0,
+        cache_read_input_tokens integer not null default 0,
+        updated_at text not null default (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+        primary key (day, tool_used, model)
+    );
+
+    insert or ignore into api_usage_daily (
+        day, tool_used, model, call_count, cached_calls, input_tokens, output_tokens,
+        cache_creation_input_tokens, cache_read_input_tokens
+    )
+    select
+        substr(timestamp, 1, 10), coalesce(tool_used, ''), coalesce(model, ''), count(*),
+        sum(cache_read_input_tokens > 0), sum(input_tokens), sum(output_tokens),
+        sum(cache_creation_input_tokens), sum(cache_read_input_tokens)
+    from api_calls
+    group by 1, 2, 3;
+
+    alter table sessions add column total_tokens integer
+        generated always as (input_tokens + output_tokens) virtual;
+    create index if not exists sessions_total_tokens_idx on sessions (total_tokens);
+    """,
+    # Full-text index over message content, kept in sync by triggers. messages
+    # is rebuilt with an integer primary key for the index to point at: the
+    # implicit rowid of a table without one may be renumbered by VACUUM
+    """
+    create table messages_new (
+        id integer primary key autoincrement,
+        message_id text not null unique,
+        session_id text not null,
+        role text not null,
+        content text not null,
+        show_calendly integer not null default 0,
+        created_at text not null
+    );
+    insert into messages_new (message_id, session_id, role, content, show_calendly, created_at)
+    select message_id, session_id, role, content, show_calendly, created_at
+    from messages
+    order by rowid;
+    drop table messages;
+    alter table messages_new rename to messages;
+    create index messages_session_created_idx on messages (session_id, created_at);
+    create index messages_created_idx on messages (created_at);
+
+    create virtual table messages_fts using fts5(
+        content,
+        content = 'messages',
+        content_rowid = 'id',
+        tokenize = 'porter unicode61',
+        prefix = '2 3'
+    );
+    insert into messages_fts (messages_fts) values ('rebuild');
+
+    create trigger messages_fts_insert after insert on messages begin
+        insert into messages_fts (rowid, content) values (new.id, new.content);
+    end;
+    create trigger messages_fts_delete after delete on messages begin
+        insert into messages_fts (messages_fts, rowid, content) values ('delete', old.id, old.content);
+    end;
+    create trigger messages_fts_update after update of content on messages begin
+        insert into messages_fts (messages_fts, rowid, content) values ('delete', old.id, old.content);
+        insert into messages_fts (rowid, content) values (new.id, new.content);
+    end;
+    """,
+]
+
+BOOLEAN_COLUMNS = {"show_calendly"}
+
+# Stay under SQLITE_MAX_VARIABLE_NUMBER on older SQLite builds
+MAX_QUERY_PARAMS = 500
+
+SESSION_COLUMNS = [
+    "session_id",
+    "first_message_at",
+    "last_message_at",
+    "message_count",
+    "show_calendly",
+    "preview",
+    "topics",
+    "api_call_count",
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+]
+
+# Same merge as record_session_activity() in migrations/003_sessions.sql
+RECORD_SESSION_ACTIVITY = f"""
+    insert into sessions ({", ".join(SESSION_COLUMNS)})
+    values ({", ".join("?" for _ in SESSION_COLUMNS)})
+    on conflict (session_id) do update set
+        first_message_at = min(
+            coalesce(first_message_at, excluded.first_message_at),
+            coalesce(excluded.first_message_at, first_message_at)
+        ),
+        last_message_at = max(
+            coalesce(last_message_at, excluded.last_message_at),
+            coalesce(excluded.last_message_at, last_message_at)
+        ),
+        message_count = message_count + excluded.message_count,
+        show_calendly = show_calendly or excluded.show_calendly,
+        preview = coalesce(preview, excluded.preview),
+        topics = topics | excluded.topics,
+        api_call_count = api_call_count + excluded.api_call_count,
+        input_tokens = input_tokens + excluded.input_tokens,
+        output_tokens = output_tokens + excluded.output_tokens,
+        cache_creation_input_tokens = cache_creation_input_tokens + excluded.cache_creation_input_tokens,
+        cache_read_input_tokens = cache_read_input_tokens + excluded.cache_read_input_tokens,
+        updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now')
+"""
+
+API_USAGE_COLUMNS = [
+    "day",
+    "tool_used",
+    "model",
+    "call_count",
+    "cached_calls",
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+]
+
+# Same merge as record_api_usage() in migrations/005_api_usage_rollups.sql
+RECORD_API_USAGE = f"""
+    insert into api_usage_daily ({", ".join(API_USAGE_COLUMNS)})
+    values ({", ".join("?" for _ in API_USAGE_COLUMNS)})
+    on conflict (day, tool_used, model) do update set
+        call_count = call_count + excluded.call_count,
+        cached_calls = cached_calls + excluded.cached_calls,
+        input_tokens = input_tokens + excluded.input_tokens,
+        output_tokens = output_tokens + excluded.output_tokens,
+        cache_creation_input_tokens = cache_creation_input_tokens + excluded.cache_creation_input_tokens,
+        cache_read_input_tokens = cache_read_input_tokens + excluded.cache_read_input_tokens,
+        updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now')
+"""
+
+# Sessions with a message matching an FTS5 query, best bm25 match first.
+# The FTS scan is materialized because bm25() and snippet() only work
+# there; bm25 is lower for better matches, and SQLite takes the snippet
+# from the row that supplied min(score).
+SEARCH_SESSIONS = """
+    with matches as materialized (
+        select
+            rowid,
+            bm25(messages_fts) as score,
+            snippet(messages_fts, 0, '**', '**', '…', 16) as snippet
+        from messages_fts
+        where messages_fts match ?
+    ),
+    best as (
+        select m.session_id, min(matches.score) as score, matches.snippet, count(*) as match_count
+        from matches
+        join messages m on m.id = matches.rowid
+        group by m.session_id
+    )
+    select s.*, -best.score as rank, best.match_count, best.snippet
+    from best
+    join sessions s on s.session_id = best.session_id
+    order by best.score, best.match_count desc, s.session_id
+    limit ? offset ?
+"""
+
+
+def fts5_query(terms: list[dict]) -> str:
+    """Render parsed search terms as an FTS5 query (every term required)."""
+    parts = []
+    for term in terms:
+        part = '"' + " ".join(term["words"]) + '"'
+        parts.append(part + "*" if term["prefix"] else part)
+    return " AND ".join(parts)
+
+
+class SQLiteStore:
+    """Message and API-call storage in a local SQLite database.
+
+    The database runs in WAL mode so the chat app and the dashboard can
+    read while the write-behind thread inserts. Each thread gets its own
+    connection.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._init_lock = threading.RLock()
+        self._initialized = False
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT)
+            connection.row_factory = sqlite3.Row
+            connection.execute("pragma journal_mode = wal")
+            connection.execute("pragma synchronous = normal")
+            connection.execute("pragma foreign_keys = on")
+            self._local.connection = connection
+            self.initialize()
+        return connection
+
+    def initialize(self):
+        """Create or upgrade the schema."""
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            connection = self.connection
+            version = connection.execute("pragma user_version").fetchone()[0]
+            for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                # executescript() commits on its own, so the transaction is
+                # spelled out to keep a failed migration from half-applying
+                try:
+                    connection.executescript(
+                        f"begin;\n{script}\npragma user_version = {number};\ncommit;"
+                    )
+                except Exception:
+                    if connection.in_transaction:
+                        connection.rollback()
+                    raise
+                logger.info(f"SQLite schema migrated to version {number}")
+            self._initialized = True
+
+    def reset(self):
+        """Close this thread's connection so the next call reopens it."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        data = dict(row)
+        for column in BOOLEAN_COLUMNS & data.keys():
+            data[column] = bool(data[column])
+        return data
+
+    def query(self, sql: str, params=()) -> list[dict]:
+        """Run a read query and return the rows as dictionaries."""
+        return [self._to_dict(row) for row in self.connection.execute(sql, params)]
+
+    def insert(self, table: str, rows: list[dict]):
+        """Insert rows in one transaction."""
+        if not rows:
+            return
+        columns = list(rows[0].keys())
+        sql = (
+            f"insert into {table} ({', '.join(columns)}) "
+            f"values ({', '.join('?' for _ in columns)})"
+        )
+        with self.connection as connection:
+            connection.executemany(sql, [tuple(row.get(c) for c in columns) for row in rows])
+
+    def select(
+        self,
+        table: str,
+        columns: str = "*",
+        eq: dict = None,
+        gt: dict = None,
+        order: str = None,
+        desc: bool = False,
+        limit: int = None,
+        offset: int = 0,
+        gte: dict = None,
+        lte: dict = None,
+    ) -> list[dict]:
+        """Return rows matching every eq/gt/gte/lte filter, optionally ordered and paged."""
+        where, params = self._where(eq, gt, gte, lte)
+        sql = f"select {columns} from {table}{where}"
+        if order:
+            sql += f" order by {order} {'desc' if desc else 'asc'}"
+        if limit is not None:
+            sql += " limit ? offset ?"
+            params.extend([limit, offset])
+        return self.query(sql, params)
+
+    def select_page(
+        self,
+        table: str,
+        sort: str,
+        key: str,
+        desc: bool = False,
+        after: tuple = None,
+        limit: int = 25,
+        gt: dict = None,
+    ) -> list[dict]:
+        """Return one keyset page ordered by (sort, key).
+
+        Args:
+            after: (sort value, key value) of the last row of the previous
+                page; the first page when omitted
+        """
+        where, params = self._where(gt=gt)
+        if after is not None:
+            op = "<" if desc else ">"
+            where += " and " if where else " where "
+            where += f"({sort} {op} ? or ({sort} = ? and {key} {op} ?))"
+            params.extend([after[0], after[0], after[1]])
+        direction = "desc" if desc else "asc"
+        sql = f"select * from {table}{where} order by {sort} {direction}, {key} {direction} limit ?"
+        return self.query(sql, params + [limit])
+
+    def count(self, table: str, eq: dict = None, gt: dict = None) -> int:
+        """Count rows matching every eq/gt filter."""
+        where, params = self._where(eq, gt)
+        return self.connection.execute(f"select count(*) from {table}{where}", params).fetchone()[0]
+
+    @staticmethod
+    def _where(eq: dict = None, gt: dict = None, gte: dict = None, lte: dict = None):
+        conditions, params = [], []
+        for op, filters in (("=", eq), (">", gt), (">=", gte), ("<=", lte)):
+            for column, value in (filters or {}).items():
+                conditions.append(f"{column} {op} ?")
+                params.append(value)
+        return (" where " + " and ".join(conditions) if conditions else ""), params
+
+    def delete(self, table: str, eq: dict):
+        """Delete rows matching every eq filter."""
+        where, params = self._where(eq)
+        with self.connection as connection:
+            connection.execute(f"delete from {table}{where}", params)
+
+    def token_totals(self, session_ids: list[str]) -> list[dict]:
+        """Sum API-call tokens per session for a list of sessions in one grouped query."""
+        if len(session_ids) > MAX_QUERY_PARAMS:
+            return [
+                row
+                for start in range(0, len(session_ids), MAX_QUERY_PARAMS)
+                for row in self.token_totals(session_ids[start : start + MAX_QUERY_PARAMS])
+            ]
+        if not session_ids:
+            return []
+        placeholders = ", ".join("?" for _ in session_ids)
+        return self.query(
+            f"""
+            select session_id,
+                   count(*) as api_call_count,
+                   coalesce(sum(input_tokens), 0) as input_tokens,
+                   coalesce(sum(output_tokens), 0) as output_tokens,
+                   coalesce(sum(cache_creation_input_tokens), 0) as cache_creation_input_tokens,
+                   coalesce(sum(cache_read_input_tokens), 0) as cache_read_input_tokens
+            from api_calls
+            where session_id in ({placeholders})
+            group by session_id
+            """,
+            list(session_ids),
+        )
+
+    def opening_messages(self, session_ids: list[str], per_session: int = 2) -> list[dict]:
+        """Return the first per_session messages of each session in one query."""
+        if len(session_ids) > MAX_QUERY_PARAMS:
+            return [
+                row
+                for start in range(0, len(session_ids), MAX_QUERY_PARAMS)
+                for row in self.opening_messages(session_ids[start : start + MAX_QUERY_PARAMS], per_session)
+            ]
+        if not session_ids:
+            return []
+        placeholders = ", ".join("?" for _ in session_ids)
+        return self.query(
+            f"""
+            select * from (
+                select *, row_number() over (partition by session_id order by created_at, id) as position
+                from messages
+                where session_id in ({placeholders})
+            )
+            where position <= ?
+            order by session_id, position
+            """,
+            [*session_ids, per_session],
+        )
+
+    def search_sessions(self, terms: list[dict], limit: int, offset: int = 0) -> list[dict]:
+        """Rank sessions by their best FTS5 match, with a highlighted snippet."""
+        return self.query(SEARCH_SESSIONS, [fts5_query(terms), limit, offset])
+
+    def record_session_activity(self, activity: list[dict]):
+        """Add per-session deltas to the sessions summary in one transaction."""
+        with self.connection as connection:
+            connection.executemany(
+                RECORD_SESSION_ACTIVITY,
+                [tuple(row.get(c) for c in SESSION_COLUMNS) for row in activity],
+            )
+
+    def replace_sessions(self, sessions: list[dict]):
+        """Replace the whole sessions summary (used by the rebuild job)."""
+        with self.connection as connection:
+            connection.execute("delete from sessions")
+            connection.executemany(
+                RECORD_SESSION_ACTIVITY,
+                [tuple(row.get(c) for c in SESSION_COLUMNS) for row in sessions],
+            )
+
+    def record_api_usage(self, usage: list[dict]):
+        """Add daily usage deltas to the api_usage_daily rollup in one transaction."""
+        with self.connection as connection:
+            connection.executemany(
+                RECORD_API_USAGE,
+                [tuple(row.get(c) for c in API_USAGE_COLUMNS) for row in usage],
+            )
+
+    def replace_api_usage(self, usage: list[dict]):
+        """Replace the whole api_usage_daily rollup (used by the rebuild job)."""
+        with self.connection as connection:
+            connection.execute("delete from api_usage_daily")
+            connection.executemany(
+                RECORD_API_USAGE,
+                [tuple(row.get(c) for c in API_USAGE_COLUMNS) for row in usage],
+            )
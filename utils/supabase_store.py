@@ -0,0 +1,208 @@
+import json
+import logging
+import threading
+
+import httpx
+from supabase import create_client, Client, ClientOptions
+
+from utils.config import get_setting, get_int_setting, get_float_setting
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Connection pool settings (secrets or environment)
+SUPABASE_POOL_SIZE = get_int_setting("SUPABASE_POOL_SIZE", 10)
+SUPABASE_TIMEOUT = get_float_setting("SUPABASE_TIMEOUT", 10.0)
+SUPABASE_KEEPALIVE_EXPIRY = get_float_setting("SUPABASE_KEEPALIVE_EXPIRY", 30.0)
+
+
+def tsquery(terms: list[dict]) -> str:
+    """Render parsed search terms as a Postgres to_tsquery() string (every term required)."""
+    parts = []
+    for term in terms:
+        words = list(term["words"])
+        if term["prefix"]:
+            words[-1] += ":*"
+        parts.append("(" + " <-> ".join(words) + ")" if len(words) > 1 else words[0])
+    return " & ".join(parts)
+
+
+class SupabaseStore:
+    """Message and API-call storage in Supabase (PostgREST).
+
+    The client and its keep-alive connection pool are created on first use
+    and shared by every Streamlit script thread; httpx clients are safe to
+    share across threads.
+    """
+
+    def __init__(self, url: str = None, key: str = None):
+        self.url = url
+        self.key = key
+        self._client = None
+        self._http_client = None
+        self._lock = threading.Lock()
+
+    def _create_pooled_client(self) -> Client:
+        """Create a Supabase client backed by a keep-alive httpx connection pool."""
+        url = self.url or get_setting("SUPABASE_URL")
+        key = self.key or get_setting("SUPABASE_KEY")
+        if not url or not key:
+            raise RuntimeError("SUPABASE_URL and SUPABASE_KEY must be set to use the Supabase backend")
+
+        self._http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=SUPABASE_POOL_SIZE,
+                max_keepalive_connections=SUPABASE_POOL_SIZE,
+                keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(SUPABASE_TIMEOUT),
+        )
+        options = ClientOptions(
+            postgrest_client_timeout=SUPABASE_TIMEOUT,
+            httpx_client=self._http_client,
+        )
+
+        logger.info(
+            f"Creating Supabase client - pool size: {SUPABASE_POOL_SIZE}, timeout: {SUPABASE_TIMEOUT}s"
+        )
+        client = create_client(url, key, options=options)
+
+        # Build the PostgREST client now so threads never race on its lazy init
+        client.postgrest
+        return client
+
+    @property
+    def client(self) -> Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create_pooled_client()
+        return self._client
+
+    def reset(self):
+        """Close the connection pool so the next call reconnects."""
+        with self._lock:
+            if self._http_client is not None:
+                try:
+                    self._http_client.close()
+                except Exception as e:
+                    logger.error(f"Error closing Supabase connection pool: {e}")
+            self._client = None
+            self._http_client = None
+
+    def initialize(self):
+        """Supabase manages the schema (see migrations/)."""
+        pass
+
+    def insert(self, table: str, rows: list[dict]):
+        """Insert rows with a single multi-row request."""
+        self.client.table(table).insert(rows).execute()
+
+    def select(
+        self,
+        table: str,
+        columns: str = "*",
+        eq: dict = None,
+        gt: dict = None,
+        order: str = None,
+        desc: bool = False,
+        limit: int = None,
+        offset: int = 0,
+        gte: dict = None,
+        lte: dict = None,
+    ) -> list[dict]:
+        """Return rows matching every eq/gt/gte/lte filter, optionally ordered and paged."""
+        query = self._filtered(self.client.table(table).select(columns), eq, gt, gte, lte)
+        if order:
+            query = query.order(order, desc=desc)
+        if limit is not None:
+            query = query.range(offset, offset + limit - 1)
+        response = query.execute()
+        return response.data or []
+
+    def select_page(
+        self,
+        table: str,
+        sort: str,
+        key: str,
+        desc: bool = False,
+        after: tuple = None,
+        limit: int = 25,
+        gt: dict = None,
+    ) -> list[dict]:
+        """Return one keyset page ordered by (sort, key).
+
+        Args:
+            after: (sort value, key value) of the last row of the previous
+                page; the first page when omitted
+        """
+        query = self._filtered(self.client.table(table).select("*"), gt=gt)
+        if after is not None:
+            op = "lt" if desc else "gt"
+            value, last_key = (json.dumps(str(v)) for v in after)
+            query = query.or_(f"{sort}.{op}.{value},and({sort}.eq.{value},{key}.{op}.{last_key})")
+        response = query.order(sort, desc=desc).order(key, desc=desc).limit(limit).execute()
+        return response.data or []
+
+    def count(self, table: str, eq: dict = None, gt: dict = None) -> int:
+        """Count rows matching every eq/gt filter without fetching them."""
+        query = self.client.table(table).select("*", count="exact", head=True)
+        return self._filtered(query, eq, gt).execute().count or 0
+
+    @staticmethod
+    def _filtered(query, eq: dict = None, gt: dict = None, gte: dict = None, lte: dict = None):
+        for op, filters in (("eq", eq), ("gt", gt), ("gte", gte), ("lte", lte)):
+            for column, value in (filters or {}).items():
+                query = getattr(query, op)(column, value)
+        return query
+
+    def delete(self, table: str, eq: dict):
+        """Delete rows matching every eq filter."""
+        self._filtered(self.client.table(table).delete(), eq).execute()
+
+    def token_totals(self, session_ids: list[str]) -> list[dict]:
+        """Sum API-call tokens per session for a list of sessions in one grouped RPC."""
+        if not session_ids:
+            return []
+        response = self.client.rpc(
+            "token_totals_by_sessions", {"session_ids": list(session_ids)}
+        ).execute()
+        return response.data or []
+
+    def opening_messages(self, session_ids: list[str], per_session: int = 2) -> list[dict]:
+        """Return the first per_session messages of each session in one RPC."""
+        if not session_ids:
+            return []
+        response = self.client.rpc(
+            "opening_messages_by_sessions",
+            {"session_ids": list(session_ids), "per_session": per_session},
+        ).execute()
+        return response.data or []
+
+    def search_sessions(self, terms: list[dict], limit: int, offset: int = 0) -> list[dict]:
+        """Rank sessions by their best full-text match, with a highlighted snippet."""
+        response = self.client.rpc(
+            "search_sessions",
+            {"search_query": tsquery(terms), "page_size": limit, "page_offset": offset},
+        ).execute()
+        return response.data or []
+
+    def record_session_activity(self, activity: list[dict]):
+        """Add per-session deltas to the sessions summary in one atomic RPC."""
+        self.client.rpc("record_session_activity", {"activity": activity}).execute()
+
+    def replace_sessions(self, sessions: list[dict], chunk_size: int = 500):
+        """Replace the whole sessions summary (used by the rebuild job)."""
+        self.client.table("sessions").delete().neq("session_id", "").execute()
+        for start in range(0, len(sessions), chunk_size):
+            self.client.table("sessions").insert(sessions[start : start + chunk_size]).execute()
+
+    def record_api_usage(self, usage: list[dict]):
+        """Add daily usage deltas to the api_usage_daily rollup in one atomic RPC."""
+        self.client.rpc("record_api_usage", {"usage": usage}).execute()
+
+    def replace_api_usage(self, usage: list[dict], chunk_size: int = 500):
+        """Replace the whole api_usage_daily rollup (used by the rebuild job)."""
+        self.client.table("api_usage_daily").delete().gte("call_count", 0).execute()
+        for start in range(0, len(usage), chunk_size):
+            self.client.table("api_usage_daily").insert(usage[start : start + chunk_size]).execute()
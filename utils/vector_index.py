@@ -0,0 +1,376 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+
+def default_embedding_function():
+    """Return Chroma's bundled local embedding model (all-MiniLM-L6-v2, ONNX)."""
+    from chromadb.utils import embedding_functions
+
+    return embedding_functions.DefaultEmbeddingFunction()
+
+
+def _matches(metadata, where):
+    """Evaluate a simple Chroma-style filter such as {"source": "a.txt"} ($eq, $ne, $in, $and)."""
+    if not where:
+        return True
+    metadata = metadata or {}
+    for key, expected in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, clause) for clause in expected):
+                return False
+        elif isinstance(expected, dict) and "$eq" in expected:
+            if metadata.get(key) != expected["$eq"]:
+                return False
+        elif isinstance(expected, dict) and "$ne" in expected:
+            if metadata.get(key) == expected["$ne"]:
+                return False
+        elif isinstance(expected, dict) and "$in" in expected:
+            if metadata.get(key) not in expected["$in"]:
+                return False
+        elif metadata.get(key) != expected:
+            return False
+    return True
+
+
+class LocalCollection:
+    """A Chroma-compatible collection stored on local disk.
+
+    Embeddings live in a float32 matrix file that is memory-mapped for
+    queries; ids, documents and metadata live in index.json next to it.
+    Every write produces a new matrix file and atomically replaces
+    index.json, so readers in other processes never see a half-written
+    index and pick up the change on their next call (hot reload).
+    """
+
+    def __init__(self, directory, name, embedding_function=None):
+        self.name = name
+        self.directory = Path(directory) / name
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.directory / "index.json"
+        self._embedding_function = embedding_function
+        self._lock = threading.RLock()
+        self._loaded_stat = None
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._collection_metadata = None
+        self._embeddings = np.zeros((0, 0), dtype=np.float32)
+        self._embeddings_file = None
+        self._reload_if_changed()
+
+    # ------------------------------------------------------------------
+    # Loading and saving
+    # ------------------------------------------------------------------
+    def _reload_if_changed(self):
+        """Reload from disk if another writer replaced index.json."""
+        try:
+            stat = os.stat(self.index_path)
+            current = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            current = None
+
+        if current == self._loaded_stat:
+            return
+
+        with self._lock:
+            if current is None:
+                self._loaded_stat = None
+                return
+
+            for attempt in range(3):
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+
+                count = len(index["ids"])
+                dim = index.get("dim") or 0
+                embeddings = np.zeros((0, dim), dtype=np.float32)
+                try:
+                    if count and dim:
+                        embeddings = np.memmap(
+                            self.directory / index["embeddings_file"],
+                            dtype=np.float32,
+                            mode="r",
+                            shape=(count, dim),
+                        )
+                    break
+                except FileNotFoundError:
+                    # A writer replaced the index between our two reads; retry
+                    stat = os.stat(self.index_path)
+                    current = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            else:
+                raise RuntimeError(f"Could not load local vector index '{self.name}'")
+
+            self._ids = index["ids"]
+            self._documents = index["documents"]
+            self._metadatas = index["metadatas"]
+            self._collection_metadata = index.get("collection_metadata")
+            self._embeddings = embeddings
+            self._embeddings_file = index.get("embeddings_file")
+            self._loaded_stat = current
+            logging.debug(f"Loaded local vector index '{self.name}' ({count} documents)")
+
+    def _save(self, ids, documents, metadatas, embeddings, collection_metadata):
+        """Write a new matrix file, then atomically swap in index.json."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        embeddings_file = None
+        if len(ids):
+            embeddings_file = f"embeddings-{uuid.uuid4().hex}.f32"
+            embeddings.tofile(self.directory / embeddings_file)
+
+        index = {
+            "ids": ids,
+            "documents": documents,
+            "metadatas": metadatas,
+            "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+            "embeddings_file": embeddings_file,
+            "collection_metadata": collection_metadata,
+        }
+        tmp_path = self.index_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+        # Readers that still map the old file keep it alive until they reload
+        for path in self.directory.glob("embeddings-*.f32"):
+            if path.name != embeddings_file:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+        self._loaded_stat = None
+        self._reload_if_changed()
+
+    # ------------------------------------------------------------------
+    # Embedding helpers
+    # ------------------------------------------------------------------
+    def _embed(self, texts):
+        if self._embedding_function is None:
+            self._embedding_function = default_embedding_function()
+        vectors = np.asarray(self._embedding_function(list(texts)), dtype=np.float32)
+        return self._normalize(vectors)
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    # ------------------------------------------------------------------
+    # Chroma collection API
+    # ------------------------------------------------------------------
+    @property
+    def metadata(self):
+        self._reload_if_changed()
+        return self._collection_metadata
+
+    def count(self):
+        self._reload_if_changed()
+        return len(self._ids)
+
+    def modify(self, name=None, metadata=None):
+        with self._lock:
+            self._reload_if_changed()
+            self._save(
+                list(self._ids),
+                list(self._documents),
+                list(self._metadatas),
+                np.array(self._embeddings),
+                metadata,
+            )
+
+    def upsert(self, ids, documents, metadatas=None, embeddings=None):
+        """Insert new documents or replace existing ones with the same IDs."""
+        if isinstance(ids, str):
+            ids, documents = [ids], [documents]
+            metadatas = [metadatas] if isinstance(metadatas, dict) else metadatas
+        metadatas = metadatas or [None] * len(ids)
+
+        vectors = (
+            self._normalize(embeddings) if embeddings is not None else self._embed(documents)
+        )
+
+        with self._lock:
+            self._reload_if_changed()
+            all_ids = list(self._ids)
+            all_documents = list(self._documents)
+            all_metadatas = list(self._metadatas)
+            matrix = np.array(self._embeddings)
+            if matrix.size == 0:
+                matrix = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+
+            positions = {doc_id: i for i, doc_id in enumerate(all_ids)}
+            new_rows = []
+            for i, doc_id in enumerate(ids):
+                if doc_id in positions:
+                    row = positions[doc_id]
+                    all_documents[row] = documents[i]
+                    all_metadatas[row] = metadatas[i]
+                    matrix[row] = vectors[i]
+                else:
+                    positions[doc_id] = len(all_ids)
+                    all_ids.append(doc_id)
+                    all_documents.append(documents[i])
+                    all_metadatas.append(metadatas[i])
+                    new_rows.append(vectors[i])
+
+            if new_rows:
+                matrix = np.vstack([matrix, np.stack(new_rows)])
+
+            self._save(all_ids, all_documents, all_metadatas, matrix, self._collection_metadata)
+
+    def add(self, ids, documents, metadatas=None, embeddings=None):
+        """Add documents, skipping IDs that already exist (as Chroma does)."""
+        if isinstance(ids, str):
+            ids, documents = [ids], [documents]
+            metadatas = [metadatas] if isinstance(metadatas, dict) else metadatas
+        self._reload_if_changed()
+        existing = set(self._ids)
+        keep = [i for i, doc_id in enumerate(ids) if doc_id not in existing]
+        if not keep:
+            return
+        self.upsert(
+            [ids[i] for i in keep],
+            [documents[i] for i in keep],
+            [metadatas[i] for i in keep] if metadatas else None,
+            [embeddings[i] for i in keep] if embeddings is not None else None,
+        )
+
+    def update(self, ids, documents=None, metadatas=None, embeddings=None):
+        """Update existing documents; metadata is kept unless new metadata is given."""
+        if isinstance(ids, str):
+            ids = [ids]
+            documents = [documents] if isinstance(documents, str) else documents
+            metadatas = [metadatas] if isinstance(metadatas, dict) else metadatas
+
+        self._reload_if_changed()
+        positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        known = [i for i, doc_id in enumerate(ids) if doc_id in positions]
+        if not known:
+            return
+
+        self.upsert(
+            [ids[i] for i in known],
+            [documents[i] if documents else self._documents[positions[ids[i]]] for i in known],
+            [metadatas[i] if metadatas else self._metadatas[positions[ids[i]]] for i in known],
+            [embeddings[i] for i in known] if embeddings is not None else None,
+        )
+
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            self._reload_if_changed()
+            remove = set(ids or [])
+            if where:
+                remove.update(
+                    doc_id
+                    for doc_id, metadata in zip(self._ids, self._metadatas)
+                    if _matches(metadata, where)
+                )
+            keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in remove]
+            if len(keep) == len(self._ids):
+                return
+
+            self._save(
+                [self._ids[i] for i in keep],
+                [self._documents[i] for i in keep],
+                [self._metadatas[i] for i in keep],
+                np.array(self._embeddings)[keep] if keep else np.zeros((0, 0), dtype=np.float32),
+                self._collection_metadata,
+            )
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=None):
+        self._reload_if_changed()
+        wanted = set(ids) if ids else None
+        rows = [
+            i
+            for i, doc_id in enumerate(self._ids)
+            if (wanted is None or doc_id in wanted) and _matches(self._metadatas[i], where)
+        ]
+        rows = rows[offset or 0:]
+        if limit is not None:
+            rows = rows[:limit]
+
+        return {
+            "ids": [self._ids[i] for i in rows],
+            "documents": [self._documents[i] for i in rows],
+            "metadatas": [self._metadatas[i] for i in rows],
+        }
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10, where=None, include=None):
+        """Return the top n_results documents per query by cosine similarity.
+
+        All queries are scored in one matrix product against the
+        memory-mapped embeddings. Distances are cosine distances (1 - cos).
+        """
+        self._reload_if_changed()
+        if query_embeddings is not None:
+            queries = self._normalize(query_embeddings)
+        else:
+            if isinstance(query_texts, str):
+                query_texts = [query_texts]
+            queries = self._embed(query_texts)
+
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        embeddings = self._embeddings
+        candidates = np.arange(len(self._ids))
+        if where:
+            candidates = np.array(
+                [i for i in candidates if _matches(self._metadatas[i], where)], dtype=int
+            )
+
+        if len(candidates) == 0:
+            for _ in range(len(queries)):
+                for key in result:
+                    result[key].append([])
+            return result
+
+        scores = queries @ np.asarray(embeddings[candidates]).T
+        k = min(n_results, len(candidates))
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top])]
+            rows = candidates[top]
+            result["ids"].append([self._ids[i] for i in rows])
+            result["documents"].append([self._documents[i] for i in rows])
+            result["metadatas"].append([self._metadatas[i] for i in rows])
+            result["distances"].append([float(1.0 - row[j]) for j in top])
+
+        return result
+
+
+class LocalVectorClient:
+    """Minimal stand-in for a Chroma client backed by LocalCollection files."""
+
+    def __init__(self, path, embedding_function=None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._embedding_function = embedding_function
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def get_or_create_collection(self, name, **kwargs):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = LocalCollection(
+                    self.path, name, self._embedding_function
+                )
+            return self._collections[name]
+
+    def get_collection(self, name, **kwargs):
+        if not (self.path / name / "index.json").exists() and name not in self._collections:
+            raise ValueError(f"Collection {name} does not exist")
+        return self.get_or_create_collection(name)
+
+    def heartbeat(self):
+        return 1
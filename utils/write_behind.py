@@ -0,0 +1,262 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Buffer database rows and write them in batches from a background thread.
+
+    Rows are grouped per table and handed to ``flush_fn(table, rows)`` as one
+    multi-row insert. A batch is flushed when ``batch_size`` rows are waiting
+    or ``flush_interval`` seconds have passed, and once more on shutdown.
+    Rows that cannot be queued (queue full) or written (insert failed) are
+    appended to a local JSONL spill file and replayed on a later flush.
+
+    Each spilled row counts its failed attempts and waits exponentially
+    longer before the next one, starting at ``retry_delay`` seconds and
+    capped at ``max_retry_delay``. A row still failing after
+    ``max_attempts`` is moved to a quarantine file next to the spill file
+    and no longer retried.
+    """
+
+    def __init__(
+        self,
+        flush_fn,
+        max_queue_size: int = 1000,
+        batch_size: int = 50,
+        flush_interval: float = 2.0,
+        spill_path: Path = Path("data/pending_writes.jsonl"),
+        max_attempts: int = 10,
+        retry_delay: float = 30.0,
+        max_retry_delay: float = 3600.0,
+    ):
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = Path(spill_path)
+        self.quarantine_path = self.spill_path.with_suffix(".quarantine.jsonl")
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        # Earliest time a spilled row is due; 0 replays any spill left by a
+        # previous run on the first flush
+        self._next_replay = 0.0
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._flush_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind-flusher", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, table: str, row: dict):
+        """Queue a row for insertion without blocking the caller.
+
+        Args:
+            table: Destination table name
+            row: Column values for the new row
+        """
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            logger.warning(f"Write-behind queue full, spilling {table} row to disk")
+            self._spill([(table, row)])
+
+    def pending(self) -> int:
+        """Return the number of rows waiting in memory."""
+        return self._queue.qsize()
+
+    def flush(self):
+        """Write every queued row now, then retry spilled rows that are due."""
+        with self._flush_lock:
+            items = self._drain(limit=None)
+            if items:
+                self._write(items)
+            self._replay_spill()
+
+    def close(self):
+        """Stop the flush thread and write out whatever is still queued."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            items = self._collect_batch()
+            with self._flush_lock:
+                if items:
+                    self._write(items)
+                self._replay_spill()
+
+    def _collect_batch(self) -> list:
+        """Wait until batch_size rows are queued or flush_interval elapses."""
+        deadline = time.monotonic() + self.flush_interval
+        items = []
+
+        while len(items) < self.batch_size and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return items
+
+    def _drain(self, limit=None) -> list:
+        items = []
+        while limit is None or len(items) < limit:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _write(self, items: list):
+        """Insert items grouped by table, spilling any group that fails."""
+        for table, rows, error in self._insert(items):
+            logger.error(f"Error flushing {len(rows)} {table} rows, spilling to disk: {error}")
+            self._spill([(table, row) for row in rows])
+
+    def _insert(self, items: list) -> list:
+        """Insert items grouped by table.
+
+        Returns:
+            (table, rows, error) for each group that failed
+        """
+        by_table = {}
+        for table, row in items:
+            by_table.setdefault(table, []).append(row)
+
+        failed = []
+        for table, rows in by_table.items():
+            start = time.perf_counter()
+            try:
+                self.flush_fn(table, rows)
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                logger.info(f"Flushed {len(rows)} {table} rows in {elapsed_ms:.0f} ms")
+            except Exception as e:
+                failed.append((table, rows, e))
+        return failed
+
+    def _retry_at(self, attempts: int) -> float:
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        return time.time() + delay
+
+    def _spill(self, items: list, attempts: int = 1):
+        self._spill_entries(
+            [
+                {"table": table, "row": row, "attempts": attempts, "next_attempt": self._retry_at(attempts)}
+                for table, row in items
+            ]
+        )
+
+    def _spill_entries(self, entries: list):
+        if not entries:
+            return
+        with self._spill_lock:
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.spill_path, "a") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+            self._next_replay = min(self._next_replay, min(e["next_attempt"] for e in entries))
+
+    def _quarantine(self, entries: list, error: Exception):
+        with self._spill_lock:
+            with open(self.quarantine_path, "a") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+        logger.error(
+            f"Giving up on {len(entries)} {entries[0]['table']} rows after {self.max_attempts} attempts, "
+            f"moved to {self.quarantine_path} (append them to {self.spill_path} to retry): {error}"
+        )
+
+    def _replay_spill(self):
+        """Retry spilled rows that are due; failures back off or are quarantined.
+
+        A failed batch is retried row by row so one bad row does not hold
+        back, or get quarantined with, the rows around it.
+        """
+        replay_path = self.spill_path.with_suffix(".replaying")
+        with self._spill_lock:
+            # A leftover replay file means a previous replay was interrupted
+            if not replay_path.exists():
+                if not self.spill_path.exists() or time.time() < self._next_replay:
+                    return
+                os.replace(self.spill_path, replay_path)
+            self._next_replay = float("inf")
+
+        due, waiting = [], []
+        now = time.time()
+        with open(replay_path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                    if not isinstance(entry, dict) or not {"table", "row"} <= entry.keys():
+                        raise ValueError("missing table or row")
+                except ValueError as e:
+                    logger.error(f"Skipping corrupt spill entry: {e}")
+                    continue
+                # Entries spilled before attempts were tracked are due now
+                entry.setdefault("attempts", 1)
+                (due if entry.get("next_attempt", 0) <= now else waiting).append(entry)
+
+        if due:
+            logger.info(f"Replaying {len(due)} spilled rows ({len(waiting)} waiting to retry)")
+            by_table = {}
+            for entry in due:
+                by_table.setdefault(entry["table"], []).append(entry)
+            for table, rows, error in self._insert([(e["table"], e["row"]) for e in due]):
+                entries = by_table[table]
+                if len(entries) > 1:
+                    failures = []
+                    for entry in entries:
+                        try:
+                            self.flush_fn(table, [entry["row"]])
+                        except Exception as e:
+                            failures.append((entry, e))
+                else:
+                    failures = [(entries[0], error)]
+                if len(failures) < len(entries):
+                    logger.info(f"Replayed {len(entries) - len(failures)} {table} rows one by one")
+
+                retry, give_up = [], []
+                for entry, entry_error in failures:
+                    entry["attempts"] += 1
+                    entry["error"] = str(entry_error)
+                    if entry["attempts"] >= self.max_attempts:
+                        give_up.append(entry)
+                    else:
+                        entry["next_attempt"] = self._retry_at(entry["attempts"])
+                        retry.append(entry)
+                if retry:
+                    logger.warning(
+                        f"{len(retry)} spilled {table} rows failed again, retrying with backoff: {error}"
+                    )
+                waiting.extend(retry)
+                if give_up:
+                    self._quarantine(give_up, error)
+
+        self._spill_entries(waiting)
+        if not waiting:
+            # Pick up rows spilled meanwhile or appended back by hand
+            self._next_replay = 0.0
+        replay_path.unlink()